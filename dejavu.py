@@ -39,6 +39,12 @@ if __name__ == '__main__':
                              'Usages: \n'
                              '--fingerprint /path/to/directory extension\n'
                              '--fingerprint /path/to/directory')
+    parser.add_argument('-j', '--job', nargs='?',
+                        help='Journal of a resumable ingestion job, used when\n'
+                             'fingerprinting a directory. Running the same job\n'
+                             'again skips the files it already committed.\n'
+                             'Usages: \n'
+                             '--job /path/to/journal.sqlite\n')
     parser.add_argument('-r', '--recognize', nargs=2,
                         help='Recognize what is '
                              'playing through the microphone or in a file.\n'
@@ -62,7 +68,7 @@ if __name__ == '__main__':
             directory = args.fingerprint[0]
             extension = args.fingerprint[1]
             print(f"Fingerprinting all .{extension} files in the {directory} directory")
-            djv.fingerprint_directory(directory, ["." + extension], 4)
+            djv.fingerprint_directory(directory, ["." + extension], 4, job=args.job)
 
         elif len(args.fingerprint) == 1:
             filepath = args.fingerprint[0]
@@ -1,31 +1,60 @@
+import math
 import multiprocessing
 import os
 import sys
 import traceback
-from itertools import groupby
+from hashlib import sha1
+from multiprocessing.pool import Pool
 from time import time
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Union
+
+import numpy as np
 
 import dejavu.logic.decoder as decoder
 from dejavu.base_classes.base_database import get_database
-from dejavu.config.settings import (DEFAULT_FS, DEFAULT_OVERLAP_RATIO,
-                                    DEFAULT_WINDOW_SIZE, FIELD_FILE_SHA1,
-                                    FIELD_TOTAL_HASHES,
+from dejavu.config.settings import (ALIGN_BIN_SIZE, DEFAULT_FS,
+                                    DEFAULT_OVERLAP_RATIO, DEFAULT_WINDOW_SIZE,
+                                    FIELD_FILE_SHA1, FIELD_TOTAL_HASHES,
+                                    FINGERPRINT_BLOCK_SECONDS,
+                                    FINGERPRINT_HASH_FORMAT,
+                                    FINGERPRINT_SPLIT_SECONDS,
                                     FINGERPRINTED_CONFIDENCE,
                                     FINGERPRINTED_HASHES, HASHES_MATCHED,
-                                    INPUT_CONFIDENCE, INPUT_HASHES, OFFSET,
-                                    OFFSET_SECS, SONG_ID, SONG_NAME, TOPN)
-from dejavu.logic.fingerprint import fingerprint
+                                    INPUT_CONFIDENCE, INPUT_HASHES,
+                                    MAX_HASH_POSTINGS, OFFSET, OFFSET_SECS,
+                                    SONG_CACHE_SIZE, SONG_ID,
+                                    SONG_LOOKUP_BATCH_SIZE, SONG_NAME, TOPN)
+from dejavu.logic.alignment import align, match_arrays
+from dejavu.logic.file_manifest import FileManifest
+from dejavu.logic.fingerprint import (StreamFingerprinter, fingerprint,
+                                      fingerprint_batch)
+from dejavu.logic.fingerprint_cache import FingerprintCache
+from dejavu.logic.ingestion import IngestionPipeline
+from dejavu.logic.ingestion_journal import (COMMITTED, FINGERPRINTED,
+                                            IngestionJournal)
+from dejavu.logic.scheduling import (decode_window, estimate_seconds,
+                                     longest_first, split_file)
+from dejavu.logic.shared_fingerprints import (FingerprintParts,
+                                              SharedFingerprints,
+                                              start_tracker)
 
 
 class Dejavu:
     def __init__(self, config):
         self.config = config
 
+        # options forwarded to the fingerprint function (e.g. the hash format), these must be the same
+        # ones when fingerprinting and when recognizing.
+        self.fingerprint_options = self.config.get("fingerprint", {})
+
         # initialize db
         db_cls = get_database(config.get("database_type", "mysql").lower())
 
-        self.db = db_cls(**config.get("database", {}))
+        self.db = db_cls(
+            hash_format=self.fingerprint_options.get("hash_format", FINGERPRINT_HASH_FORMAT),
+            song_cache_size=self.config.get("song_cache_size", SONG_CACHE_SIZE),
+            **config.get("database", {})
+        )
         self.db.setup()
 
         # if we should limit seconds fingerprinted,
@@ -33,19 +62,94 @@ class Dejavu:
         self.limit = self.config.get("fingerprint_limit", None)
         if self.limit == -1:  # for JSON compatibility
             self.limit = None
+
+        # audio can be mixed down to mono and resampled before being fingerprinted, None keeps the
+        # sampling rate of each file. Both must be the same when fingerprinting and when recognizing.
+        self.analysis_rate = self.config.get("analysis_rate", None)
+        self.downmix = self.config.get("downmix", False)
+
+        # optional on-disk cache of file fingerprints, checked before decoding any file.
+        cache_options = self.config.get("fingerprint_cache", None)
+        self.cache = FingerprintCache(**cache_options) if cache_options else None
+
+        # optional local record of the sha1 of every file seen, so unchanged files are not read to hash them.
+        manifest_path = self.config.get("file_manifest", None)
+        self.manifest = FileManifest(manifest_path) if manifest_path else None
+
+        # whether the hashes of every fingerprinted song are loaded at start up, or files are looked up in
+        # the database to know whether they were already fingerprinted (which is better for large catalogs
+        # when few files are fingerprinted at a time).
+        self.preload_song_hashes = self.config.get("preload_song_hashes", True)
+
+        # number of consecutive offset differences counted together when aligning matches (see align).
+        self.align_bin_size = self.config.get("align_bin_size", ALIGN_BIN_SIZE)
+
+        # hashes with more rows than this in the database are not matched when recognizing, None matches all.
+        self.max_hash_postings = self.config.get("max_hash_postings", MAX_HASH_POSTINGS)
+
+        # whether matches are counted by the database, which then only returns the best ones (see
+        # return_aligned_matches), instead of every matching fingerprint.
+        self.server_side_matching = self.config.get("server_side_matching", False)
         self.__load_fingerprinted_audio_hashes()
 
+        # pool of fingerprint workers, created by the first fingerprint_directory call and reused by the
+        # following ones (see close).
+        self._pool = None
+        self._pool_size = 0
+
     def __load_fingerprinted_audio_hashes(self) -> None:
         """
-        Keeps a dictionary with the hashes of the fingerprinted songs, in that way is possible to check
-        whether or not an audio file was already processed.
+        Keeps a set with the hashes of the fingerprinted songs, in that way is possible to check
+        whether or not an audio file was already processed. Songs fingerprinted afterwards are added
+        to it as they are inserted. Without preloading it, it only keeps the hashes of the songs known
+        to be fingerprinted so far.
         """
         # get songs previously indexed
-        self.songs = self.db.get_songs()
-        self.songhashes_set = set()  # to know which ones we've computed before
-        for song in self.songs:
-            song_hash = song[FIELD_FILE_SHA1]
-            self.songhashes_set.add(song_hash)
+        self.songhashes_set = self.db.get_song_hashes() if self.preload_song_hashes else set()
+
+    def __fingerprinted_hashes(self, file_hashes: List[str]) -> Set[str]:
+        """
+        Finds which files were already fingerprinted.
+
+        :param file_hashes: sha1 of the files.
+        :return: a set with the given hashes which belong to fingerprinted songs.
+        """
+        fingerprinted = {file_hash for file_hash in file_hashes if file_hash in self.songhashes_set}
+        if not self.preload_song_hashes:
+            unknown = [file_hash for file_hash in file_hashes if file_hash not in fingerprinted]
+            if unknown:
+                found = self.db.find_song_hashes(unknown)
+                self.songhashes_set.update(found)
+                fingerprinted |= found
+
+        return fingerprinted
+
+    def __insert_songs(self, songs: List[Tuple[str, str, List[Tuple[str, int]]]]) -> None:
+        """
+        Inserts fingerprinted songs and their fingerprints into the database, all of them at once.
+
+        :param songs: a list of tuples with the song name, the file hash and the fingerprints of each song.
+        """
+        if songs:
+            self.db.insert_songs(songs)
+            self.songhashes_set.update(file_hash for _, file_hash, _ in songs)
+
+    def get_file_hash(self, file_path: str, commit: bool = True) -> str:
+        """
+        Gets the sha1 of the content of a file, from the file manifest if there is one and the file did not
+        change since it was hashed.
+
+        :param file_path: path to the file.
+        :param commit: whether a newly computed hash is written to the manifest right away.
+        :return: the sha1 of the file content.
+        """
+        if self.manifest is None:
+            return decoder.unique_hash(file_path)
+
+        file_hash = self.manifest.file_hash(file_path)
+        if commit:
+            self.manifest.commit()
+        return file_hash
 
     def get_fingerprinted_songs(self) -> List[Dict[str, any]]:
         """
@@ -63,86 +167,352 @@ class Dejavu:
         """
         self.db.delete_songs_by_id(song_ids)
 
-    def fingerprint_directory(self, path: str, extensions: str, nprocesses: int = None) -> None:
+    def fingerprint_directory(self, path: str, extensions: str, nprocesses: int = None, job: str = None) -> None:
         """
         Given a directory and a set of extensions it fingerprints all files that match each extension specified.
 
+        Files are fingerprinted longest first (see longest_first), and long wav files are split in time ranges
+        fingerprinted in parallel (see FINGERPRINT_SPLIT_SECONDS). The worker processes are kept for the
+        following calls, until close is called.
+
         :param path: path to the directory.
         :param extensions: list of file extensions to consider.
         :param nprocesses: amount of processes to fingerprint the files within the directory.
+        :param job: path to the journal of a resumable ingestion job (see IngestionJournal), created if it does
+        not exist. Running the job again with the same journal, e.g. after a crash, skips the files it already
+        committed.
+        """
+        nprocesses = self.__count_processes(nprocesses)
+
+        journal = IngestionJournal(job) if job else None
+        if journal is not None:
+            counts = journal.counts()
+            if any(counts.values()):
+                print(f"Resuming ingestion job {job}: {counts[COMMITTED]} files committed, "
+                      f"{sum(counts.values()) - counts[COMMITTED]} to be done again")
+
+        def on_written(file_hashes: List[str]) -> None:
+            self.songhashes_set.update(file_hashes)
+            if journal is not None:
+                journal.mark(file_hashes, COMMITTED)
+                journal.checkpoint()
+
+        pool = self.__get_pool(nprocesses)
+
+        # fingerprinted songs are written by the writer threads of the pipeline while more files are
+        # fingerprinted, which stops while the writers catch up if they fall behind.
+        pipeline = IngestionPipeline(self.db, on_written=on_written, **self.config.get("ingestion", {}))
+        pipeline.stats.workers = nprocesses
+
+        # fingerprints of the parts of split files, by file hash, until every part is done.
+        parts = {}
+        try:
+            # Send off our tasks, the pool consumes the worker input (in a thread of its own) as the directory
+            # is scanned, so the first files are fingerprinted right away.
+            tasks = longest_first(self.__plan_tasks(self.__scan_directory(path, extensions, journal)))
+            iterator = pool.imap_unordered(Dejavu._fingerprint_worker, pipeline.throttle(tasks, 2 * nprocesses))
+
+            # Loop till we have all of them
+            while True:
+                try:
+                    song_name, hashes, file_hash, part, worker, busy_time = next(iterator)
+                except multiprocessing.TimeoutError:
+                    continue
+                except StopIteration:
+                    break
+                except Exception:
+                    print("Failed fingerprinting")
+                    # Print traceback because we can't reraise it here
+                    traceback.print_exc(file=sys.stdout)
+                    pipeline.release()
+                    continue
+
+                pipeline.stats.add_worker_time(worker, busy_time)
+
+                if part is not None:
+                    index, nparts = part
+                    file_parts = parts.setdefault(file_hash, [None] * nparts)
+                    file_parts[index] = hashes
+                    if any(file_part is None for file_part in file_parts):
+                        pipeline.release(failed=False)
+                        continue
+                    hashes = FingerprintParts(parts.pop(file_hash))
+
+                # marked before it is put, as a writer may commit it right away.
+                if journal is not None:
+                    journal.mark([file_hash], FINGERPRINTED)
+                pipeline.put(song_name, file_hash, hashes)
+
+            pipeline.close()
+        except BaseException:
+            pipeline.abort()
+            self.__close_pool(terminate=True)
+            raise
+        finally:
+            # the files some part of which failed are not written.
+            for file_parts in parts.values():
+                FingerprintParts([file_part for file_part in file_parts if file_part is not None]).release()
+            if journal is not None:
+                journal.close()
+
+        print(pipeline.stats)
+
+    def close(self) -> None:
+        """
+        Stops the fingerprint workers kept by fingerprint_directory, if any.
+        """
+        self.__close_pool()
+
+    @staticmethod
+    def __count_processes(nprocesses: int = None) -> int:
+        """
+        Number of fingerprint workers to use.
+
+        :param nprocesses: number of workers asked for, if any.
+        :return: the number of workers, which defaults to the number of CPUs.
         """
         # Try to use the maximum amount of processes if not given.
         try:
             nprocesses = nprocesses or multiprocessing.cpu_count()
         except NotImplementedError:
-            nprocesses = 1
+            return 1
+        return 1 if nprocesses <= 0 else nprocesses
+
+    def __get_pool(self, nprocesses: int) -> Pool:
+        """
+        Gets the pool of fingerprint workers, which is created if there is none yet (or it has a different
+        number of workers).
+
+        :param nprocesses: number of workers.
+        :return: the pool.
+        """
+        if self._pool is not None and self._pool_size != nprocesses:
+            self.__close_pool()
+
+        if self._pool is None:
+            # workers don't use the database, but they shouldn't inherit its connections either.
+            self.db.before_fork()
+            # the workers hand their fingerprints over in shared memory blocks, which the tracker started here
+            # unlinks if the parent exits before releasing them.
+            start_tracker()
+            self._pool = multiprocessing.Pool(nprocesses, initializer=self.db.after_fork)
+            self._pool_size = nprocesses
+
+        return self._pool
+
+    def __close_pool(self, terminate: bool = False) -> None:
+        """
+        Stops the pool of fingerprint workers, if any.
+
+        :param terminate: whether the workers are stopped right away, instead of once their tasks are done.
+        """
+        if self._pool is None:
+            return
+
+        if terminate:
+            self._pool.terminate()
         else:
-            nprocesses = 1 if nprocesses <= 0 else nprocesses
+            self._pool.close()
+            self._pool.join()
+        self._pool = None
 
-        pool = multiprocessing.Pool(nprocesses)
+    def __plan_tasks(self, tasks: Iterable[Tuple]) -> Iterator[Tuple[float, Tuple]]:
+        """
+        Estimates the seconds of audio of each file to be fingerprinted, as the cost of its task for
+        longest_first, and splits long seekable files (see decoder.seekable) in time ranges (see split_file),
+        each one a task of its own. Files are not split if there is a fingerprint cache, which keeps whole files.
 
-        filenames_to_fingerprint = []
-        for filename, _ in decoder.find_files(path, extensions):
-            # don't refingerprint already fingerprinted files
-            if decoder.unique_hash(filename) in self.songhashes_set:
-                print(f"{filename} already fingerprinted, continuing...")
+        :param tasks: _fingerprint_worker input of each file.
+        :return: an iterator over tuples of the cost of each task and the _fingerprint_worker input.
+        """
+        wsize, hop = self.__window(self.fingerprint_options)
+
+        for task in tasks:
+            file_name = task[0]
+            seconds = estimate_seconds(file_name, self.limit)
+
+            ranges = []
+            if (self.cache is None and FINGERPRINT_SPLIT_SECONDS and seconds > FINGERPRINT_SPLIT_SECONDS
+                    and decoder.seekable(file_name, self.analysis_rate)):
+                ranges = split_file(file_name, math.ceil(seconds / FINGERPRINT_SPLIT_SECONDS), self.limit, wsize, hop,
+                                    downmix=self.downmix)
+
+            if len(ranges) < 2:
+                yield seconds, (*task, None)
                 continue
 
-            filenames_to_fingerprint.append(filename)
+            for index, (first, last) in enumerate(ranges):
+                yield seconds / len(ranges), (*task, (first, last, index, len(ranges)))
 
-        # Prepare _fingerprint_worker input
-        worker_input = list(zip(filenames_to_fingerprint, [self.limit] * len(filenames_to_fingerprint)))
+    @staticmethod
+    def __window(fingerprint_options: Dict[str, any]) -> Tuple[int, int]:
+        """
+        FFT window size and number of samples between frames the fingerprints are computed with.
 
-        # Send off our tasks
-        iterator = pool.imap_unordered(Dejavu._fingerprint_worker, worker_input)
+        :param fingerprint_options: options given to the fingerprint function.
+        :return: a tuple with the window size and the hop.
+        """
+        wsize = fingerprint_options.get("wsize", DEFAULT_WINDOW_SIZE)
+        return wsize, wsize - int(wsize * fingerprint_options.get("wratio", DEFAULT_OVERLAP_RATIO))
 
-        # Loop till we have all of them
-        while True:
-            try:
-                song_name, hashes, file_hash = next(iterator)
-            except multiprocessing.TimeoutError:
-                continue
-            except StopIteration:
-                break
-            except Exception:
-                print("Failed fingerprinting")
-                # Print traceback because we can't reraise it here
-                traceback.print_exc(file=sys.stdout)
-            else:
-                sid = self.db.insert_song(song_name, file_hash, len(hashes))
+    def __scan_directory(self, path: str, extensions: str, journal: IngestionJournal = None) -> Iterator[Tuple]:
+        """
+        Scans a directory for files not fingerprinted yet, as the input of _fingerprint_worker.
 
-                self.db.insert_hashes(sid, hashes)
-                self.db.set_song_fingerprinted(sid)
-                self.__load_fingerprinted_audio_hashes()
+        :param path: path to the directory.
+        :param extensions: list of file extensions to consider.
+        :param journal: journal of the ingestion job, if any, where the files found are recorded.
+        :return: an iterator over the _fingerprint_worker input of each file, as they are found.
+        """
+        queued_hashes = set()
+        files = []
+        for filename, _ in decoder.find_files(path, extensions):
+            if journal is not None:
+                # files the job already committed are skipped, unless they changed since.
+                stat = os.stat(filename)
+                if journal.is_committed(filename, stat):
+                    continue
+
+            # only new or changed files are read to hash them if there is a file manifest.
+            file_hash = self.get_file_hash(filename, commit=False)
+            files.append((filename, file_hash))
+            if journal is not None:
+                journal.queue(filename, file_hash, stat)
+
+            # files are looked up in the database in batches if the song hashes aren't preloaded.
+            if self.preload_song_hashes or len(files) >= SONG_LOOKUP_BATCH_SIZE:
+                yield from self.__files_to_fingerprint(files, queued_hashes, journal)
+                files = []
+
+        yield from self.__files_to_fingerprint(files, queued_hashes, journal)
+
+        if self.manifest is not None:
+            self.manifest.commit()
+        if journal is not None:
+            journal.checkpoint()
+
+    def __files_to_fingerprint(self, files: List[Tuple[str, str]], queued_hashes: Set[str],
+                               journal: IngestionJournal = None) -> Iterator[Tuple]:
+        """
+        Filters out files already fingerprinted, or with the same content as other file being fingerprinted.
 
-        pool.close()
-        pool.join()
+        :param files: a list of tuples with the name and the hash of each file.
+        :param queued_hashes: hashes of the files being fingerprinted, the hashes of the files yielded are
+        added to it.
+        :param journal: journal of the ingestion job, if any, where files already fingerprinted are committed.
+        :return: an iterator over the _fingerprint_worker input of the files to be fingerprinted.
+        """
+        fingerprinted = self.__fingerprinted_hashes([file_hash for _, file_hash in files])
+        if journal is not None and fingerprinted:
+            journal.mark(fingerprinted, COMMITTED)
 
-    def fingerprint_file(self, file_path: str, song_name: str = None) -> None:
+        for filename, file_hash in files:
+            # don't refingerprint already fingerprinted files
+            if file_hash in fingerprinted:
+                print(f"{filename} already fingerprinted, continuing...")
+                continue
+            elif file_hash in queued_hashes:
+                print(f"{filename} has the same content as another file being fingerprinted, continuing...")
+                continue
+
+            queued_hashes.add(file_hash)
+            yield (filename, file_hash, self.limit, self.analysis_rate, self.downmix, self.cache,
+                   self.fingerprint_options)
+
+    def fingerprint_file(self, file_path: str, song_name: str = None, start: float = None,
+                         limit: int = None, nprocesses: int = None) -> None:
         """
         Given a path to a file the method generates hashes for it and stores them in the database
         for later be queried.
 
         :param file_path: path to the file.
         :param song_name: song name associated to the audio file.
+        :param start: number of seconds into the file where fingerprinting starts.
+        :param limit: number of seconds to fingerprint, which defaults to the fingerprint_limit config.
+        :param nprocesses: number of processes the file is fingerprinted by in parallel (see
+        get_file_fingerprints_parallel, 0 for every CPU), None fingerprints it in this process.
         """
         song_name_from_path = decoder.get_audio_name_from_path(file_path)
-        song_hash = decoder.unique_hash(file_path)
+        song_hash = self.get_file_hash(file_path)
         song_name = song_name or song_name_from_path
         # don't refingerprint already fingerprinted files
-        if song_hash in self.songhashes_set:
+        if self.__fingerprinted_hashes([song_hash]):
             print(f"{song_name} already fingerprinted, continuing...")
+        elif nprocesses is not None:
+            hashes, _ = self.get_file_fingerprints_parallel(file_path, limit or self.limit, nprocesses=nprocesses,
+                                                            start=start, file_hash=song_hash, cache=self.cache)
+            self.__insert_songs([(song_name, song_hash, hashes)])
+        else:
+            hashes, file_hash = Dejavu.get_file_fingerprints(file_path, limit or self.limit,
+                                                             analysis_rate=self.analysis_rate, downmix=self.downmix,
+                                                             cache=self.cache, start=start, file_hash=song_hash,
+                                                             **self.fingerprint_options)
+            self.__insert_songs([(song_name, file_hash, hashes)])
+
+    def get_file_fingerprints_parallel(self, file_path: str, limit: int, nprocesses: int = None,
+                                       start: float = None, file_hash: str = None,
+                                       cache: FingerprintCache = None) -> Tuple[Set[Tuple[str, int]], int]:
+        """
+        Fingerprints a single file with the worker pool, split in time ranges (see split_file) and channel by
+        channel, each one a task of its own. The fingerprints of every task are put back together, and they are
+        the very same as those get_file_fingerprints computes. The worker processes are kept for the following
+        calls, until close is called.
+
+        Every task reads its range right away from seekable files (see decoder.seekable), but any other file
+        is decoded by each task from its start up to the end of its range, so the samples are the same.
+
+        :param file_path: path to the file.
+        :param limit: number of seconds to fingerprint.
+        :param nprocesses: number of worker processes, which defaults to the number of CPUs.
+        :param start: number of seconds into the file where fingerprinting starts.
+        :param file_hash: sha1 of the file content, required if there is a cache.
+        :param cache: fingerprint cache the fingerprints are looked up in, and put into once computed.
+        :return: a tuple with the set of fingerprints, and the sampling rate they were computed at.
+        """
+        nprocesses = self.__count_processes(nprocesses)
+
+        if cache is not None:
+            cache_options = Dejavu.get_cache_options(limit, self.analysis_rate, self.downmix,
+                                                     self.fingerprint_options, start=start)
+            cached = cache.get(file_hash, cache_options)
+            if cached is not None:
+                return cached
+
+        # channels are split only if they are not mixed down, and the format can be read without decoding.
+        audio = decoder.probe(file_path, analysis_rate=self.analysis_rate, downmix=self.downmix)
+        channels = list(range(audio[0])) if audio is not None and audio[0] > 1 else [None]
+
+        wsize, hop = self.__window(self.fingerprint_options)
+        ranges = split_file(file_path, math.ceil(nprocesses / len(channels)), limit, wsize, hop, start=start,
+                            analysis_rate=self.analysis_rate, downmix=self.downmix)
+
+        tasks = [(file_path, limit, self.analysis_rate, self.downmix, start, self.fingerprint_options, frames, channel)
+                 for frames in ranges for channel in channels]
+
+        if audio is None or nprocesses == 1 or len(tasks) < 2:
+            fingerprints, fs, _ = Dejavu._fingerprint_file(file_path, limit, analysis_rate=self.analysis_rate,
+                                                           downmix=self.downmix, start=start, file_hash=file_hash,
+                                                           **self.fingerprint_options)
         else:
-            song_name, hashes, file_hash = Dejavu._fingerprint_worker(
-                file_path,
-                self.limit,
-                song_name=song_name
-            )
-            sid = self.db.insert_song(song_name, file_hash)
+            pool = self.__get_pool(nprocesses)
+
+            parts = []
+            try:
+                parts.extend(pool.imap_unordered(Dejavu._fingerprint_part_worker, tasks))
+                # ranges have no fingerprint in common, but channels may have some.
+                fingerprints = set(FingerprintParts(parts))
+            except BaseException:
+                self.__close_pool(terminate=True)
+                raise
+            finally:
+                FingerprintParts(parts).release()
+
+            fs = audio[1]
 
-            self.db.insert_hashes(sid, hashes)
-            self.db.set_song_fingerprinted(sid)
-            self.__load_fingerprinted_audio_hashes()
+        if cache is not None and fs is not None:
+            cache.put(file_hash, cache_options, fingerprints, fs)
+
+        return fingerprints, fs
 
     def generate_fingerprints(self, samples: List[int], Fs=DEFAULT_FS) -> Tuple[List[Tuple[str, int]], float]:
         f"""
@@ -153,53 +523,85 @@ class Dejavu:
         :return: a list of tuples for hash and its corresponding offset, together with the generation time.
         """
         t = time()
-        hashes = fingerprint(samples, Fs=Fs)
+        hashes = fingerprint(samples, Fs=Fs, **self.fingerprint_options)
+        fingerprint_time = time() - t
+        return hashes, fingerprint_time
+
+    def generate_fingerprints_batch(self, clips: List[List[int]],
+                                    Fs=DEFAULT_FS) -> Tuple[List[List[Tuple[str, int]]], float]:
+        f"""
+        Generate the fingerprints for many clips (channels) at once, which is cheaper than calling
+        generate_fingerprints for each one of them.
+
+        :param clips: list of channels, all of them sampled at the same rate.
+        :param Fs: sampling rate which defaults to {DEFAULT_FS}.
+        :return: a list with the tuples for hash and its corresponding offset of each clip, together with
+         the generation time.
+        """
+        t = time()
+        hashes = fingerprint_batch(clips, Fs=Fs, **self.fingerprint_options)
         fingerprint_time = time() - t
         return hashes, fingerprint_time
 
-    def find_matches(self, hashes: List[Tuple[str, int]]) -> Tuple[List[Tuple[int, int]], Dict[str, int], float]:
+    def find_matches(self, hashes: List[Tuple[str, int]],
+                     topn: int = TOPN) -> Tuple[Tuple[np.ndarray, ...], Dict[str, int], float]:
         """
         Finds the corresponding matches on the fingerprinted audios for the given hashes.
 
         :param hashes: list of tuples for hashes and their corresponding offsets
-        :return: a tuple containing the matches found against the db, a dictionary which counts the different
-         hashes matched for each song (with the song id as key), and the time that the query took.
+        :param topn: number of songs the matches are aligned for afterwards, the only ones returned when they
+         are counted by the database (see the server_side_matching config).
+        :return: a tuple containing the matches found against the db (counted by song id and offset difference,
+         see MatchHistogram), a dictionary which counts the different hashes matched for each song (with the song
+         id as key), and the time that the query took.
 
         """
         t = time()
-        matches, dedup_hashes = self.db.return_matches(hashes)
+        # offsets binned together (see align) are counted in Python, the database only counts exact ones.
+        if self.server_side_matching and self.align_bin_size <= 1:
+            matches, dedup_hashes = self.db.return_aligned_matches(hashes, topn, max_postings=self.max_hash_postings)
+        else:
+            matches, dedup_hashes = self.db.return_matches(hashes, max_postings=self.max_hash_postings)
         query_time = time() - t
 
         return matches, dedup_hashes, query_time
 
-    def align_matches(self, matches: List[Tuple[int, int]], dedup_hashes: Dict[str, int], queried_hashes: int,
-                      topn: int = TOPN) -> List[Dict[str, any]]:
+    def align_matches(self, matches: Union[List[Tuple[int, int]], Tuple[np.ndarray, np.ndarray]],
+                      dedup_hashes: Dict[str, int], queried_hashes: int, topn: int = TOPN,
+                      Fs: int = DEFAULT_FS) -> List[Dict[str, any]]:
         """
         Finds hash matches that align in time with other matches and finds
         consensus about which hashes are "true" signal from the audio.
 
-        :param matches: matches from the database
+        :param matches: matches from the database, as tuples of song id and offset difference or as a tuple
+        of both arrays, along with the number of matches of each pair (see MatchHistogram).
         :param dedup_hashes: dictionary containing the hashes matched without duplicates for each song
         (key is the song id).
         :param queried_hashes: amount of hashes sent for matching against the db
         :param topn: number of results being returned back.
+        :param Fs: sampling rate the hashes were generated at, to turn offsets into seconds.
         :return: a list of dictionaries (based on topn) with match information.
         """
-        # count offset occurrences per song and keep only the maximum ones.
-        sorted_matches = sorted(matches, key=lambda m: (m[0], m[1]))
-        counts = [(*key, len(list(group))) for key, group in groupby(sorted_matches, key=lambda m: (m[0], m[1]))]
-        songs_matches = sorted(
-            [max(list(group), key=lambda g: g[2]) for key, group in groupby(counts, key=lambda count: count[0])],
-            key=lambda count: count[2], reverse=True
-        )
+        # count offset occurrences per song and keep only the maximum ones, over arrays (see align).
+        songs_matches = align(*match_arrays(matches), topn=topn, bin_size=self.align_bin_size)
+
+        # offsets are in frames, which are one hop apart.
+        wsize = self.fingerprint_options.get("wsize", DEFAULT_WINDOW_SIZE)
+        hop = wsize - int(wsize * self.fingerprint_options.get("wratio", DEFAULT_OVERLAP_RATIO))
+
+        # the metadata of every song is brought at once, mostly from the song cache.
+        songs = self.db.get_songs_by_ids([song_id for song_id, _, _ in songs_matches])
 
         songs_result = []
-        for song_id, offset, _ in songs_matches[0:topn]:  # consider topn elements in the result
-            song = self.db.get_song_by_id(song_id)
+        for song_id, offset, _ in songs_matches:
+            # songs deleted since their fingerprints were matched are left out.
+            song = songs.get(song_id)
+            if song is None:
+                continue
 
             song_name = song.get(SONG_NAME, None)
             song_hashes = song.get(FIELD_TOTAL_HASHES, None)
-            nseconds = round(float(offset) / DEFAULT_FS * DEFAULT_WINDOW_SIZE * DEFAULT_OVERLAP_RATIO, 5)
+            nseconds = round(float(offset) * hop / Fs, 5)
             hashes_matched = dedup_hashes[song_id]
 
             song = {
@@ -229,31 +631,154 @@ class Dejavu:
     def _fingerprint_worker(arguments):
         # Pool.imap sends arguments as tuples so we have to unpack
         # them ourself.
-        try:
-            file_name, limit = arguments
-        except ValueError:
-            pass
+        file_name, file_hash, limit, analysis_rate, downmix, cache, fingerprint_options, part = arguments
 
+        t = time()
         song_name, extension = os.path.splitext(os.path.basename(file_name))
 
-        fingerprints, file_hash = Dejavu.get_file_fingerprints(file_name, limit, print_output=True)
+        fingerprints, file_hash = Dejavu.get_file_fingerprints(file_name, limit, print_output=True,
+                                                               analysis_rate=analysis_rate, downmix=downmix,
+                                                               cache=cache, file_hash=file_hash,
+                                                               frames=part[:2] if part else None,
+                                                               **fingerprint_options)
+
+        # only a descriptor of the packed fingerprints is pickled back to the parent.
+        fingerprints = SharedFingerprints(fingerprints)
 
-        return song_name, fingerprints, file_hash
+        # the index and number of parts of split files, and what the worker was busy with, for the stats.
+        return song_name, fingerprints, file_hash, part[2:] if part else None, os.getpid(), time() - t
 
     @staticmethod
-    def get_file_fingerprints(file_name: str, limit: int, print_output: bool = False):
-        channels, fs, file_hash = decoder.read(file_name, limit)
-        fingerprints = set()
-        channel_amount = len(channels)
-        for channeln, channel in enumerate(channels, start=1):
-            if print_output:
-                print(f"Fingerprinting channel {channeln}/{channel_amount} for {file_name}")
+    def _fingerprint_part_worker(arguments):
+        # Pool.imap sends arguments as tuples so we have to unpack
+        # them ourself.
+        file_name, limit, analysis_rate, downmix, start, fingerprint_options, frames, channel = arguments
 
-            hashes = fingerprint(channel, Fs=fs)
+        fingerprints, _, _ = Dejavu._fingerprint_file(file_name, limit, analysis_rate=analysis_rate,
+                                                      downmix=downmix, start=start, frames=frames, channel=channel,
+                                                      **fingerprint_options)
 
-            if print_output:
-                print(f"Finished channel {channeln}/{channel_amount} for {file_name}")
+        # only a descriptor of the packed fingerprints is pickled back to the parent.
+        return SharedFingerprints(fingerprints)
 
-            fingerprints |= set(hashes)
+    @staticmethod
+    def get_file_fingerprints(file_name: str, limit: int, print_output: bool = False, analysis_rate: int = None,
+                              downmix: bool = False, cache: FingerprintCache = None, start: float = None,
+                              file_hash: str = None, frames: Tuple[int, int] = None, **fingerprint_options):
+        # frames are a time range of a split file (see split_file), whose fingerprints are not cached.
+        if cache is not None and frames is None:
+            file_hash = file_hash or decoder.unique_hash(file_name)
+            cache_options = Dejavu.get_cache_options(limit, analysis_rate, downmix, fingerprint_options, start=start)
+            cached = cache.get(file_hash, cache_options)
+            if cached is not None:
+                if print_output:
+                    print(f"Fingerprints for {file_name} found in the cache")
+                return cached[0], file_hash
+
+        fingerprints, fs, file_hash = Dejavu._fingerprint_file(file_name, limit, print_output=print_output,
+                                                               analysis_rate=analysis_rate, downmix=downmix,
+                                                               start=start, file_hash=file_hash, frames=frames,
+                                                               **fingerprint_options)
+
+        # nothing is cached for a file no audio was read from.
+        if cache is not None and frames is None and fs is not None:
+            cache.put(file_hash, cache_options, fingerprints, fs)
 
         return fingerprints, file_hash
+
+    @staticmethod
+    def _fingerprint_file(file_name: str, limit: int, print_output: bool = False, analysis_rate: int = None,
+                          downmix: bool = False, start: float = None, file_hash: str = None,
+                          frames: Tuple[int, int] = None, channel: int = None,
+                          **fingerprint_options) -> Tuple[Set[Tuple[str, int]], int, str]:
+        """
+        Decodes and fingerprints a file, or a part of it.
+
+        :param file_name: path to the file.
+        :param limit: number of seconds to fingerprint.
+        :param print_output: whether the progress is printed.
+        :param analysis_rate: sampling rate the channels are resampled to, None keeps the file one.
+        :param downmix: whether the channels are mixed down into a single one.
+        :param start: number of seconds into the file where fingerprinting starts.
+        :param file_hash: sha1 of the file content, if already known, otherwise the file is hashed as it is read.
+        :param frames: first and last (not included, None up to the end) frames of a time range (see split_file),
+        the only one fingerprinted. The file is not hashed then.
+        :param channel: index of the only channel fingerprinted, if any.
+        :param fingerprint_options: options given to the fingerprint function.
+        :return: a tuple with the set of fingerprints, the sampling rate they were computed at (None if no block
+        of audio was read at all) and the file hash.
+        """
+        window_frame = 0
+        window = None
+        if frames is not None:
+            # only the window around the range is decoded, the fingerprints out of the range are dropped.
+            window_frame, window = decode_window(*frames, *Dejavu.__window(fingerprint_options))
+
+        if print_output:
+            print(f"Fingerprinting {file_name}" + (f" (frames {frames[0]} to {frames[1]})" if frames else ""))
+
+        # the file is decoded and fingerprinted by blocks, with a stream fingerprinter per channel, so
+        # neither the audio nor the spectrogram are ever entirely in memory. If its sha1 isn't known yet,
+        # the file is hashed while it is read.
+        file_sha1 = sha1() if file_hash is None and frames is None else None
+        fingerprints = set()
+        streams = None
+        fs = None
+        nsamples = 0
+        for channels, fs in decoder.read_blocks(file_name, FINGERPRINT_BLOCK_SECONDS, limit,
+                                                analysis_rate=analysis_rate, downmix=downmix, start=start,
+                                                sha1_hash=file_sha1, window=window):
+            if channel is not None:
+                channels = channels[channel:channel + 1]
+
+            if streams is None:
+                streams = [StreamFingerprinter(Fs=fs, **fingerprint_options) for _ in channels]
+
+            for stream, samples in zip(streams, channels):
+                fingerprints |= set(stream.update(samples))
+            nsamples += len(channels[0]) if channels else 0
+
+        if streams is None:
+            # the decoder gave no block, not even an empty one, so there is nothing to fingerprint.
+            streams = []
+
+        for stream in streams:
+            fingerprints |= set(stream.flush())
+
+        if frames is not None:
+            # offsets are counted from the start of the window, and from the start of the file once back.
+            first, last = frames
+            fingerprints = {(hsh, offset + window_frame) for hsh, offset in fingerprints
+                            if first <= offset + window_frame and (last is None or offset + window_frame < last)}
+
+        if file_sha1 is not None:
+            file_hash = file_sha1.hexdigest().upper()
+
+        if print_output:
+            print(f"Finished {len(streams)} channels for {file_name}")
+
+            if nsamples > 0:
+                # hashes per second of audio, what the peak selection options (if any) are meant to bound.
+                seconds = nsamples / fs
+                print(f"{len(fingerprints)} hashes for {file_name}, {len(fingerprints) / seconds:.1f} per second "
+                      f"of audio")
+
+        return fingerprints, fs, file_hash
+
+    @staticmethod
+    def get_cache_options(limit: int, analysis_rate: int, downmix: bool, fingerprint_options: Dict[str, any],
+                          start: float = None) -> Dict[str, any]:
+        """
+        Every option the fingerprints of a file depend on, which are part of its cache key.
+
+        :param limit: number of seconds fingerprinted.
+        :param analysis_rate: sampling rate the audio is resampled to.
+        :param downmix: whether the audio is mixed down to mono.
+        :param fingerprint_options: options given to the fingerprint function.
+        :param start: number of seconds into the file where fingerprinting starts.
+        :return: a dictionary with the options.
+        """
+        options = {"limit": limit, "analysis_rate": analysis_rate, "downmix": downmix, **fingerprint_options}
+        if start:
+            options["start"] = start
+        return options
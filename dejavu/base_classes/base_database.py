@@ -1,6 +1,8 @@
 import abc
 import importlib
-from typing import Dict, List, Tuple
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
 
 from dejavu.config.settings import DATABASES
 
@@ -84,6 +86,26 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         """
         pass
 
+    @abc.abstractmethod
+    def get_song_hashes(self) -> Set[str]:
+        """
+        Returns the file hashes of all fully fingerprinted songs in the database.
+
+        :return: a set with the sha1 of the songs files, in upper case hexadecimal format.
+        """
+        pass
+
+    @abc.abstractmethod
+    def find_song_hashes(self, file_hashes: List[str], batch_size: int = 1000) -> Set[str]:
+        """
+        Looks for fully fingerprinted songs by their file hashes.
+
+        :param file_hashes: sha1 of the files, in upper case hexadecimal format.
+        :param batch_size: number of query's batches.
+        :return: a set with the given hashes which belong to fingerprinted songs.
+        """
+        pass
+
     @abc.abstractmethod
     def get_song_by_id(self, song_id: int) -> Dict[str, str]:
         """
@@ -94,6 +116,17 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         """
         pass
 
+    @abc.abstractmethod
+    def get_songs_by_ids(self, song_ids: List[int], batch_size: int = 1000) -> Dict[int, Dict[str, str]]:
+        """
+        Brings the info of many songs from the database.
+
+        :param song_ids: song identifiers.
+        :param batch_size: number of query's batches.
+        :return: a dictionary with the songs (value) by their identifiers (key), songs not found are left out.
+        """
+        pass
+
     @abc.abstractmethod
     def insert(self, fingerprint: str, song_id: int, offset: int):
         """
@@ -118,6 +151,20 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         """
         pass
 
+    @abc.abstractmethod
+    def insert_songs(self, songs: List[Tuple[str, str, List[Tuple[str, int]]]],
+                     batch_size: int = 1000) -> List[int]:
+        """
+        Inserts many songs along with their fingerprints, in a single transaction, and sets them as
+        fingerprinted.
+
+        :param songs: A sequence of tuples in the format (song name, file hash, hashes)
+            - hashes: A sequence of tuples in the format (hash, offset)
+        :param batch_size: fingerprints insert batches.
+        :return: the inserted ids.
+        """
+        pass
+
     @abc.abstractmethod
     def query(self, fingerprint: str = None) -> List[Tuple]:
         """
@@ -151,16 +198,19 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         """
 
     @abc.abstractmethod
-    def return_matches(self, hashes: List[Tuple[str, int]], batch_size: int = 1000) \
-            -> Tuple[List[Tuple[int, int]], Dict[int, int]]:
+    def return_matches(self, hashes: List[Tuple[str, int]], batch_size: int = 1000,
+                       max_postings: int = None) -> Tuple[Tuple[np.ndarray, ...], Dict[int, int]]:
         """
         Searches the database for pairs of (hash, offset) values.
 
         :param hashes: A sequence of tuples in the format (hash, offset)
             - hash: Part of a sha1 hash, in hexadecimal format
             - offset: Offset this hash was created from/at.
-        :param batch_size: number of query's batches.
-        :return: a list of (sid, offset_difference) tuples and a
+        :param batch_size: number of hashes looked up by the first statement.
+        :param max_postings: maximum number of rows a hash can have in the database to be matched, None
+        matches every hash.
+        :return: a tuple with the song id, offset difference and count arrays, with
+        the number of matches of each distinct (sid, offset_difference) pair, and a
         dictionary with the amount of hashes matched (not considering
         duplicated hashes) in each song.
             - song id: Song identifier
@@ -168,6 +218,27 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         """
         pass
 
+    @abc.abstractmethod
+    def return_aligned_matches(self, hashes: List[Tuple[str, int]], topn: int, max_postings: int = None,
+                               batch_size: int = 1000) -> Tuple[Tuple[np.ndarray, ...], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values as return_matches does, counting the matches
+        by song and offset difference in the database itself.
+
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format
+            - offset: Offset this hash was created from/at.
+        :param topn: number of songs returned.
+        :param max_postings: maximum number of rows a hash can have in the database to be matched, None
+        matches every hash.
+        :param batch_size: number of values sent by each statement.
+        :return: a tuple with the song id, offset difference and count arrays, with
+        the best offset difference of each one of the topn songs, and a dictionary
+        with the amount of hashes matched (not considering duplicated hashes) in
+        each one of them.
+        """
+        pass
+
     @abc.abstractmethod
     def delete_songs_by_id(self, song_ids: List[int], batch_size: int = 1000) -> None:
         """
@@ -1,8 +1,6 @@
 import abc
 from time import time
-from typing import Dict, List, Tuple
-
-import numpy as np
+from typing import Dict, List, Set, Tuple
 
 from dejavu.config.settings import DEFAULT_FS
 
@@ -13,20 +11,28 @@ class BaseRecognizer(object, metaclass=abc.ABCMeta):
         self.Fs = DEFAULT_FS
 
     def _recognize(self, *data) -> Tuple[List[Dict[str, any]], int, int, int]:
-        fingerprint_times = []
+        hashes, fingerprint_time = self._fingerprint(*data)
+        return self._match(hashes, fingerprint_time)
+
+    def _fingerprint(self, *data) -> Tuple[Set[Tuple[str, int]], int]:
+        # all the channels are fingerprinted in a single batch.
+        fingerprints, fingerprint_time = self.dejavu.generate_fingerprints_batch(list(data), Fs=self.Fs)
+
         hashes = set()  # to remove possible duplicated fingerprints we built a set.
-        for channel in data:
-            fingerprints, fingerprint_time = self.dejavu.generate_fingerprints(channel, Fs=self.Fs)
-            fingerprint_times.append(fingerprint_time)
-            hashes |= set(fingerprints)
+        for channel_fingerprints in fingerprints:
+            hashes |= set(channel_fingerprints)
+
+        return hashes, fingerprint_time
 
+    def _match(self, hashes: Set[Tuple[str, int]],
+               fingerprint_time: int) -> Tuple[List[Dict[str, any]], int, int, int]:
         matches, dedup_hashes, query_time = self.dejavu.find_matches(hashes)
 
         t = time()
-        final_results = self.dejavu.align_matches(matches, dedup_hashes, len(hashes))
+        final_results = self.dejavu.align_matches(matches, dedup_hashes, len(hashes), Fs=self.Fs)
         align_time = time() - t
 
-        return final_results, np.sum(fingerprint_times), query_time, align_time
+        return final_results, fingerprint_time, query_time, align_time
 
     @abc.abstractmethod
     def recognize(self) -> Dict[str, any]:
@@ -1,7 +1,18 @@
 import abc
-from typing import Dict, List, Tuple
+from itertools import repeat
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
 
 from dejavu.base_classes.base_database import BaseDatabase
+from dejavu.config.settings import (FIELD_SONG_ID, FINGERPRINT_HASH_FORMAT,
+                                    FINGERPRINT_HASH_FORMATS, MATCH_BATCH_ROWS,
+                                    MATCH_FETCH_SIZE, MAX_HASH_POSTINGS,
+                                    PACKED_HASH_LAYOUTS, SONG_CACHE_SIZE, TOPN)
+from dejavu.logic.alignment import MatchHistogram
+from dejavu.logic.shared_fingerprints import (FingerprintParts,
+                                              SharedFingerprints)
+from dejavu.logic.song_cache import SongCache
 
 
 class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
@@ -9,9 +20,36 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
     # I've built this class with the idea to reuse that logic instead of copy pasting
     # over and over the same code.
 
-    def __init__(self):
+    # Maximum number of hashes looked up by each statement of return_matches (see _lookup_batch_size), None
+    # for the batch_size it is given, which the IN lists (a placeholder per hash) are limited to.
+    LOOKUP_BATCH_LIMIT = None
+
+    def __init__(self, hash_format: str = FINGERPRINT_HASH_FORMAT, song_cache_size: int = SONG_CACHE_SIZE):
         super().__init__()
 
+        if hash_format not in FINGERPRINT_HASH_FORMATS:
+            raise ValueError(f"Unsupported hash format {hash_format}, must be one of {FINGERPRINT_HASH_FORMATS}.")
+
+        self.hash_format = hash_format
+
+        # metadata of the songs recently looked up by id (see get_songs_by_ids).
+        self.song_cache = SongCache(song_cache_size)
+
+        # hex hashes are kept in binary columns, while the packed integer formats use an integer
+        # column and need no conversion at all, so the fingerprint queries are swapped for those.
+        if hash_format in PACKED_HASH_LAYOUTS:
+            self.CREATE_FINGERPRINTS_TABLE = self.CREATE_PACKED_FINGERPRINTS_TABLE.format(
+                hash_type=self.PACKED_HASH_TYPES[hash_format]
+            )
+            self.INSERT_FINGERPRINT = self.INSERT_PACKED_FINGERPRINT
+            self.SELECT = self.SELECT_PACKED
+            self.SELECT_MULTIPLE = self.SELECT_PACKED_MULTIPLE
+            self.IN_MATCH = self.IN_PACKED_MATCH
+            self.CREATE_QUERY_TABLE = self.CREATE_PACKED_QUERY_TABLE.format(
+                hash_type=self.PACKED_HASH_TYPES[hash_format]
+            )
+            self.QUERY_HASH_VALUES = self.PACKED_QUERY_HASH_VALUES
+
     def before_fork(self) -> None:
         """
         Called before the database instance is given to the new process
@@ -43,6 +81,7 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
             cur.execute(self.DROP_FINGERPRINTS)
             cur.execute(self.DROP_SONGS)
 
+        self.song_cache.clear()
         self.setup()
 
     def delete_unfingerprinted_songs(self) -> None:
@@ -53,6 +92,8 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
         with self.cursor() as cur:
             cur.execute(self.DELETE_UNFINGERPRINTED)
 
+        self.song_cache.clear()
+
     def get_num_songs(self) -> int:
         """
         Returns the song's count stored.
@@ -96,16 +137,73 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
             cur.execute(self.SELECT_SONGS)
             return list(cur)
 
+    def get_song_hashes(self) -> Set[str]:
+        """
+        Returns the file hashes of all fully fingerprinted songs in the database.
+
+        :return: a set with the sha1 of the songs files, in upper case hexadecimal format.
+        """
+        with self.cursor() as cur:
+            cur.execute(self.SELECT_SONG_HASHES)
+            return {file_hash for file_hash, in cur}
+
+    def find_song_hashes(self, file_hashes: List[str], batch_size: int = 1000) -> Set[str]:
+        """
+        Looks for fully fingerprinted songs by their file hashes.
+
+        :param file_hashes: sha1 of the files, in upper case hexadecimal format.
+        :param batch_size: number of query's batches.
+        :return: a set with the given hashes which belong to fingerprinted songs.
+        """
+        found = set()
+        with self.cursor() as cur:
+            for index in range(0, len(file_hashes), batch_size):
+                # Create our IN part of the query
+                query = self.SELECT_SONG_HASHES_IN % ', '.join(
+                    [self.IN_FILE_SHA1_MATCH] * len(file_hashes[index: index + batch_size])
+                )
+
+                cur.execute(query, file_hashes[index: index + batch_size])
+                found.update(file_hash for file_hash, in cur)
+
+        return found
+
     def get_song_by_id(self, song_id: int) -> Dict[str, str]:
         """
-        Brings the song info from the database.
+        Brings the song info from the database, or from the song cache.
 
         :param song_id: song identifier.
         :return: a song by its identifier. Result must be a Dictionary.
         """
+        return self.get_songs_by_ids([song_id]).get(song_id)
+
+    def get_songs_by_ids(self, song_ids: List[int], batch_size: int = 1000) -> Dict[int, Dict[str, str]]:
+        """
+        Brings the info of many songs, from the song cache and, for the songs not cached, from the database
+        with a query per batch, which are then cached.
+
+        :param song_ids: song identifiers.
+        :param batch_size: number of query's batches.
+        :return: a dictionary with the songs (value) by their identifiers (key), songs not found are left out.
+        """
+        songs, missing = self.song_cache.get_many(song_ids)
+        if not missing:
+            return songs
+
+        fetched = {}
         with self.cursor(dictionary=True) as cur:
-            cur.execute(self.SELECT_SONG, (song_id,))
-            return cur.fetchone()
+            for index in range(0, len(missing), batch_size):
+                # Create our IN part of the query
+                query = self.SELECT_SONGS_BY_IDS % ', '.join(['%s'] * len(missing[index: index + batch_size]))
+
+                cur.execute(query, missing[index: index + batch_size])
+                for row in cur.fetchall():
+                    song = dict(row)
+                    fetched[song.pop(FIELD_SONG_ID)] = song
+
+        self.song_cache.put_many(fetched)
+        songs.update(fetched)
+        return songs
 
     def insert(self, fingerprint: str, song_id: int, offset: int):
         """
@@ -118,12 +216,29 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
         with self.cursor() as cur:
             cur.execute(self.INSERT_FINGERPRINT, (fingerprint, song_id, offset))
 
-    @abc.abstractmethod
     def insert_song(self, song_name: str, file_hash: str, total_hashes: int) -> int:
         """
         Inserts a song name into the database, returns the new
         identifier of the song.
 
+        :param song_name: The name of the song.
+        :param file_hash: Hash from the fingerprinted file.
+        :param total_hashes: amount of hashes to be inserted on fingerprint table.
+        :return: the inserted id.
+        """
+        with self.cursor() as cur:
+            song_id = self._insert_song(cur, song_name, file_hash, total_hashes)
+
+        # a song deleted from the database may leave its id to a new one.
+        self.song_cache.invalidate([song_id])
+        return song_id
+
+    @abc.abstractmethod
+    def _insert_song(self, cur, song_name: str, file_hash: str, total_hashes: int) -> int:
+        """
+        Inserts a song name with the given cursor, returns the new identifier of the song.
+
+        :param cur: an open cursor.
         :param song_name: The name of the song.
         :param file_hash: Hash from the fingerprinted file.
         :param total_hashes: amount of hashes to be inserted on fingerprint table.
@@ -131,6 +246,36 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
         """
         pass
 
+    def insert_songs(self, songs: List[Tuple[str, str, List[Tuple[str, int]]]],
+                     batch_size: int = 1000) -> List[int]:
+        """
+        Inserts many songs along with their fingerprints, in a single transaction, and sets them as
+        fingerprinted.
+
+        :param songs: A sequence of tuples in the format (song name, file hash, hashes)
+            - hashes: A sequence of tuples in the format (hash, offset), SharedFingerprints or FingerprintParts
+        :param batch_size: fingerprints insert batches.
+        :return: the inserted ids.
+        """
+        song_ids = []
+        with self.cursor() as cur:
+            for song_name, file_hash, hashes in songs:
+                song_id = self._insert_song(cur, song_name, file_hash, len(hashes))
+
+                if isinstance(hashes, (SharedFingerprints, FingerprintParts)):
+                    # packed fingerprints are turned into rows column by column, with no tuple in between.
+                    values = list(zip(repeat(song_id), *hashes.columns()))
+                else:
+                    values = [(song_id, hsh, int(offset)) for hsh, offset in hashes]
+                for index in range(0, len(values), batch_size):
+                    cur.executemany(self.INSERT_FINGERPRINT, values[index: index + batch_size])
+
+                cur.execute(self.UPDATE_SONG_FINGERPRINTED, (song_id,))
+                song_ids.append(song_id)
+
+        self.song_cache.invalidate(song_ids)
+        return song_ids
+
     def query(self, fingerprint: str = None) -> List[Tuple]:
         """
         Returns all matching fingerprint entries associated with
@@ -170,52 +315,198 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
             for index in range(0, len(hashes), batch_size):
                 cur.executemany(self.INSERT_FINGERPRINT, values[index: index + batch_size])
 
-    def return_matches(self, hashes: List[Tuple[str, int]],
-                       batch_size: int = 1000) -> Tuple[List[Tuple[int, int]], Dict[int, int]]:
+    def return_matches(self, hashes: List[Tuple[str, int]], batch_size: int = 1000,
+                       max_postings: int = MAX_HASH_POSTINGS) -> Tuple[Tuple[np.ndarray, ...], Dict[int, int]]:
         """
-        Searches the database for pairs of (hash, offset) values.
+        Searches the database for pairs of (hash, offset) values. Hashes are looked up in batches, the way
+        each backend does best (see _lookup_hashes), the first one of batch_size hashes and the next ones
+        sized from the rows returned so far (see _lookup_batch_size).
 
         :param hashes: A sequence of tuples in the format (hash, offset)
             - hash: Part of a sha1 hash, in hexadecimal format
             - offset: Offset this hash was created from/at.
-        :param batch_size: number of query's batches.
-        :return: a list of (sid, offset_difference) tuples and a
+        :param batch_size: number of hashes looked up by the first statement.
+        :param max_postings: maximum number of rows a hash can have in the database to be matched, None
+        matches every hash.
+        :return: a tuple with the song id, offset difference and count arrays, with
+        the number of matches of each distinct (sid, offset_difference) pair, and a
         dictionary with the amount of hashes matched (not considering
         duplicated hashes) in each song.
             - song id: Song identifier
             - offset_difference: (database_offset - sampled_offset)
         """
+        # Hex hashes are looked up in upper case, which is how the database returns them,
+        # packed integer hashes come back just as they are.
+        normalize = int if self.hash_format in PACKED_HASH_LAYOUTS else str.upper
+
         # Create a dictionary of hash => offset pairs for later lookups
         mapper = {}
         for hsh, offset in hashes:
-            if hsh.upper() in mapper.keys():
-                mapper[hsh.upper()].append(offset)
-            else:
-                mapper[hsh.upper()] = [offset]
+            mapper.setdefault(normalize(hsh), []).append(offset)
 
         values = list(mapper.keys())
 
-        # in order to count each hash only once per db offset we use the dic below
-        dedup_hashes = {}
+        # rows are counted by song and offset difference as they are fetched, each one once for every offset
+        # its hash was sampled at, and each one once per song in dedup_hashes.
+        histogram = MatchHistogram(mapper, max_postings=max_postings)
 
-        results = []
         with self.cursor() as cur:
-            for index in range(0, len(values), batch_size):
-                # Create our IN part of the query
-                query = self.SELECT_MULTIPLE % ', '.join([self.IN_MATCH] * len(values[index: index + batch_size]))
+            self._start_lookup(cur, values)
+            try:
+                start, size, nrows = 0, batch_size, 0
+                while start < len(values):
+                    stop = min(start + size, len(values))
+                    self._lookup_hashes(cur, values, start, stop)
+
+                    while True:
+                        rows = cur.fetchmany(MATCH_FETCH_SIZE)
+                        if not rows:
+                            break
+                        histogram.fold(rows)
+                        nrows += len(rows)
+
+                    # every row of the hashes of the batch is fetched by now.
+                    histogram.flush()
+                    start = stop
+                    size = self._lookup_batch_size(start, nrows, batch_size)
+            finally:
+                self._finish_lookup(cur)
+
+            return histogram.matches(), histogram.dedup_hashes
+
+    def _start_lookup(self, cur, values: List[str]) -> None:
+        """
+        Gets ready to look up the hashes of a recording (see _lookup_hashes), e.g. by loading them into a
+        temporary table or by preparing the lookup statement. Nothing to do for the IN lists.
+
+        :param cur: an open cursor, the one the hashes are looked up with.
+        :param values: every distinct hash of the recording, as it is looked up.
+        """
+        pass
+
+    def _lookup_hashes(self, cur, values: List[str], start: int, stop: int) -> None:
+        """
+        Executes the statement looking up a batch of the hashes of a recording, whose rows (hash, song id and
+        offset) are then fetched from the cursor. Hashes are given as an IN list here, with a placeholder each.
+
+        :param cur: an open cursor.
+        :param values: every distinct hash of the recording, as it is looked up.
+        :param start: index of the first hash of the batch.
+        :param stop: index of the last hash (not included) of the batch.
+        """
+        cur.execute(self.SELECT_MULTIPLE % ', '.join([self.IN_MATCH] * (stop - start)), values[start:stop])
+
+    def _finish_lookup(self, cur) -> None:
+        """
+        Cleans up what _start_lookup left in the session, once every hash is looked up (or it failed).
+
+        :param cur: an open cursor.
+        """
+        pass
+
+    def _lookup_batch_size(self, done: int, nrows: int, batch_size: int) -> int:
+        """
+        Number of hashes the next lookup statement looks up, so it returns about MATCH_BATCH_ROWS rows going by
+        the rows per hash of the hashes looked up so far, and at most LOOKUP_BATCH_LIMIT of them.
+
+        :param done: number of hashes looked up so far.
+        :param nrows: number of rows they returned.
+        :param batch_size: number of hashes the first statement looked up.
+        :return: the number of hashes.
+        """
+        limit = self.LOOKUP_BATCH_LIMIT or batch_size
+        if nrows == 0:
+            return limit
+        return int(min(max(MATCH_BATCH_ROWS * done // nrows, 1), limit))
+
+    def _cleanup(self, cur, query: str) -> None:
+        """
+        Executes a statement cleaning up the session after a query (e.g. dropping a temporary table), which
+        also runs after the query failed.
+
+        :param cur: an open cursor.
+        :param query: the statement.
+        """
+        cur.execute(query)
+
+    def supports_aligned_matches(self) -> bool:
+        """
+        Tells whether the database can count the matches by song and offset difference itself (see
+        return_aligned_matches), which takes window functions.
+
+        :return: True if it can.
+        """
+        return True
+
+    def return_aligned_matches(self, hashes: List[Tuple[str, int]], topn: int = TOPN,
+                               max_postings: int = MAX_HASH_POSTINGS,
+                               batch_size: int = 1000) -> Tuple[Tuple[np.ndarray, ...], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values as return_matches does, but the matches are
+        counted by song and offset difference in the database, which only returns the best offset difference
+        of the topn songs instead of every matching fingerprint. The pairs are loaded into a temporary table
+        (see _load_query_hashes), which the fingerprints are joined with. Databases which can't count them
+        (see supports_aligned_matches) return every match as return_matches does, which gives the same topn
+        songs once aligned.
+
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format
+            - offset: Offset this hash was created from/at.
+        :param topn: number of songs returned.
+        :param max_postings: maximum number of rows a hash can have in the database to be matched, None
+        matches every hash.
+        :param batch_size: number of pairs loaded (or hashes deleted) by each statement.
+        :return: a tuple with the song id, offset difference and count arrays, with
+        the best offset difference of each one of the topn songs, and a dictionary
+        with the amount of hashes matched (not considering duplicated hashes) in
+        each one of them.
+        """
+        if not self.supports_aligned_matches():
+            return self.return_matches(hashes, batch_size=batch_size, max_postings=max_postings)
+
+        normalize = int if self.hash_format in PACKED_HASH_LAYOUTS else str.upper
+        pairs = [(normalize(hsh), offset) for hsh, offset in hashes]
+
+        dedup_hashes = {}
+        with self.cursor() as cur:
+            cur.execute(self.DROP_QUERY_TABLE)
+            cur.execute(self.CREATE_QUERY_TABLE)
+            try:
+                self._load_query_hashes(cur, pairs, batch_size)
 
-                cur.execute(query, values[index: index + batch_size])
+                if max_postings:
+                    # hashes too common to be matched are left out, they are few but have most of the rows.
+                    cur.execute(self.SELECT_COMMON_QUERY_HASHES, (max_postings,))
+                    common = [hsh for hsh, in cur.fetchall()]
+                    for index in range(0, len(common), batch_size):
+                        batch = common[index: index + batch_size]
+                        cur.execute(self.DELETE_QUERY_HASHES % ', '.join(['%s'] * len(batch)), batch)
 
-                for hsh, sid, offset in cur:
-                    if sid not in dedup_hashes.keys():
-                        dedup_hashes[sid] = 1
-                    else:
-                        dedup_hashes[sid] += 1
-                    #  we now evaluate all offset for each  hash matched
-                    for song_sampled_offset in mapper[hsh]:
-                        results.append((sid, offset - song_sampled_offset))
+                cur.execute(self.SELECT_ALIGNED_MATCHES, (topn,))
+                rows = cur.fetchall()
 
-            return results, dedup_hashes
+                if rows:
+                    song_ids = [sid for sid, _, _ in rows]
+                    cur.execute(self.SELECT_QUERY_HASHES_MATCHED % ', '.join(['%s'] * len(song_ids)), song_ids)
+                    dedup_hashes = {sid: count for sid, count in cur.fetchall()}
+            finally:
+                self._cleanup(cur, self.DROP_QUERY_TABLE)
+
+        song_ids, offsets, counts = np.array(rows, dtype=np.int64).reshape(-1, 3).T
+        return (song_ids, offsets, counts), dedup_hashes
+
+    def _load_query_hashes(self, cur, pairs: List[Tuple[str, int]], batch_size: int) -> None:
+        """
+        Loads the (hash, offset) pairs of a recording into the temporary query table, with multi-row inserts.
+
+        :param cur: an open cursor, the one the query table was created with.
+        :param pairs: tuples of hash (as it is looked up) and offset.
+        :param batch_size: number of pairs inserted by each statement.
+        """
+        for index in range(0, len(pairs), batch_size):
+            batch = pairs[index: index + batch_size]
+            cur.execute(self.INSERT_QUERY_HASHES % ', '.join([self.QUERY_HASH_VALUES] * len(batch)),
+                        [value for pair in batch for value in pair])
 
     def delete_songs_by_id(self, song_ids: List[int], batch_size: int = 1000) -> None:
         """
@@ -230,3 +521,5 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
                 query = self.DELETE_SONGS % ', '.join(['%s'] * len(song_ids[index: index + batch_size]))
 
                 cur.execute(query, song_ids[index: index + batch_size])
+
+        self.song_cache.invalidate(song_ids)
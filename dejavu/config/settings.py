@@ -47,6 +47,49 @@ FINGERPRINTS_TABLENAME = "fingerprints"
 FIELD_HASH = 'hash'
 FIELD_OFFSET = 'offset'
 
+# TEMPORARY TABLE OF THE HASHES OF A RECORDING (see the server_side_matching config)
+QUERY_TABLENAME = "query_hashes"
+
+# TEMPORARY TABLE OF THE HASHES OF A RECORDING LOOKED UP BY BATCHES (MySQL only, see MySQLDatabase._lookup_hashes)
+LOOKUP_TABLENAME = "lookup_hashes"
+
+# Number of fingerprinted songs inserted into the database at a time, in a single transaction, when
+# fingerprinting a directory. Their fingerprints are kept in memory until then.
+SONG_INSERT_BATCH_SIZE = 10
+
+# Number of fingerprints inserted into the database by each statement.
+FINGERPRINT_INSERT_BATCH_SIZE = 1000
+
+# When fingerprinting a directory, fingerprinted songs are written into the database by this many
+# threads, each one with its own connection, while more files are fingerprinted. At most
+# INGESTION_QUEUE_SIZE batches of songs wait for a writer; past that the fingerprinting waits too.
+INGESTION_WRITERS = 2
+INGESTION_QUEUE_SIZE = 4
+
+# Number of files looked up in the database at a time, to know whether they were already fingerprinted,
+# when the hashes of the fingerprinted songs are not preloaded (see the preload_song_hashes config).
+SONG_LOOKUP_BATCH_SIZE = 100
+
+# Number of songs whose metadata (name, file sha1 and number of hashes) is kept in memory by song id, so the
+# results of a recognition are formatted without querying the database for each song. 0 disables it (see the
+# song_cache_size config).
+SONG_CACHE_SIZE = 10000
+
+# Number of rows fetched at a time when looking up the hashes of a recording, which are counted by song
+# and offset difference as they arrive (see MatchHistogram), instead of keeping every match in memory.
+MATCH_FETCH_SIZE = 10000
+
+# Number of rows each statement looking up the hashes of a recording aims to return. After the first one, the
+# number of hashes each statement looks up is tuned from the rows per hash returned so far, so recordings of
+# common hashes take smaller batches (the rows of a whole batch may be held in memory) and those of rare
+# hashes fewer statements.
+MATCH_BATCH_ROWS = 100000
+
+# Hashes with more rows than this in the database are left out when recognizing, as they are so common
+# they match about every song and add little but work. None counts every hash (see the max_hash_postings
+# config).
+MAX_HASH_POSTINGS = None
+
 # FINGERPRINTS CONFIG:
 # This is used as connectivity parameter for scipy.generate_binary_structure function. This parameter
 # changes the morphology mask when looking for maximum peaks on the spectrogram matrix.
@@ -56,6 +99,15 @@ FIELD_OFFSET = 'offset'
 # And 2 sets a square mask, i.e. all elements are considered neighbors.
 CONNECTIVITY_MASK = 2
 
+# How peaks are found in the spectrogram. Possible values are:
+# "morphology": a maximum filter with the neighborhood footprint plus the erosion of the zero background,
+#   which is the original implementation.
+# "separable": finds the very same peaks for the square mask (CONNECTIVITY_MASK = 2), but it does the
+#   maximum filter as two 1D passes and skips the erosion whenever the minimum amplitude is not negative.
+#   With the diamond mask it just falls back to "morphology".
+PEAK_BACKENDS = ["morphology", "separable"]
+PEAK_BACKEND = "separable"
+
 # Sampling rate, related to the Nyquist conditions, which affects
 # the range frequencies we can detect.
 DEFAULT_FS = 44100
@@ -82,6 +134,19 @@ DEFAULT_AMP_MIN = 10
 # fingerprints and faster matching, but can potentially affect accuracy.
 PEAK_NEIGHBORHOOD_SIZE = 10  # 20 was the original value.
 
+# Optional peak selection in order to bound the number of fingerprints regardless of how busy the audio is.
+# PEAK_DENSITY_CAP: when set, only the strongest PEAK_DENSITY_CAP peaks are kept in every block of
+#   PEAK_DENSITY_WINDOW frames by 1 / PEAK_DENSITY_BANDS of the frequency bins, so there are at most
+#   PEAK_DENSITY_CAP * PEAK_DENSITY_BANDS peaks per window, and in turn at most DEFAULT_FAN_VALUE hashes
+#   per peak (~22 frames are a second of audio with the default window size, overlap and sampling rate).
+# PEAK_ADAPTIVE_THRESHOLD: when set, a peak must also be this many dB above the mean level of its own
+#   frame, so loud passages don't produce more peaks just because more bins are over DEFAULT_AMP_MIN.
+# None disables them, which keeps the fingerprints as they have always been.
+PEAK_DENSITY_CAP = None
+PEAK_DENSITY_WINDOW = 22
+PEAK_DENSITY_BANDS = 4
+PEAK_ADAPTIVE_THRESHOLD = None
+
 # Thresholds on how close or far fingerprints can be in time in order
 # to be paired as a fingerprint. If your max is too low, higher values of
 # DEFAULT_FAN_VALUE may not perform as expected.
@@ -98,5 +163,69 @@ PEAK_SORT = True
 # with potentially lesser collisions of matches.
 FINGERPRINT_REDUCTION = 20
 
+# How the peak pairs are turned into hashes. Possible values are:
+# "sha1": the truncated sha1 hex digest of each pair, this is the original format so it's the one
+#   to use in order to keep matching audios fingerprinted with previous versions.
+# "mixed": a hex digest of the same length computed by integer mixing, which is done in batch for all
+#   the pairs and is several times faster than sha1, but it is not compatible with sha1 catalogs.
+# "int32" and "int64": freq1, freq2 and t_delta packed directly into an integer, no hashing involved.
+#   These are stored in an integer hash column, which makes both the fingerprints table and its
+#   index smaller, but they need a database created with the same format.
+FINGERPRINT_HASH_FORMATS = ["sha1", "mixed", "int32", "int64"]
+FINGERPRINT_HASH_FORMAT = "sha1"
+
+# Number of bits given to freq1, freq2 and t_delta respectively in the packed integer hash formats.
+# Frequencies must fit in their bits (i.e. DEFAULT_WINDOW_SIZE / 2 + 1 frequency bins) and so must
+# the range between MIN_HASH_TIME_DELTA and MAX_HASH_TIME_DELTA.
+PACKED_HASH_LAYOUTS = {
+    "int32": (12, 12, 8),
+    "int64": (24, 24, 16)
+}
+
+# Number of seconds of audio fingerprinted at a time when fingerprinting files, so the memory
+# needed for the spectrogram is bounded no matter how long the audio is.
+FINGERPRINT_BLOCK_SECONDS = 60
+
+# Number of frames of the clips fingerprinted together by fingerprint_batch which are transformed and searched
+# for peaks at once, so the fixed cost of those is paid once for several clips (a 10 seconds clip is about 215
+# frames with the default window size, overlap and sampling rate). Clips longer than that go on their own.
+FINGERPRINT_BATCH_FRAMES = 1024
+
+# Default size cap in bytes of the on-disk fingerprint cache (when one is configured), the least
+# recently used entries are evicted beyond it.
+FINGERPRINT_CACHE_SIZE = 2**30
+
+# How audio files are decoded. Possible values are:
+# "pydub": pydub AudioSegment, which loads the whole file in memory and copies it a couple of times.
+# "ffmpeg": the 16 bit PCM output of ffmpeg is piped straight into numpy buffers (in blocks when
+#   fingerprinting files), and downmixing and resampling are done by ffmpeg itself. It needs the ffmpeg
+#   binary (FFMPEG_BINARY), if it can't be found pydub is used instead. Resampling is not done the same
+#   way as with pydub, so with an analysis rate the hashes differ from those of a database fingerprinted
+#   with pydub.
+# Wav files are read by WavReader with either one, unless ffmpeg resamples them.
+DECODER_BACKENDS = ["pydub", "ffmpeg"]
+DECODER_BACKEND = "pydub"
+FFMPEG_BINARY = "ffmpeg"
+
+# Number of threads scanning directories for audio files, which overlap the latency of listing each
+# directory (e.g. on network mounts). Files are handed out as soon as they are found.
+SCAN_THREADS = 8
+
+# Files are fingerprinted longest first, out of the ones found so far, so a long file doesn't hold a
+# whole directory back by being picked up last. The length of wav files is read from their header, and
+# that of any other file is estimated from its size, assuming this bitrate (bits per second).
+SCHEDULE_BITRATE = 192000
+
+# Wav files (which can be decoded from any sample on, unless ffmpeg resamples them) longer than this
+# number of seconds are split in time ranges about this long, which are fingerprinted in parallel by
+# different workers and then put back together, with the very same fingerprints as the whole file.
+# None never splits files.
+FINGERPRINT_SPLIT_SECONDS = 600
+
 # Number of results being returned for file recognition
 TOPN = 2
+
+# Number of consecutive offset differences whose matches are counted together when aligning them, so a
+# recording which drifts a few frames (e.g. played slightly faster or slower) still lines up. 1 counts
+# every offset on its own, which is how they were always aligned.
+ALIGN_BIN_SIZE = 1
@@ -1,18 +1,30 @@
 import queue
+import re
+from typing import List
 
 import mysql.connector
-from mysql.connector.errors import DatabaseError
+from mysql.connector.errors import DatabaseError, ProgrammingError
 
 from dejavu.base_classes.common_database import CommonDatabase
 from dejavu.config.settings import (FIELD_FILE_SHA1, FIELD_FINGERPRINTED,
                                     FIELD_HASH, FIELD_OFFSET, FIELD_SONG_ID,
                                     FIELD_SONGNAME, FIELD_TOTAL_HASHES,
-                                    FINGERPRINTS_TABLENAME, SONGS_TABLENAME)
+                                    FINGERPRINT_HASH_FORMAT,
+                                    FINGERPRINTS_TABLENAME, LOOKUP_TABLENAME,
+                                    QUERY_TABLENAME, SONG_CACHE_SIZE,
+                                    SONGS_TABLENAME)
 
 
 class MySQLDatabase(CommonDatabase):
     type = "mysql"
 
+    # batches are ranges of the lookup table, only limited by the rows returned (see MATCH_BATCH_ROWS).
+    LOOKUP_BATCH_LIMIT = 50000
+
+    # first versions with window functions, which server side matching takes (see supports_aligned_matches).
+    WINDOW_FUNCTIONS_VERSION = (8, 0)
+    MARIADB_WINDOW_FUNCTIONS_VERSION = (10, 2)
+
     # CREATES
     CREATE_SONGS_TABLE = f"""
         CREATE TABLE IF NOT EXISTS `{SONGS_TABLENAME}` (
@@ -25,6 +37,7 @@ class MySQLDatabase(CommonDatabase):
         ,   `date_modified` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
         ,   CONSTRAINT `pk_{SONGS_TABLENAME}_{FIELD_SONG_ID}` PRIMARY KEY (`{FIELD_SONG_ID}`)
         ,   CONSTRAINT `uq_{SONGS_TABLENAME}_{FIELD_SONG_ID}` UNIQUE KEY (`{FIELD_SONG_ID}`)
+        ,   INDEX `ix_{SONGS_TABLENAME}_{FIELD_FILE_SHA1}` (`{FIELD_FILE_SHA1}`)
         ) ENGINE=INNODB;
     """
 
@@ -78,6 +91,16 @@ class MySQLDatabase(CommonDatabase):
         WHERE `{FIELD_SONG_ID}` = %s;
     """
 
+    SELECT_SONGS_BY_IDS = f"""
+        SELECT
+            `{FIELD_SONG_ID}`
+        ,   `{FIELD_SONGNAME}`
+        ,   HEX(`{FIELD_FILE_SHA1}`) AS `{FIELD_FILE_SHA1}`
+        ,   `{FIELD_TOTAL_HASHES}`
+        FROM `{SONGS_TABLENAME}`
+        WHERE `{FIELD_SONG_ID}` IN (%s);
+    """
+
     SELECT_NUM_FINGERPRINTS = f"SELECT COUNT(*) AS n FROM `{FINGERPRINTS_TABLENAME}`;"
 
     SELECT_UNIQUE_SONG_IDS = f"""
@@ -97,6 +120,18 @@ class MySQLDatabase(CommonDatabase):
         WHERE `{FIELD_FINGERPRINTED}` = 1;
     """
 
+    SELECT_SONG_HASHES = f"""
+        SELECT HEX(`{FIELD_FILE_SHA1}`)
+        FROM `{SONGS_TABLENAME}`
+        WHERE `{FIELD_FINGERPRINTED}` = 1;
+    """
+
+    SELECT_SONG_HASHES_IN = f"""
+        SELECT HEX(`{FIELD_FILE_SHA1}`)
+        FROM `{SONGS_TABLENAME}`
+        WHERE `{FIELD_FINGERPRINTED}` = 1 AND `{FIELD_FILE_SHA1}` IN (%s);
+    """
+
     # DROPS
     DROP_FINGERPRINTS = f"DROP TABLE IF EXISTS `{FINGERPRINTS_TABLENAME}`;"
     DROP_SONGS = f"DROP TABLE IF EXISTS `{SONGS_TABLENAME}`;"
@@ -117,37 +152,285 @@ class MySQLDatabase(CommonDatabase):
 
     # IN
     IN_MATCH = f"UNHEX(%s)"
+    IN_FILE_SHA1_MATCH = "UNHEX(%s)"
+
+    # HASH LOOKUP: the hashes of a recording are loaded into a temporary table, by their position, and each batch
+    # is joined with the fingerprints by a statement prepared once for all of them, given its range of positions.
+    CREATE_LOOKUP_TABLE = f"""
+        CREATE TEMPORARY TABLE `{LOOKUP_TABLENAME}` (
+            `position` INT UNSIGNED NOT NULL
+        ,   `{FIELD_HASH}` BINARY(10) NOT NULL
+        ,   PRIMARY KEY USING BTREE (`position`)
+        ) ENGINE=MEMORY;
+    """
 
-    def __init__(self, **options):
-        super().__init__()
+    # executemany rewrites it into multi-row inserts.
+    INSERT_LOOKUP_HASHES = f"INSERT INTO `{LOOKUP_TABLENAME}` (`position`, `{FIELD_HASH}`) VALUES (%s, UNHEX(%s));"
+
+    PREPARE_LOOKUP = "PREPARE lookup_hashes FROM %s;"
+
+    SELECT_LOOKUP = f"""
+        SELECT HEX(f.`{FIELD_HASH}`), f.`{FIELD_SONG_ID}`, f.`{FIELD_OFFSET}`
+        FROM `{LOOKUP_TABLENAME}` q
+        INNER JOIN `{FINGERPRINTS_TABLENAME}` f ON f.`{FIELD_HASH}` = q.`{FIELD_HASH}`
+        WHERE q.`position` >= ? AND q.`position` < ?
+    """
+
+    SET_LOOKUP_RANGE = "SET @lookup_start = %s, @lookup_stop = %s;"
+
+    EXECUTE_LOOKUP = "EXECUTE lookup_hashes USING @lookup_start, @lookup_stop;"
+
+    DEALLOCATE_LOOKUP = "DEALLOCATE PREPARE lookup_hashes;"
+
+    DROP_LOOKUP_TABLE = f"DROP TEMPORARY TABLE IF EXISTS `{LOOKUP_TABLENAME}`;"
+
+    # SERVER SIDE MATCHING (a temporary table can only be referred to once in each statement)
+    CREATE_QUERY_TABLE = f"""
+        CREATE TEMPORARY TABLE `{QUERY_TABLENAME}` (
+            `{FIELD_HASH}` BINARY(10) NOT NULL
+        ,   `{FIELD_OFFSET}` INT NOT NULL
+        ,   INDEX `ix_{QUERY_TABLENAME}_{FIELD_HASH}` (`{FIELD_HASH}`)
+        ) ENGINE=MEMORY;
+    """
+
+    INSERT_QUERY_HASHES = f"INSERT INTO `{QUERY_TABLENAME}` (`{FIELD_HASH}`, `{FIELD_OFFSET}`) VALUES %s;"
+
+    QUERY_HASH_VALUES = "(UNHEX(%s), %s)"
+
+    SELECT_COMMON_QUERY_HASHES = f"""
+        SELECT `{FIELD_HASH}`
+        FROM `{FINGERPRINTS_TABLENAME}`
+        WHERE `{FIELD_HASH}` IN (SELECT `{FIELD_HASH}` FROM `{QUERY_TABLENAME}`)
+        GROUP BY `{FIELD_HASH}`
+        HAVING COUNT(*) > %s;
+    """
+
+    DELETE_QUERY_HASHES = f"DELETE FROM `{QUERY_TABLENAME}` WHERE `{FIELD_HASH}` IN (%s);"
+
+    # the best offset difference of each song (the smallest one among ties), and the songs with the most
+    # matches at it (the smallest song ids among ties).
+    SELECT_ALIGNED_MATCHES = f"""
+        SELECT `{FIELD_SONG_ID}`, `difference`, `matches`
+        FROM (
+            SELECT
+                `{FIELD_SONG_ID}`
+            ,   `difference`
+            ,   `matches`
+            ,   ROW_NUMBER() OVER (PARTITION BY `{FIELD_SONG_ID}` ORDER BY `matches` DESC, `difference`) AS `ranking`
+            FROM (
+                SELECT
+                    f.`{FIELD_SONG_ID}`
+                ,   CAST(f.`{FIELD_OFFSET}` AS SIGNED) - q.`{FIELD_OFFSET}` AS `difference`
+                ,   COUNT(*) AS `matches`
+                FROM `{FINGERPRINTS_TABLENAME}` f
+                INNER JOIN `{QUERY_TABLENAME}` q ON q.`{FIELD_HASH}` = f.`{FIELD_HASH}`
+                GROUP BY f.`{FIELD_SONG_ID}`, `difference`
+            ) AS `counts`
+        ) AS `best`
+        WHERE `ranking` = 1
+        ORDER BY `matches` DESC, `{FIELD_SONG_ID}`
+        LIMIT %s;
+    """
+
+    SELECT_QUERY_HASHES_MATCHED = f"""
+        SELECT `{FIELD_SONG_ID}`, COUNT(*)
+        FROM `{FINGERPRINTS_TABLENAME}`
+        WHERE `{FIELD_HASH}` IN (SELECT `{FIELD_HASH}` FROM `{QUERY_TABLENAME}`) AND `{FIELD_SONG_ID}` IN (%s)
+        GROUP BY `{FIELD_SONG_ID}`;
+    """
+
+    DROP_QUERY_TABLE = f"DROP TEMPORARY TABLE IF EXISTS `{QUERY_TABLENAME}`;"
+
+    SELECT_VERSION = "SELECT VERSION();"
+
+    # PACKED INTEGER HASH FORMATS
+    PACKED_HASH_TYPES = {"int32": "INT", "int64": "BIGINT"}
+
+    CREATE_PACKED_FINGERPRINTS_TABLE = f"""
+        CREATE TABLE IF NOT EXISTS `{FINGERPRINTS_TABLENAME}` (
+            `{FIELD_HASH}` {{hash_type}} NOT NULL
+        ,   `{FIELD_SONG_ID}` MEDIUMINT UNSIGNED NOT NULL
+        ,   `{FIELD_OFFSET}` INT UNSIGNED NOT NULL
+        ,   `date_created` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ,   `date_modified` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ,   INDEX `ix_{FINGERPRINTS_TABLENAME}_{FIELD_HASH}` (`{FIELD_HASH}`)
+        ,   CONSTRAINT `uq_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}_{FIELD_OFFSET}_{FIELD_HASH}`
+                UNIQUE KEY  (`{FIELD_SONG_ID}`, `{FIELD_OFFSET}`, `{FIELD_HASH}`)
+        ,   CONSTRAINT `fk_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}` FOREIGN KEY (`{FIELD_SONG_ID}`)
+                REFERENCES `{SONGS_TABLENAME}`(`{FIELD_SONG_ID}`) ON DELETE CASCADE
+    ) ENGINE=INNODB;
+    """
+
+    INSERT_PACKED_FINGERPRINT = f"""
+        INSERT IGNORE INTO `{FINGERPRINTS_TABLENAME}` (
+                `{FIELD_SONG_ID}`
+            ,   `{FIELD_HASH}`
+            ,   `{FIELD_OFFSET}`)
+        VALUES (%s, %s, %s);
+    """
+
+    SELECT_PACKED = f"""
+        SELECT `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`
+        FROM `{FINGERPRINTS_TABLENAME}`
+        WHERE `{FIELD_HASH}` = %s;
+    """
+
+    SELECT_PACKED_MULTIPLE = f"""
+        SELECT `{FIELD_HASH}`, `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`
+        FROM `{FINGERPRINTS_TABLENAME}`
+        WHERE `{FIELD_HASH}` IN (%s);
+    """
+
+    IN_PACKED_MATCH = "%s"
+
+    CREATE_PACKED_LOOKUP_TABLE = f"""
+        CREATE TEMPORARY TABLE `{LOOKUP_TABLENAME}` (
+            `position` INT UNSIGNED NOT NULL
+        ,   `{FIELD_HASH}` {{hash_type}} NOT NULL
+        ,   PRIMARY KEY USING BTREE (`position`)
+        ) ENGINE=MEMORY;
+    """
+
+    INSERT_PACKED_LOOKUP_HASHES = f"INSERT INTO `{LOOKUP_TABLENAME}` (`position`, `{FIELD_HASH}`) VALUES (%s, %s);"
+
+    SELECT_PACKED_LOOKUP = f"""
+        SELECT f.`{FIELD_HASH}`, f.`{FIELD_SONG_ID}`, f.`{FIELD_OFFSET}`
+        FROM `{LOOKUP_TABLENAME}` q
+        INNER JOIN `{FINGERPRINTS_TABLENAME}` f ON f.`{FIELD_HASH}` = q.`{FIELD_HASH}`
+        WHERE q.`position` >= ? AND q.`position` < ?
+    """
+
+    CREATE_PACKED_QUERY_TABLE = f"""
+        CREATE TEMPORARY TABLE `{QUERY_TABLENAME}` (
+            `{FIELD_HASH}` {{hash_type}} NOT NULL
+        ,   `{FIELD_OFFSET}` INT NOT NULL
+        ,   INDEX `ix_{QUERY_TABLENAME}_{FIELD_HASH}` (`{FIELD_HASH}`)
+        ) ENGINE=MEMORY;
+    """
+
+    PACKED_QUERY_HASH_VALUES = "(%s, %s)"
+
+    def __init__(self, hash_format: str = FINGERPRINT_HASH_FORMAT, song_cache_size: int = SONG_CACHE_SIZE,
+                 **options):
+        super().__init__(hash_format, song_cache_size)
         self.cursor = cursor_factory(**options)
         self._options = options
 
+        # whether the server has window functions, asked the first time it is needed.
+        self._window_functions = None
+        # whether the hashes of a recording are looked up through the lookup table, until it can't be created.
+        self._lookup_table = True
+
+        if hash_format in self.PACKED_HASH_TYPES:
+            self.CREATE_LOOKUP_TABLE = self.CREATE_PACKED_LOOKUP_TABLE.format(
+                hash_type=self.PACKED_HASH_TYPES[hash_format]
+            )
+            self.INSERT_LOOKUP_HASHES = self.INSERT_PACKED_LOOKUP_HASHES
+            self.SELECT_LOOKUP = self.SELECT_PACKED_LOOKUP
+
     def after_fork(self) -> None:
         # Clear the cursor cache, we don't want any stale connections from
         # the previous process.
         Cursor.clear_cache()
 
-    def insert_song(self, song_name: str, file_hash: str, total_hashes: int) -> int:
+    def _insert_song(self, cur, song_name: str, file_hash: str, total_hashes: int) -> int:
         """
-        Inserts a song name into the database, returns the new
-        identifier of the song.
+        Inserts a song name with the given cursor, returns the new identifier of the song.
 
+        :param cur: an open cursor.
         :param song_name: The name of the song.
         :param file_hash: Hash from the fingerprinted file.
         :param total_hashes: amount of hashes to be inserted on fingerprint table.
         :return: the inserted id.
         """
-        with self.cursor() as cur:
-            cur.execute(self.INSERT_SONG, (song_name, file_hash, total_hashes))
-            return cur.lastrowid
+        cur.execute(self.INSERT_SONG, (song_name, file_hash, total_hashes))
+        return cur.lastrowid
+
+    def supports_aligned_matches(self) -> bool:
+        """
+        Tells whether the server has window functions (MySQL 8.0 or MariaDB 10.2 on), which server side
+        matching takes (see return_aligned_matches). Older ones count the matches client side.
+
+        :return: True if it does.
+        """
+        if self._window_functions is None:
+            with self.cursor() as cur:
+                cur.execute(self.SELECT_VERSION)
+                version, = cur.fetchone()
+            self._window_functions = self._has_window_functions(version)
+        return self._window_functions
+
+    @classmethod
+    def _has_window_functions(cls, version: str) -> bool:
+        """
+        Tells whether a server version has window functions.
+
+        :param version: version of the server, as VERSION() gives it (e.g. "8.0.36" or "10.6.16-MariaDB").
+        :return: True if it does.
+        """
+        numbers = tuple(int(number) for number in re.findall(r"\d+", version.split("-")[0])[:2])
+        if "mariadb" in version.lower():
+            return numbers >= cls.MARIADB_WINDOW_FUNCTIONS_VERSION
+        return numbers >= cls.WINDOW_FUNCTIONS_VERSION
+
+    def _start_lookup(self, cur, values: List[str]) -> None:
+        """
+        Loads the hashes of a recording into the temporary lookup table and prepares the statement looking
+        them up. If the table can't be created or the statement prepared (e.g. without the CREATE TEMPORARY
+        TABLES privilege), hashes are looked up by IN lists instead from then on.
+
+        :param cur: an open cursor, the one the hashes are looked up with.
+        :param values: every distinct hash of the recording, as it is looked up.
+        """
+        if not self._lookup_table:
+            return
+
+        try:
+            cur.execute(self.DROP_LOOKUP_TABLE)
+            cur.execute(self.CREATE_LOOKUP_TABLE)
+            cur.executemany(self.INSERT_LOOKUP_HASHES, list(enumerate(values)))
+            cur.execute(self.PREPARE_LOOKUP, (self.SELECT_LOOKUP,))
+        except ProgrammingError:
+            self._cleanup(cur, self.DROP_LOOKUP_TABLE)
+            self._lookup_table = False
+            # IN lists have a placeholder per hash, so they are limited to the batch_size of return_matches.
+            self.LOOKUP_BATCH_LIMIT = None
+
+    def _lookup_hashes(self, cur, values: List[str], start: int, stop: int) -> None:
+        """
+        Executes the prepared lookup statement for a batch of the hashes of a recording, by their positions
+        in the lookup table.
+
+        :param cur: an open cursor.
+        :param values: every distinct hash of the recording, as it is looked up.
+        :param start: index of the first hash of the batch.
+        :param stop: index of the last hash (not included) of the batch.
+        """
+        if not self._lookup_table:
+            super()._lookup_hashes(cur, values, start, stop)
+            return
+
+        cur.execute(self.SET_LOOKUP_RANGE, (start, stop))
+        cur.execute(self.EXECUTE_LOOKUP)
+
+    def _finish_lookup(self, cur) -> None:
+        """
+        Deallocates the lookup statement and drops the lookup table.
+
+        :param cur: an open cursor.
+        """
+        if not self._lookup_table:
+            return
+
+        self._cleanup(cur, self.DEALLOCATE_LOOKUP)
+        self._cleanup(cur, self.DROP_LOOKUP_TABLE)
 
     def __getstate__(self):
-        return self._options,
+        return self.hash_format, self.song_cache.max_size, self._options
 
     def __setstate__(self, state):
-        self._options, = state
-        self.cursor = cursor_factory(**self._options)
+        hash_format, song_cache_size, self._options = state
+        self.__init__(hash_format, song_cache_size, **self._options)
 
 
 def cursor_factory(**factory_options):
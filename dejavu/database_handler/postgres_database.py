@@ -1,18 +1,25 @@
 import queue
+from typing import List, Tuple
 
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
 from psycopg2.extras import DictCursor
 
 from dejavu.base_classes.common_database import CommonDatabase
 from dejavu.config.settings import (FIELD_FILE_SHA1, FIELD_FINGERPRINTED,
                                     FIELD_HASH, FIELD_OFFSET, FIELD_SONG_ID,
                                     FIELD_SONGNAME, FIELD_TOTAL_HASHES,
-                                    FINGERPRINTS_TABLENAME, SONGS_TABLENAME)
+                                    FINGERPRINT_HASH_FORMAT,
+                                    FINGERPRINTS_TABLENAME, QUERY_TABLENAME,
+                                    SONG_CACHE_SIZE, SONGS_TABLENAME)
 
 
 class PostgreSQLDatabase(CommonDatabase):
     type = "postgres"
 
+    # arrays are not limited by the number of placeholders, only by the rows returned (see MATCH_BATCH_ROWS).
+    LOOKUP_BATCH_LIMIT = 50000
+
     # CREATES
     CREATE_SONGS_TABLE = f"""
         CREATE TABLE IF NOT EXISTS "{SONGS_TABLENAME}" (
@@ -26,6 +33,9 @@ class PostgreSQLDatabase(CommonDatabase):
         ,   CONSTRAINT "pk_{SONGS_TABLENAME}_{FIELD_SONG_ID}" PRIMARY KEY ("{FIELD_SONG_ID}")
         ,   CONSTRAINT "uq_{SONGS_TABLENAME}_{FIELD_SONG_ID}" UNIQUE ("{FIELD_SONG_ID}")
         );
+
+        CREATE INDEX IF NOT EXISTS "ix_{SONGS_TABLENAME}_{FIELD_FILE_SHA1}" ON "{SONGS_TABLENAME}"
+        ("{FIELD_FILE_SHA1}");
     """
 
     CREATE_FINGERPRINTS_TABLE = f"""
@@ -88,6 +98,16 @@ class PostgreSQLDatabase(CommonDatabase):
         WHERE "{FIELD_SONG_ID}" = %s;
     """
 
+    SELECT_SONGS_BY_IDS = f"""
+        SELECT
+            "{FIELD_SONG_ID}"
+        ,   "{FIELD_SONGNAME}"
+        ,   upper(encode("{FIELD_FILE_SHA1}", 'hex')) AS "{FIELD_FILE_SHA1}"
+        ,   "{FIELD_TOTAL_HASHES}"
+        FROM "{SONGS_TABLENAME}"
+        WHERE "{FIELD_SONG_ID}" IN (%s);
+    """
+
     SELECT_NUM_FINGERPRINTS = f'SELECT COUNT(*) AS n FROM "{FINGERPRINTS_TABLENAME}";'
 
     SELECT_UNIQUE_SONG_IDS = f"""
@@ -107,6 +127,18 @@ class PostgreSQLDatabase(CommonDatabase):
         WHERE "{FIELD_FINGERPRINTED}" = 1;
     """
 
+    SELECT_SONG_HASHES = f"""
+        SELECT upper(encode("{FIELD_FILE_SHA1}", 'hex'))
+        FROM "{SONGS_TABLENAME}"
+        WHERE "{FIELD_FINGERPRINTED}" = 1;
+    """
+
+    SELECT_SONG_HASHES_IN = f"""
+        SELECT upper(encode("{FIELD_FILE_SHA1}", 'hex'))
+        FROM "{SONGS_TABLENAME}"
+        WHERE "{FIELD_FINGERPRINTED}" = 1 AND "{FIELD_FILE_SHA1}" IN (%s);
+    """
+
     # DROPS
     DROP_FINGERPRINTS = F'DROP TABLE IF EXISTS "{FINGERPRINTS_TABLENAME}";'
     DROP_SONGS = F'DROP TABLE IF EXISTS "{SONGS_TABLENAME}";'
@@ -130,37 +162,236 @@ class PostgreSQLDatabase(CommonDatabase):
 
     # IN
     IN_MATCH = f"decode(%s, 'hex')"
+    IN_FILE_SHA1_MATCH = "decode(%s, 'hex')"
 
-    def __init__(self, **options):
-        super().__init__()
+    # HASH LOOKUP: the hashes of each batch are given as a single array parameter to a statement, which is
+    # prepared (parsed and planned) once for all the batches of a recording.
+    PREPARE_LOOKUP = f"""
+        PREPARE "lookup_hashes" (BYTEA[]) AS
+        SELECT upper(encode("{FIELD_HASH}", 'hex')), "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_TABLENAME}"
+        WHERE "{FIELD_HASH}" = ANY($1);
+    """
+
+    EXECUTE_LOOKUP = 'EXECUTE "lookup_hashes" (%s);'
+
+    DEALLOCATE_LOOKUP = 'DEALLOCATE "lookup_hashes";'
+
+    # SERVER SIDE MATCHING
+    CREATE_QUERY_TABLE = f"""
+        CREATE TEMPORARY TABLE "{QUERY_TABLENAME}" (
+            "{FIELD_HASH}" BYTEA NOT NULL
+        ,   "{FIELD_OFFSET}" INT NOT NULL
+        );
+    """
+
+    INSERT_QUERY_HASHES = f'INSERT INTO "{QUERY_TABLENAME}" ("{FIELD_HASH}", "{FIELD_OFFSET}") VALUES %s;'
+
+    QUERY_HASH_VALUES = "(decode(%s, 'hex'), %s)"
+
+    # the pairs are given as two array parameters instead, so they are loaded by a single statement.
+    INSERT_QUERY_HASH_ARRAYS = f"""
+        INSERT INTO "{QUERY_TABLENAME}" ("{FIELD_HASH}", "{FIELD_OFFSET}")
+        SELECT decode(h, 'hex'), o FROM unnest(%s::TEXT[], %s::INT[]) AS pairs(h, o);
+    """
+
+    # temporary tables are not analyzed by autovacuum, the planner needs their statistics for the join.
+    ANALYZE_QUERY_TABLE = f'ANALYZE "{QUERY_TABLENAME}";'
+
+    SELECT_COMMON_QUERY_HASHES = f"""
+        SELECT "{FIELD_HASH}"
+        FROM "{FINGERPRINTS_TABLENAME}"
+        WHERE "{FIELD_HASH}" IN (SELECT "{FIELD_HASH}" FROM "{QUERY_TABLENAME}")
+        GROUP BY "{FIELD_HASH}"
+        HAVING COUNT(*) > %s;
+    """
+
+    DELETE_QUERY_HASHES = f'DELETE FROM "{QUERY_TABLENAME}" WHERE "{FIELD_HASH}" IN (%s);'
+
+    # the best offset difference of each song (the smallest one among ties), and the songs with the most
+    # matches at it (the smallest song ids among ties).
+    SELECT_ALIGNED_MATCHES = f"""
+        SELECT "{FIELD_SONG_ID}", "difference", "matches"
+        FROM (
+            SELECT
+                "{FIELD_SONG_ID}"
+            ,   "difference"
+            ,   "matches"
+            ,   ROW_NUMBER() OVER (PARTITION BY "{FIELD_SONG_ID}" ORDER BY "matches" DESC, "difference") AS "ranking"
+            FROM (
+                SELECT
+                    f."{FIELD_SONG_ID}"
+                ,   f."{FIELD_OFFSET}" - q."{FIELD_OFFSET}" AS "difference"
+                ,   COUNT(*) AS "matches"
+                FROM "{FINGERPRINTS_TABLENAME}" f
+                INNER JOIN "{QUERY_TABLENAME}" q ON q."{FIELD_HASH}" = f."{FIELD_HASH}"
+                GROUP BY f."{FIELD_SONG_ID}", "difference"
+            ) AS "counts"
+        ) AS "best"
+        WHERE "ranking" = 1
+        ORDER BY "matches" DESC, "{FIELD_SONG_ID}"
+        LIMIT %s;
+    """
+
+    SELECT_QUERY_HASHES_MATCHED = f"""
+        SELECT "{FIELD_SONG_ID}", COUNT(*)
+        FROM "{FINGERPRINTS_TABLENAME}"
+        WHERE "{FIELD_HASH}" IN (SELECT "{FIELD_HASH}" FROM "{QUERY_TABLENAME}") AND "{FIELD_SONG_ID}" IN (%s)
+        GROUP BY "{FIELD_SONG_ID}";
+    """
+
+    DROP_QUERY_TABLE = f'DROP TABLE IF EXISTS "{QUERY_TABLENAME}";'
+
+    # PACKED INTEGER HASH FORMATS
+    PACKED_HASH_TYPES = {"int32": "INTEGER", "int64": "BIGINT"}
+
+    CREATE_PACKED_FINGERPRINTS_TABLE = f"""
+        CREATE TABLE IF NOT EXISTS "{FINGERPRINTS_TABLENAME}" (
+            "{FIELD_HASH}" {{hash_type}} NOT NULL
+        ,   "{FIELD_SONG_ID}" INT NOT NULL
+        ,   "{FIELD_OFFSET}" INT NOT NULL
+        ,   "date_created" TIMESTAMP NOT NULL DEFAULT now()
+        ,   "date_modified" TIMESTAMP NOT NULL DEFAULT now()
+        ,   CONSTRAINT "uq_{FINGERPRINTS_TABLENAME}" UNIQUE  ("{FIELD_SONG_ID}", "{FIELD_OFFSET}", "{FIELD_HASH}")
+        ,   CONSTRAINT "fk_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}" FOREIGN KEY ("{FIELD_SONG_ID}")
+                REFERENCES "{SONGS_TABLENAME}"("{FIELD_SONG_ID}") ON DELETE CASCADE
+        );
+
+        CREATE INDEX IF NOT EXISTS "ix_{FINGERPRINTS_TABLENAME}_{FIELD_HASH}" ON "{FINGERPRINTS_TABLENAME}"
+        USING hash ("{FIELD_HASH}");
+    """
+
+    INSERT_PACKED_FINGERPRINT = f"""
+        INSERT INTO "{FINGERPRINTS_TABLENAME}" (
+                "{FIELD_SONG_ID}"
+            ,   "{FIELD_HASH}"
+            ,   "{FIELD_OFFSET}")
+        VALUES (%s, %s, %s) ON CONFLICT DO NOTHING;
+    """
+
+    SELECT_PACKED = f"""
+        SELECT "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_TABLENAME}"
+        WHERE "{FIELD_HASH}" = %s;
+    """
+
+    SELECT_PACKED_MULTIPLE = f"""
+        SELECT "{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_TABLENAME}"
+        WHERE "{FIELD_HASH}" IN (%s);
+    """
+
+    IN_PACKED_MATCH = "%s"
+
+    PREPARE_PACKED_LOOKUP = f"""
+        PREPARE "lookup_hashes" ({{hash_type}}[]) AS
+        SELECT "{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_TABLENAME}"
+        WHERE "{FIELD_HASH}" = ANY($1);
+    """
+
+    CREATE_PACKED_QUERY_TABLE = f"""
+        CREATE TEMPORARY TABLE "{QUERY_TABLENAME}" (
+            "{FIELD_HASH}" {{hash_type}} NOT NULL
+        ,   "{FIELD_OFFSET}" INT NOT NULL
+        );
+    """
+
+    PACKED_QUERY_HASH_VALUES = "(%s, %s)"
+
+    INSERT_PACKED_QUERY_HASH_ARRAYS = f"""
+        INSERT INTO "{QUERY_TABLENAME}" ("{FIELD_HASH}", "{FIELD_OFFSET}")
+        SELECT h, o FROM unnest(%s::BIGINT[], %s::INT[]) AS pairs(h, o);
+    """
+
+    def __init__(self, hash_format: str = FINGERPRINT_HASH_FORMAT, song_cache_size: int = SONG_CACHE_SIZE,
+                 **options):
+        super().__init__(hash_format, song_cache_size)
         self.cursor = cursor_factory(**options)
         self._options = options
 
+        if hash_format in self.PACKED_HASH_TYPES:
+            self.INSERT_QUERY_HASH_ARRAYS = self.INSERT_PACKED_QUERY_HASH_ARRAYS
+            self.PREPARE_LOOKUP = self.PREPARE_PACKED_LOOKUP.format(hash_type=self.PACKED_HASH_TYPES[hash_format])
+
     def after_fork(self) -> None:
         # Clear the cursor cache, we don't want any stale connections from
         # the previous process.
         Cursor.clear_cache()
 
-    def insert_song(self, song_name: str, file_hash: str, total_hashes: int) -> int:
+    def _insert_song(self, cur, song_name: str, file_hash: str, total_hashes: int) -> int:
         """
-        Inserts a song name into the database, returns the new
-        identifier of the song.
+        Inserts a song name with the given cursor, returns the new identifier of the song.
 
+        :param cur: an open cursor.
         :param song_name: The name of the song.
         :param file_hash: Hash from the fingerprinted file.
         :param total_hashes: amount of hashes to be inserted on fingerprint table.
         :return: the inserted id.
         """
-        with self.cursor() as cur:
-            cur.execute(self.INSERT_SONG, (song_name, file_hash, total_hashes))
-            return cur.fetchone()[0]
+        cur.execute(self.INSERT_SONG, (song_name, file_hash, total_hashes))
+        return cur.fetchone()[0]
+
+    def _load_query_hashes(self, cur, pairs: List[Tuple[str, int]], batch_size: int) -> None:
+        """
+        Loads the (hash, offset) pairs of a recording into the temporary query table, all of them at once
+        as array parameters.
+
+        :param cur: an open cursor, the one the query table was created with.
+        :param pairs: tuples of hash (as it is looked up) and offset.
+        :param batch_size: unused, the pairs are loaded by a single statement.
+        """
+        cur.execute(self.INSERT_QUERY_HASH_ARRAYS, ([hsh for hsh, _ in pairs], [offset for _, offset in pairs]))
+        cur.execute(self.ANALYZE_QUERY_TABLE)
+
+    def _start_lookup(self, cur, values: List[str]) -> None:
+        """
+        Prepares the statement looking up the hashes of a recording.
+
+        :param cur: an open cursor, the one the hashes are looked up with.
+        :param values: every distinct hash of the recording, as it is looked up.
+        """
+        cur.execute(self.PREPARE_LOOKUP)
+
+    def _lookup_hashes(self, cur, values: List[str], start: int, stop: int) -> None:
+        """
+        Executes the prepared lookup statement for a batch of the hashes of a recording, given as an array.
+
+        :param cur: an open cursor.
+        :param values: every distinct hash of the recording, as it is looked up.
+        :param start: index of the first hash of the batch.
+        :param stop: index of the last hash (not included) of the batch.
+        """
+        batch = values[start:stop]
+        if self.hash_format not in self.PACKED_HASH_TYPES:
+            batch = [bytes.fromhex(hsh) for hsh in batch]
+        cur.execute(self.EXECUTE_LOOKUP, (batch,))
+
+    def _finish_lookup(self, cur) -> None:
+        """
+        Deallocates the lookup statement.
+
+        :param cur: an open cursor.
+        """
+        self._cleanup(cur, self.DEALLOCATE_LOOKUP)
+
+    def _cleanup(self, cur, query: str) -> None:
+        """
+        Executes a statement cleaning up the session after a query, unless the query failed and aborted the
+        transaction, which then rejects any statement until it is rolled back.
+
+        :param cur: an open cursor.
+        :param query: the statement.
+        """
+        if cur.connection.get_transaction_status() != TRANSACTION_STATUS_INERROR:
+            cur.execute(query)
 
     def __getstate__(self):
-        return self._options,
+        return self.hash_format, self.song_cache.max_size, self._options
 
     def __setstate__(self, state):
-        self._options, = state
-        self.cursor = cursor_factory(**self._options)
+        hash_format, song_cache_size, self._options = state
+        self.__init__(hash_format, song_cache_size, **self._options)
 
 
 def cursor_factory(**factory_options):
@@ -0,0 +1,287 @@
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+
+from dejavu.config.settings import ALIGN_BIN_SIZE, TOPN
+
+# Packed keys are counted with bincount while their range is at most this many times the number of matches,
+# and by sorting them (np.unique) otherwise, which takes no memory for the keys missing in between.
+BINCOUNT_DENSITY = 4
+
+# Matches a MatchHistogram folds in before merging them with the distinct ones counted so far, at least.
+MATCH_MERGE_SIZE = 1 << 20
+
+
+def match_arrays(matches: Union[Iterable[Tuple[int, int]], Tuple[np.ndarray, ...]]) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Turns the matches found in the database into a song id and an offset difference array, along with the
+    number of matches of each pair if they are already counted (see MatchHistogram).
+
+    :param matches: tuples of song id and offset difference, or a tuple with both arrays (and the counts).
+    :return: a tuple with the song id, the offset difference and the count arrays, the latter None if every
+    pair is a single match.
+    """
+    if isinstance(matches, tuple) and len(matches) in (2, 3) and isinstance(matches[0], np.ndarray):
+        counts = matches[2] if len(matches) == 3 else None
+        return np.asarray(matches[0], dtype=np.int64), np.asarray(matches[1], dtype=np.int64), counts
+
+    matches = matches if isinstance(matches, list) else list(matches)
+    # flattening the tuples is several times faster than numpy converting them one by one.
+    flat = np.fromiter(chain.from_iterable(matches), dtype=np.int64, count=2 * len(matches))
+    return flat[0::2], flat[1::2], None
+
+
+def align(song_ids: np.ndarray, offsets: np.ndarray, counts: np.ndarray = None, topn: int = TOPN,
+          bin_size: int = ALIGN_BIN_SIZE) -> List[Tuple[int, int, int]]:
+    """
+    Finds the offset difference most matches of each song agree on, and the songs with the most matches
+    aligned that way. Matches are counted by (song id, offset) packed into a single integer key, the best
+    offset of each song is the first one of its keys with the highest count, and the top songs are picked by
+    partitioning their counts, so no Python object is created per match.
+
+    Ties are broken as a sort of the matches would: the smallest offset of a song, and the smallest song id
+    among songs with the same count.
+
+    :param song_ids: song id of each match.
+    :param offsets: offset difference (database offset - sampled offset) of each match.
+    :param counts: number of matches of each pair of song id and offset difference, None if every pair is a
+    single match.
+    :param topn: number of songs returned.
+    :param bin_size: number of consecutive offsets counted together, so matches a few frames apart (e.g.
+    because of a playback speed drift) add up. The offset returned is the most common one in the best bin of
+    each song. 1 counts each offset on its own.
+    :return: a list of tuples with the song id, the offset and the number of aligned matches of the topn songs,
+    best first.
+    """
+    if len(song_ids) == 0 or topn <= 0:
+        return []
+
+    song_ids = np.asarray(song_ids, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    bins = offsets // bin_size if bin_size > 1 else offsets
+
+    weights = counts
+    keys, span, low = _pack(song_ids, bins)
+
+    # counts of each (song id, bin), sorted by song id and then by bin.
+    if span * (int(song_ids.max()) + 1) <= BINCOUNT_DENSITY * len(keys):
+        counts = _sum(np.bincount(keys, weights=weights))
+        keys = np.flatnonzero(counts)
+        counts = counts[keys]
+    elif weights is None:
+        keys, counts = np.unique(keys, return_counts=True)
+    else:
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = _sum(np.bincount(inverse, weights=weights))
+    key_songs, key_bins = keys // span, keys % span + low
+
+    # the best bin of each song: its highest count, the first one (smallest bin) among ties.
+    order = np.lexsort((-counts, key_songs))
+    heads = order[np.r_[True, key_songs[order][1:] != key_songs[order][:-1]]]
+    songs, best_bins, best_counts = key_songs[heads], key_bins[heads], counts[heads]
+
+    # the topn songs: the highest counts, the smallest song ids among ties.
+    if len(songs) > topn:
+        threshold = best_counts[np.argpartition(-best_counts, topn - 1)[:topn]].min()
+        candidates = np.flatnonzero(best_counts >= threshold)
+    else:
+        candidates = np.arange(len(songs))
+    top = candidates[np.argsort(-best_counts[candidates], kind="stable")][:topn]
+
+    results = []
+    for index in top:
+        song_id, offset, count = int(songs[index]), int(best_bins[index]), int(best_counts[index])
+        if bin_size > 1:
+            in_bin = (song_ids == song_id) & (bins == offset)
+            offset = _bin_offset(offsets[in_bin], weights[in_bin] if weights is not None else None)
+        results.append((song_id, offset, count))
+
+    return results
+
+
+def _pack(song_ids: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, int, int]:
+    """
+    Packs song ids and offsets (or bins) into single integer keys, which sort by song id and then by offset.
+
+    :param song_ids: song id of each match.
+    :param values: offset (or bin) of each match.
+    :return: a tuple with the keys, the number of different values a key can hold for each song, and the
+    smallest value, which keys are counted from.
+    """
+    low = int(values.min())
+    span = int(values.max()) - low + 1
+
+    if (int(song_ids.max()) + 1) * span > np.iinfo(np.int64).max:
+        raise OverflowError("Song ids and offsets are too large to be aligned")
+
+    return song_ids * span + (values - low), span, low
+
+
+def _bin_offset(offsets: np.ndarray, counts: np.ndarray = None) -> int:
+    """
+    Most common offset of the matches in a bin, the smallest one among ties.
+
+    :param offsets: offset of each match in the bin.
+    :param counts: number of matches of each offset, None if each one is a single match.
+    :return: the offset.
+    """
+    if counts is None:
+        values, counts = np.unique(offsets, return_counts=True)
+    else:
+        values, inverse = np.unique(offsets, return_inverse=True)
+        counts = np.bincount(inverse, weights=counts)
+    return int(values[np.argmax(counts)])
+
+
+def _sum(counts: np.ndarray) -> np.ndarray:
+    """
+    Counts added up by bincount, which are floats when they are weighted.
+
+    :param counts: bincount output.
+    :return: the counts as integers.
+    """
+    return counts if counts.dtype == np.int64 else np.rint(counts).astype(np.int64)
+
+
+class MatchHistogram(object):
+    """
+    Counts the matches of a query by song id and offset difference, folding in the rows the database returns
+    as they are fetched (see fold), instead of keeping a tuple for every row and every sampled offset of its
+    hash. Rows are counted in arrays, whose distinct (song id, offset difference) pairs are merged whenever
+    the pending ones outnumber them, so the memory used is bounded by the distinct pairs (which the candidate
+    songs have a few of each), not by the matches.
+
+    Hashes with more than max_postings rows (in the database), which are so common they match about every
+    song, can be left out altogether. Their rows are then held (as arrays) until the whole query batch they
+    are in is fetched (see flush), as only then the number of rows of each hash is known.
+    """
+    def __init__(self, sampled_offsets: Dict[Any, List[int]], max_postings: int = None):
+        """
+        :param sampled_offsets: offsets each hash was sampled at in the query, by hash as the database
+        returns it.
+        :param max_postings: maximum number of rows a hash can have to be counted, None counts every hash.
+        """
+        super().__init__()
+
+        self.max_postings = max_postings
+        # hashes matched (each row once, however many times its hash was sampled), by song id.
+        self.dedup_hashes = {}
+
+        self._index = {hsh: index for index, hsh in enumerate(sampled_offsets)}
+        # sampled offsets of every hash side by side, those of each one from its start on.
+        self._lengths = np.fromiter(map(len, sampled_offsets.values()), dtype=np.int64, count=len(sampled_offsets))
+        self._starts = np.cumsum(self._lengths) - self._lengths
+        self._sampled = np.fromiter(chain.from_iterable(sampled_offsets.values()), dtype=np.int64,
+                                    count=int(self._lengths.sum()))
+
+        self._held = []
+        self._keys = []
+        self._counts = []
+        self._pending = 0
+        self._merged = 0
+
+    def fold(self, rows: List[Tuple[Any, int, int]]) -> None:
+        """
+        Counts rows returned by the database.
+
+        :param rows: tuples of hash, song id and database offset.
+        """
+        if not rows:
+            return
+
+        hashes = np.fromiter((self._index[hsh] for hsh, _, _ in rows), dtype=np.int64, count=len(rows))
+        song_ids = np.fromiter((sid for _, sid, _ in rows), dtype=np.int64, count=len(rows))
+        offsets = np.fromiter((offset for _, _, offset in rows), dtype=np.int64, count=len(rows))
+
+        if self.max_postings:
+            self._held.append((hashes, song_ids, offsets))
+        else:
+            self._add(hashes, song_ids, offsets)
+
+    def flush(self) -> None:
+        """
+        Counts the rows held for the hashes of a query batch, once every row of its hashes is fetched, leaving
+        out those of the hashes with more than max_postings rows.
+        """
+        if not self._held:
+            return
+
+        hashes, song_ids, offsets = (np.concatenate(column) for column in zip(*self._held))
+        self._held = []
+
+        postings = np.bincount(hashes)
+        kept = postings[hashes] <= self.max_postings
+        self._add(hashes[kept], song_ids[kept], offsets[kept])
+
+    def matches(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Counts of the matches folded in so far.
+
+        :return: a tuple with the song id, the offset difference and the count arrays, one entry for each
+        distinct pair of song id and offset difference.
+        """
+        self.flush()
+        self._merge()
+        keys = self._keys[0] if self._keys else np.empty(0, dtype=np.int64)
+        counts = self._counts[0] if self._counts else np.empty(0, dtype=np.int64)
+        return keys >> 32, (keys & 0xFFFFFFFF) - 2 ** 31, counts
+
+    def _add(self, hashes: np.ndarray, song_ids: np.ndarray, offsets: np.ndarray) -> None:
+        """
+        Counts rows, each one matching every offset its hash was sampled at.
+
+        :param hashes: index of the hash of each row.
+        :param song_ids: song id of each row.
+        :param offsets: database offset of each row.
+        """
+        if len(song_ids) == 0:
+            return
+
+        ids, counts = np.unique(song_ids, return_counts=True)
+        for song_id, count in zip(ids.tolist(), counts.tolist()):
+            self.dedup_hashes[song_id] = self.dedup_hashes.get(song_id, 0) + count
+
+        # every row is repeated once for each sampled offset of its hash.
+        lengths = self._lengths[hashes]
+        total = int(lengths.sum())
+        positions = np.repeat(self._starts[hashes] - (np.cumsum(lengths) - lengths), lengths) + np.arange(total)
+        differences = np.repeat(offsets, lengths) - self._sampled[positions]
+
+        keys = _pack_fixed(np.repeat(song_ids, lengths), differences)
+        self._keys.append(keys)
+        self._counts.append(np.ones(len(keys), dtype=np.int64))
+        self._pending += len(keys)
+
+        if self._pending > max(self._merged, MATCH_MERGE_SIZE):
+            self._merge()
+
+    def _merge(self) -> None:
+        """
+        Merges the pending counts with those merged so far, one count per distinct key.
+        """
+        if self._pending == 0:
+            return
+
+        keys, inverse = np.unique(np.concatenate(self._keys), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate(self._counts)).astype(np.int64)
+
+        self._keys, self._counts = [keys], [counts]
+        self._merged = len(keys)
+        self._pending = 0
+
+
+def _pack_fixed(song_ids: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Packs song ids and offset differences into single integer keys, the song id in the upper 32 bits, so
+    keys packed separately can be merged.
+
+    :param song_ids: song id of each match.
+    :param offsets: offset difference of each match.
+    :return: the keys.
+    """
+    if song_ids.min() < 0 or song_ids.max() >= 2 ** 31 or offsets.min() < -2 ** 31 or offsets.max() >= 2 ** 31:
+        raise OverflowError("Song ids and offsets are too large to be counted")
+
+    return (song_ids << 32) | (offsets + 2 ** 31)
@@ -1,13 +1,17 @@
-import fnmatch
 import os
+import queue
+import threading
 from hashlib import sha1
-from typing import List, Tuple
+from typing import Any, Iterator, List, Tuple
 
 import numpy as np
 from pydub import AudioSegment
-from pydub.utils import audioop
+from scipy.signal import resample_poly
 
-from dejavu.third_party import wavio
+from dejavu.config.settings import (DECODER_BACKEND, DECODER_BACKENDS,
+                                    SCAN_THREADS)
+from dejavu.logic.ffmpeg_reader import FFmpegReader, ffmpeg_available
+from dejavu.logic.wav_reader import WavFormatError, WavReader
 
 
 def unique_hash(file_path: str, block_size: int = 2**20) -> str:
@@ -31,68 +35,437 @@ def unique_hash(file_path: str, block_size: int = 2**20) -> str:
     return s.hexdigest().upper()
 
 
-def find_files(path: str, extensions: List[str]) -> List[Tuple[str, str]]:
+def find_files(path: str, extensions: List[str], nthreads: int = SCAN_THREADS) -> Iterator[Tuple[str, str]]:
     """
     Get all files that meet the specified extensions.
 
+    Directories are listed by several threads at once, and files are yielded as soon as they are
+    found, in no particular order, so the caller can start working on them before the whole tree
+    has been scanned. As with os.walk, symbolic links to directories are not followed and
+    directories which can't be listed are skipped.
+
     :param path: path to a directory with audio files.
     :param extensions: file extensions to look for.
-    :return: a list of tuples with file name and its extension.
+    :param nthreads: number of threads listing directories.
+    :return: an iterator over tuples with file name and its extension.
     """
     # Allow both with ".mp3" and without "mp3" to be used for extensions
     extensions = [e.replace(".", "") for e in extensions]
+    suffixes = tuple(f".{extension}" for extension in extensions)
+
+    directories = queue.LifoQueue()
+    found = queue.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def scan() -> None:
+        while True:
+            directory = directories.get()
+            if directory is done:
+                break
+
+            try:
+                # once the caller stops iterating, the remaining directories are only dequeued.
+                if stop.is_set():
+                    continue
 
-    results = []
-    for dirpath, dirnames, files in os.walk(path):
-        for extension in extensions:
-            for f in fnmatch.filter(files, f"*.{extension}"):
-                p = os.path.join(dirpath, f)
-                results.append((p, extension))
-    return results
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+
+                        if is_dir:
+                            if not entry.is_symlink():
+                                directories.put(entry.path)
+                        elif entry.name.endswith(suffixes):
+                            for extension, suffix in zip(extensions, suffixes):
+                                if entry.name.endswith(suffix):
+                                    found.put((entry.path, extension))
+            except OSError:
+                pass
+            finally:
+                directories.task_done()
+
+    def finish() -> None:
+        # every directory has been listed once there are no unfinished ones in the queue.
+        directories.join()
+        for _ in threads:
+            directories.put(done)
+        found.put(done)
+
+    directories.put(path)
+    threads = [threading.Thread(target=scan, daemon=True) for _ in range(max(nthreads, 1))]
+    for thread in threads:
+        thread.start()
+    threading.Thread(target=finish, daemon=True).start()
+
+    try:
+        while True:
+            result = found.get()
+            if result is done:
+                break
+            yield result
+    finally:
+        # also when the caller stops iterating early.
+        stop.set()
 
 
-def read(file_name: str, limit: int = None) -> Tuple[List[List[int]], int, str]:
+def read(file_name: str, limit: int = None, analysis_rate: int = None, downmix: bool = False,
+         start: float = None, sha1_hash: Any = None, hash_file: bool = True) -> Tuple[List[List[int]], int, str]:
     """
     Reads any file supported by pydub (ffmpeg) and returns the data contained
-    within. If file reading fails due to input being a 24-bit wav file,
-    wavio is used as a backup.
+    within. With the "ffmpeg" DECODER_BACKEND, the output of ffmpeg is read
+    straight into a numpy buffer instead. Wav files are memory mapped (see
+    WavReader), unless ffmpeg is resampling them.
 
     Can be optionally limited to a certain amount of seconds from the start
     of the file by specifying the `limit` parameter. This is the amount of
-    seconds from the start of the file.
+    seconds from the start of the file, or from `start` seconds into the file
+    if given. Only that window of the file is decoded.
+
+    The channels can also be mixed down to mono and resampled to a lower rate
+    before fingerprinting (see resample).
+
+    The file is hashed with unique_hash once it is read. If a sha1 hash is
+    given, the whole file is hashed into it while it is read instead, so it is
+    not read twice (see read_blocks). Callers which don't use the hash can
+    skip it with `hash_file`, as hashing reads the whole file even when a short
+    window of it is decoded.
+
+    :param file_name: file to be read.
+    :param limit: number of seconds to limit.
+    :param analysis_rate: sampling rate the channels are resampled to, None keeps the file one.
+    :param downmix: whether the channels are mixed down into a single one.
+    :param start: number of seconds into the file where reading starts.
+    :param sha1_hash: hash to update with the content of the file while it is read (e.g. hashlib.sha1()).
+    :param hash_file: whether the file is hashed at all, if no sha1 hash is given.
+    :return: tuple list of (channels, sample_rate, content_file_hash), the hash being None if the file is not
+    hashed.
+    """
+    wav = _open_wav(file_name, analysis_rate)
+    if wav is not None:
+        data = wav.read(start=start, limit=limit, sha1_hash=sha1_hash)
+
+        # channels are just views over the interleaved samples.
+        channels, fs = resample([data[:, chn] for chn in range(wav.channels)], wav.fs, analysis_rate=analysis_rate,
+                                downmix=downmix)
+        return channels, fs, _file_hash(file_name, sha1_hash, hash_file)
+
+    if _use_ffmpeg():
+        with _HashingThread(file_name, sha1_hash), FFmpegReader(file_name, limit=limit, analysis_rate=analysis_rate,
+                                                                downmix=downmix, start=start) as reader:
+            data = reader.read()
+
+        # channels are just views over the interleaved samples.
+        return [data[:, chn] for chn in range(reader.channels)], reader.fs, _file_hash(file_name, sha1_hash,
+                                                                                       hash_file)
+
+    # pydub seeks (ffmpeg -ss) and stops (ffmpeg -t) on its own.
+    with _HashingThread(file_name, sha1_hash):
+        audiofile = AudioSegment.from_file(file_name, start_second=start, duration=limit or None)
+    if audiofile.sample_width != 2:
+        audiofile = audiofile.set_sample_width(2)
+
+    data = np.frombuffer(audiofile.raw_data, np.int16)
+
+    channels = []
+    for chn in range(audiofile.channels):
+        channels.append(data[chn::audiofile.channels])
+
+    channels, fs = resample(channels, audiofile.frame_rate, analysis_rate=analysis_rate, downmix=downmix)
+
+    return channels, fs, _file_hash(file_name, sha1_hash, hash_file)
+
+
+def read_blocks(file_name: str, block_seconds: int, limit: int = None, analysis_rate: int = None,
+                downmix: bool = False, start: float = None, sha1_hash: Any = None,
+                window: Tuple[int, int] = None) -> Iterator[Tuple[List[np.ndarray], int]]:
+    """
+    Reads a file in blocks of block_seconds, so it is never entirely in memory (for wav files and
+    with the "ffmpeg" DECODER_BACKEND, otherwise the file is read at once and then split in blocks).
+    There is always at least one block, even if it is empty.
+
+    If a sha1 hash is given, it is updated with the whole content of the file, which makes it the
+    same as unique_hash once every block has been read. Wav files are hashed from the same mapping
+    they are read from, and any other file by a thread reading it alongside the decoder, so the file
+    is read once from disk either way.
+
+    A window restricts the blocks to a range of the samples which would be read otherwise, the very
+    same ones. Seekable files (see seekable) are read right from the first sample of the window, and
+    any other file is decoded from the start (or start seconds into it) as usual and the samples before
+    the window are dropped, since decoders don't seek to the exact same samples.
+
+    :param file_name: file to be read.
+    :param block_seconds: number of seconds of each block.
+    :param limit: number of seconds to limit.
+    :param analysis_rate: sampling rate the channels are resampled to, None keeps the file one.
+    :param downmix: whether the channels are mixed down into a single one.
+    :param start: number of seconds into the file where reading starts.
+    :param sha1_hash: hash to update with the content of the file, if given (e.g. hashlib.sha1()).
+    :param window: a tuple with the first sample and the number of samples (None up to the end) read,
+    counted from start. A file can't be hashed while reading a window of it.
+    :return: an iterator over tuples of (channels, sample_rate) for each block.
+    """
+    if window is not None:
+        if sha1_hash is not None:
+            raise ValueError("A file can't be hashed while reading a window of it")
+        yield from _read_window(file_name, block_seconds, window, limit=limit, analysis_rate=analysis_rate,
+                                downmix=downmix, start=start)
+        return
+
+    wav = _open_wav(file_name, analysis_rate)
+    if wav is not None and not analysis_rate:
+        empty = True
+        for block in wav.blocks(block_seconds * wav.fs, start=start, limit=limit, sha1_hash=sha1_hash):
+            empty = False
+            yield resample([block[:, chn] for chn in range(wav.channels)], wav.fs, downmix=downmix)
+
+        if empty:
+            yield resample([np.empty(0, dtype=np.int16) for _ in range(wav.channels)], wav.fs, downmix=downmix)
+    elif _use_ffmpeg():
+        with _HashingThread(file_name, sha1_hash), FFmpegReader(file_name, limit=limit, analysis_rate=analysis_rate,
+                                                                downmix=downmix, start=start) as reader:
+            empty = True
+            for block in reader.blocks(block_seconds * reader.fs):
+                empty = False
+                yield [block[:, chn] for chn in range(reader.channels)], reader.fs
+
+            if empty:
+                yield [np.empty(0, dtype=np.int16) for _ in range(reader.channels)], reader.fs
+    else:
+        channels, fs, _ = read(file_name, limit, analysis_rate=analysis_rate, downmix=downmix, start=start,
+                               sha1_hash=sha1_hash)
+
+        block_size = block_seconds * fs
+        for index in range(0, max(len(channels[0]) if channels else 0, 1), block_size):
+            yield [channel[index:index + block_size] for channel in channels], fs
+
+
+def seekable(file_name: str, analysis_rate: int = None) -> bool:
+    """
+    Tells whether a file can be read from any sample on, exactly as if it was read from the start, which
+    is the case for wav files unless they are resampled.
+
+    :param file_name: file to be read.
+    :param analysis_rate: sampling rate the channels are resampled to.
+    :return: True if the file is seekable.
+    """
+    return _open_wav(file_name, analysis_rate) is not None and not analysis_rate
+
+
+def probe(file_name: str, analysis_rate: int = None, downmix: bool = False) -> Tuple[int, int, int]:
+    """
+    Reads the format of the audio read from a file (see read_blocks) without decoding it, from the header
+    of wav files or of the output of ffmpeg.
+
+    :param file_name: file to be read.
+    :param analysis_rate: sampling rate the channels are resampled to, None keeps the file one.
+    :param downmix: whether the channels are mixed down into a single one.
+    :return: a tuple with the number of channels, the sampling rate and the number of samples (per channel,
+    None if not known before decoding), or None if the format can't be read without decoding the file.
+    """
+    wav = _open_wav(file_name, analysis_rate)
+    if wav is not None:
+        channels = 1 if downmix else wav.channels
+        return (channels, wav.fs, wav.nframes) if not analysis_rate else (channels, analysis_rate, None)
+
+    if _use_ffmpeg():
+        # ffmpeg is stopped as soon as its output header is read.
+        with FFmpegReader(file_name, analysis_rate=analysis_rate, downmix=downmix) as reader:
+            return reader.channels, reader.fs, None
+
+    return None
+
+
+def _read_window(file_name: str, block_seconds: int, window: Tuple[int, int], limit: int = None,
+                 analysis_rate: int = None, downmix: bool = False,
+                 start: float = None) -> Iterator[Tuple[List[np.ndarray], int]]:
+    """
+    Reads a window of the samples read_blocks reads from a file (see read_blocks).
 
     :param file_name: file to be read.
+    :param block_seconds: number of seconds of each block.
+    :param window: a tuple with the first sample and the number of samples (None up to the end) read.
     :param limit: number of seconds to limit.
-    :return: tuple list of (channels, sample_rate, content_file_hash).
+    :param analysis_rate: sampling rate the channels are resampled to, None keeps the file one.
+    :param downmix: whether the channels are mixed down into a single one.
+    :param start: number of seconds into the file where reading starts.
+    :return: an iterator over tuples of (channels, sample_rate) for each block.
+    """
+    first, nsamples = window
+
+    if seekable(file_name, analysis_rate):
+        wav = WavReader(file_name)
+        # the same samples read_blocks would read, as WavReader.blocks rounds start and limit.
+        begin = min(int(round((start or 0) * wav.fs)), wav.nframes)
+        end = wav.nframes if not limit else min(begin + int(round(limit * wav.fs)), wav.nframes)
+
+        begin, end = min(begin + first, end), end if nsamples is None else min(begin + first + nsamples, end)
+        if begin == end:
+            yield resample([np.empty(0, dtype=np.int16) for _ in range(wav.channels)], wav.fs, downmix=downmix)
+        else:
+            yield from read_blocks(file_name, block_seconds, (end - begin) / wav.fs, downmix=downmix,
+                                   start=begin / wav.fs)
+        return
+
+    blocks = read_blocks(file_name, block_seconds, limit, analysis_rate=analysis_rate, downmix=downmix,
+                         start=start)
+    try:
+        empty = None
+        position = 0
+        for channels, fs in blocks:
+            length = len(channels[0]) if channels else 0
+            begin = min(max(first - position, 0), length)
+            end = length if nsamples is None else min(max(first + nsamples - position, 0), length)
+            position += length
+
+            if begin < end:
+                yield [channel[begin:end] for channel in channels], fs
+                empty = False
+            elif empty is None:
+                empty = [channel[0:0] for channel in channels], fs
+
+            # the decoding stops once the window is over.
+            if nsamples is not None and position >= first + nsamples:
+                break
+
+        if empty:
+            yield empty
+    finally:
+        blocks.close()
+
+
+class _HashingThread(threading.Thread):
+    """
+    Hashes a file in the background while it is decoded (as a context manager, which waits for the
+    hash to be complete when exiting). Both read the same pages of the file at about the same time,
+    so these are read once from disk and the hashing overlaps the decoding.
+    """
+    def __init__(self, file_name: str, sha1_hash: Any = None):
+        """
+        :param file_name: file to be hashed.
+        :param sha1_hash: hash to update with the content of the file, nothing is done if None.
+        """
+        super().__init__(daemon=True)
+
+        self.file_name = file_name
+        self.sha1_hash = sha1_hash
+        self.error = None
+        self._stop_hashing = threading.Event()
+
+    def run(self) -> None:
+        try:
+            with open(self.file_name, "rb") as f:
+                while not self._stop_hashing.is_set():
+                    buf = f.read(2**20)
+                    if not buf:
+                        break
+                    self.sha1_hash.update(buf)
+        except OSError as e:
+            self.error = e
+
+    def __enter__(self):
+        if self.sha1_hash is not None:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.sha1_hash is not None:
+            if exc_type is not None:
+                # the decoding failed or was abandoned, so the hash is of no use.
+                self._stop_hashing.set()
+            self.join()
+            if self.error is not None and exc_type is None:
+                raise self.error
+
+
+def _file_hash(file_name: str, sha1_hash: Any = None, hash_file: bool = True) -> str:
+    """
+    Hash of a file read by read, in the form unique_hash returns it.
+
+    :param file_name: file which was read.
+    :param sha1_hash: hash updated with the whole content of the file while it was read, if any.
+    :param hash_file: whether the file is hashed if no sha1 hash was given.
+    :return: the hash in an hexagesimal string form, None if the file is not hashed.
+    """
+    if sha1_hash is not None:
+        return sha1_hash.hexdigest().upper()
+    return unique_hash(file_name) if hash_file else None
+
+
+def _open_wav(file_name: str, analysis_rate: int = None) -> WavReader:
+    """
+    Opens the file with WavReader if it is a supported wav file, and it is not to be resampled by
+    ffmpeg (which must resample the same way when reading the whole file and when reading it in blocks).
+
+    :param file_name: file to be read.
+    :param analysis_rate: sampling rate the channels are resampled to.
+    :return: a WavReader, or None if the file is read some other way.
     """
-    # pydub does not support 24-bit wav files, use wavio when this occurs
+    if analysis_rate and _use_ffmpeg():
+        return None
+
     try:
-        audiofile = AudioSegment.from_file(file_name)
+        return WavReader(file_name)
+    except WavFormatError:
+        return None
+
+
+def backend() -> str:
+    """
+    Decoder files are actually read with, which may not be the DECODER_BACKEND selected (e.g. "ffmpeg" falls
+    back to "pydub" when ffmpeg is not available). Resampling and decoding differ between backends, so the
+    samples of a file may differ too.
+
+    :return: one of the DECODER_BACKENDS.
+    """
+    return "ffmpeg" if _use_ffmpeg() else "pydub"
 
-        if limit:
-            audiofile = audiofile[:limit * 1000]
 
-        data = np.fromstring(audiofile.raw_data, np.int16)
+def _use_ffmpeg() -> bool:
+    """
+    Tells whether files are decoded with the ffmpeg pipe.
+
+    :return: True if the ffmpeg DECODER_BACKEND is selected and ffmpeg is available.
+    """
+    if DECODER_BACKEND not in DECODER_BACKENDS:
+        raise ValueError(f"Unsupported decoder backend {DECODER_BACKEND}, must be one of {DECODER_BACKENDS}.")
 
-        channels = []
-        for chn in range(audiofile.channels):
-            channels.append(data[chn::audiofile.channels])
+    return DECODER_BACKEND == "ffmpeg" and ffmpeg_available()
 
-        audiofile.frame_rate
-    except audioop.error:
-        _, _, audiofile = wavio.readwav(file_name)
 
-        if limit:
-            audiofile = audiofile[:limit * 1000]
+def resample(channels: List[np.ndarray], fs: int, analysis_rate: int = None,
+             downmix: bool = False) -> Tuple[List[np.ndarray], int]:
+    """
+    Mixes the channels down to mono and/or resamples them to the analysis rate. Fingerprinting
+    11025 Hz mono instead of 44.1 kHz stereo means an eighth of the samples to transform.
+
+    :param channels: list of channels samples.
+    :param fs: sampling rate of the channels.
+    :param analysis_rate: sampling rate the channels are resampled to, None keeps fs.
+    :param downmix: whether the channels are mixed down into a single one.
+    :return: a tuple with the list of channels and their sampling rate.
+    """
+    if downmix and len(channels) > 1:
+        channels = [np.mean(np.asarray(channels, dtype=np.float32), axis=0)]
 
-        audiofile = audiofile.T
-        audiofile = audiofile.astype(np.int16)
+    if analysis_rate and analysis_rate != fs:
+        # polyphase resampling by the reduced ratio between rates, which low pass filters the
+        # channels before decimating them.
+        gcd = np.gcd(int(analysis_rate), int(fs))
+        up, down = int(analysis_rate) // gcd, int(fs) // gcd
+        channels = [resample_poly(np.asarray(channel, dtype=np.float32), up, down) for channel in channels]
+        fs = analysis_rate
 
-        channels = []
-        for chn in audiofile:
-            channels.append(chn)
+    channels = [
+        channel if np.asarray(channel).dtype == np.int16
+        else np.clip(np.rint(channel), -32768, 32767).astype(np.int16)
+        for channel in channels
+    ]
 
-    return channels, audiofile.frame_rate, unique_hash(file_name)
+    return channels, fs
 
 
 def get_audio_name_from_path(file_path: str) -> str:
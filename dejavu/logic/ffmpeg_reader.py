@@ -0,0 +1,171 @@
+import shutil
+import struct
+import subprocess
+from typing import BinaryIO, Iterator, Tuple
+
+import numpy as np
+from pydub.exceptions import CouldntDecodeError
+
+from dejavu.config.settings import FFMPEG_BINARY
+
+
+def ffmpeg_available() -> bool:
+    """
+    Tells whether the ffmpeg binary can be found.
+
+    :return: True if FFMPEG_BINARY is in the path.
+    """
+    return shutil.which(FFMPEG_BINARY) is not None
+
+
+class FFmpegReader(object):
+    """
+    Decodes any file ffmpeg supports by piping its output as 16 bit PCM, which is read straight into
+    numpy buffers, either in blocks or as a whole. Downmixing and resampling are done by ffmpeg
+    itself while decoding.
+
+    Usage:
+        with FFmpegReader(file_name, analysis_rate=11025) as reader:
+            for block in reader.blocks(block_frames):
+                ...  # block is an array of frames by reader.channels samples at reader.fs
+    """
+    def __init__(self, file_name: str, limit: int = None, analysis_rate: int = None, downmix: bool = False,
+                 start: float = None):
+        """
+        Starts the ffmpeg process and reads the format of its output.
+
+        :param file_name: file to be read.
+        :param limit: number of seconds to limit.
+        :param analysis_rate: sampling rate ffmpeg resamples the audio to, None keeps the file one.
+        :param downmix: whether ffmpeg mixes the channels down into a single one.
+        :param start: number of seconds into the file where decoding starts.
+        """
+        super().__init__()
+
+        self.file_name = file_name
+
+        command = [FFMPEG_BINARY, "-nostdin", "-v", "error"]
+        if start:
+            # as an input option, so ffmpeg seeks in the file instead of decoding up to start.
+            command += ["-ss", str(start)]
+        command += ["-i", file_name, "-map", "0:a:0"]
+        if limit:
+            command += ["-t", str(limit)]
+        if downmix:
+            command += ["-ac", "1"]
+        if analysis_rate:
+            command += ["-ar", str(analysis_rate)]
+        # a wav stream instead of raw PCM, so its header tells the output channels and sampling rate.
+        command += ["-f", "wav", "-acodec", "pcm_s16le", "-"]
+
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            self.channels, self.fs = self._read_header(self._process.stdout)
+        except Exception:
+            self.close()
+            raise
+
+    def blocks(self, block_frames: int) -> Iterator[np.ndarray]:
+        """
+        Reads the audio in blocks, each one in a new buffer filled in place from the pipe.
+
+        :param block_frames: number of frames (samples per channel) of each block.
+        :return: an iterator over arrays of frames by channels, the last one may be shorter.
+        """
+        while True:
+            block = np.empty((block_frames, self.channels), dtype=np.int16)
+            nframes = self._read_into(block)
+            if nframes > 0:
+                yield block[:nframes]
+            if nframes < block_frames:
+                break
+
+        self._wait()
+
+    def read(self) -> np.ndarray:
+        """
+        Reads the whole audio at once.
+
+        :return: an array of frames by channels.
+        """
+        # the output length isn't known beforehand, so the buffer grows by doubling its size. It is
+        # resized in place (realloc), which usually avoids copying what has been read so far.
+        data = np.empty((2**20, self.channels), dtype=np.int16)
+        nframes = 0
+        while True:
+            nframes += self._read_into(data[nframes:])
+            if nframes < len(data):
+                break
+            data.resize((2 * len(data), self.channels), refcheck=False)
+
+        self._wait()
+
+        data.resize((nframes, self.channels), refcheck=False)
+        return data
+
+    def close(self) -> None:
+        """
+        Stops ffmpeg if it is still running.
+        """
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._process.stdout.close()
+        self._process.stderr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _read_into(self, buffer: np.ndarray) -> int:
+        """
+        Fills the buffer with the output of ffmpeg, until it is full or the output ends.
+
+        :param buffer: array of frames by channels to fill.
+        :return: number of whole frames read.
+        """
+        view = memoryview(buffer).cast("B")
+        nbytes = 0
+        while nbytes < len(view):
+            read = self._process.stdout.readinto(view[nbytes:])
+            if not read:
+                break
+            nbytes += read
+
+        return nbytes // (2 * self.channels)
+
+    def _wait(self) -> None:
+        """
+        Waits for ffmpeg to finish and checks it did successfully.
+        """
+        if self._process.wait() != 0:
+            raise CouldntDecodeError(f"Decoding {self.file_name} with ffmpeg failed: "
+                                     f"{self._process.stderr.read().decode('utf8', 'replace').strip()}")
+
+    def _read_header(self, stream: BinaryIO) -> Tuple[int, int]:
+        """
+        Reads the wav header up to the start of the samples.
+
+        :param stream: ffmpeg output.
+        :return: a tuple with the number of channels and the sampling rate.
+        """
+        riff = stream.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:] != b"WAVE":
+            self._wait()
+            raise CouldntDecodeError(f"Decoding {self.file_name} with ffmpeg failed: no audio output")
+
+        channels, fs = None, None
+        while True:
+            chunk = stream.read(8)
+            if len(chunk) < 8:
+                raise CouldntDecodeError(f"Decoding {self.file_name} with ffmpeg failed: no audio data")
+
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"data":
+                return channels, fs
+
+            body = stream.read(size + size % 2)  # chunks are word aligned.
+            if chunk_id == b"fmt ":
+                channels, fs = struct.unpack("<HI", body[2:8])
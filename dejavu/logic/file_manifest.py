@@ -0,0 +1,126 @@
+import os
+import sqlite3
+from typing import Tuple
+
+import dejavu.logic.decoder as decoder
+
+
+class FileManifest(object):
+    """
+    Local record of the sha1 of the content of files (see decoder.unique_hash), so files which did not
+    change since they were hashed are not read again, e.g. when scanning a large directory for new files.
+
+    Files are keyed by their path, size, modification time and inode: if any of them changes, the file
+    is hashed again. The manifest is a sqlite database, which can be used from any thread (e.g. the one
+    feeding a multiprocessing pool) but from a single one at a time. Changes are written to it by commit
+    (and when closing it, which is done as a context manager).
+    """
+    def __init__(self, path: str):
+        """
+        Opens the manifest, creating it if needed.
+
+        :param path: path to the sqlite database file.
+        """
+        super().__init__()
+
+        self.path = path
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY
+            ,   size INTEGER NOT NULL
+            ,   mtime_ns INTEGER NOT NULL
+            ,   inode INTEGER NOT NULL
+            ,   sha1 TEXT NOT NULL
+            );
+        """)
+        self._connection.commit()
+
+    def get(self, file_path: str, stat: os.stat_result = None) -> str:
+        """
+        Looks for the sha1 of a file.
+
+        :param file_path: path to the file.
+        :param stat: result of os.stat for the file, if already known.
+        :return: the sha1 of the file content, or None if the file is not in the manifest or it changed
+        since it was hashed.
+        """
+        stat = stat or os.stat(file_path)
+        row = self._connection.execute(
+            "SELECT sha1 FROM files WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?;",
+            (self._key(file_path), *self._stat_key(stat))
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, file_path: str, file_hash: str, stat: os.stat_result = None) -> None:
+        """
+        Records the sha1 of a file.
+
+        :param file_path: path to the file.
+        :param file_hash: sha1 of the file content.
+        :param stat: result of os.stat for the file when it was hashed (or before), if already known.
+        """
+        stat = stat or os.stat(file_path)
+        self._connection.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, sha1) VALUES (?, ?, ?, ?, ?);",
+            (self._key(file_path), *self._stat_key(stat), file_hash)
+        )
+
+    def file_hash(self, file_path: str, stat: os.stat_result = None) -> str:
+        """
+        Gets the sha1 of a file from the manifest, hashing it (and recording it) only if it is not there.
+
+        :param file_path: path to the file.
+        :param stat: result of os.stat for the file, if already known.
+        :return: the sha1 of the file content.
+        """
+        # the file is stat before being hashed, so if it changes meanwhile it is hashed again next time.
+        stat = stat or os.stat(file_path)
+        file_hash = self.get(file_path, stat)
+        if file_hash is None:
+            file_hash = decoder.unique_hash(file_path)
+            self.put(file_path, file_hash, stat)
+        return file_hash
+
+    def commit(self) -> None:
+        """
+        Writes the changes to the manifest.
+        """
+        self._connection.commit()
+
+    def close(self) -> None:
+        """
+        Writes the changes and closes the manifest.
+        """
+        self._connection.commit()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _key(file_path: str) -> str:
+        """
+        Path a file is recorded with, which is the same wherever it is scanned from.
+
+        :param file_path: path to the file.
+        :return: the absolute path to the file.
+        """
+        return os.path.abspath(file_path)
+
+    @staticmethod
+    def _stat_key(stat: os.stat_result) -> Tuple[int, int, int]:
+        """
+        Attributes of a file which change whenever its content does.
+
+        :param stat: result of os.stat for the file.
+        :return: a tuple with the size, the modification time in nanoseconds and the inode of the file.
+        """
+        return stat.st_size, stat.st_mtime_ns, stat.st_ino
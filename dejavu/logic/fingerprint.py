@@ -1,11 +1,11 @@
 import hashlib
-from operator import itemgetter
-from typing import List, Tuple
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Tuple
 
-import matplotlib.mlab as mlab
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.ndimage.filters import maximum_filter
+from scipy.fft import rfft
+from scipy.ndimage.filters import maximum_filter, maximum_filter1d
 from scipy.ndimage.morphology import (binary_erosion,
                                       generate_binary_structure,
                                       iterate_structure)
@@ -13,8 +13,14 @@ from scipy.ndimage.morphology import (binary_erosion,
 from dejavu.config.settings import (CONNECTIVITY_MASK, DEFAULT_AMP_MIN,
                                     DEFAULT_FAN_VALUE, DEFAULT_FS,
                                     DEFAULT_OVERLAP_RATIO, DEFAULT_WINDOW_SIZE,
+                                    FINGERPRINT_BATCH_FRAMES,
+                                    FINGERPRINT_HASH_FORMAT,
+                                    FINGERPRINT_HASH_FORMATS,
                                     FINGERPRINT_REDUCTION, MAX_HASH_TIME_DELTA,
-                                    MIN_HASH_TIME_DELTA,
+                                    MIN_HASH_TIME_DELTA, PACKED_HASH_LAYOUTS,
+                                    PEAK_ADAPTIVE_THRESHOLD, PEAK_BACKEND,
+                                    PEAK_BACKENDS, PEAK_DENSITY_BANDS,
+                                    PEAK_DENSITY_CAP, PEAK_DENSITY_WINDOW,
                                     PEAK_NEIGHBORHOOD_SIZE, PEAK_SORT)
 
 
@@ -23,7 +29,11 @@ def fingerprint(channel_samples: List[int],
                 wsize: int = DEFAULT_WINDOW_SIZE,
                 wratio: float = DEFAULT_OVERLAP_RATIO,
                 fan_value: int = DEFAULT_FAN_VALUE,
-                amp_min: int = DEFAULT_AMP_MIN) -> List[Tuple[str, int]]:
+                amp_min: int = DEFAULT_AMP_MIN,
+                hash_format: str = FINGERPRINT_HASH_FORMAT,
+                peak_backend: str = PEAK_BACKEND,
+                peak_cap: int = PEAK_DENSITY_CAP,
+                adaptive_threshold: float = PEAK_ADAPTIVE_THRESHOLD) -> List[Tuple[str, int]]:
     """
     FFT the channel, log transform output, find local maxima, then return locally sensitive hashes.
 
@@ -33,35 +43,448 @@ def fingerprint(channel_samples: List[int],
     :param wratio: ratio by which each sequential window overlaps the last and the next window.
     :param fan_value: degree to which a fingerprint can be paired with its neighbors.
     :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :param hash_format: how the peak pairs are hashed, one of the FINGERPRINT_HASH_FORMATS.
+    :param peak_backend: how the peaks are found, one of the PEAK_BACKENDS.
+    :param peak_cap: maximum number of peaks kept per time window and frequency band (None for no cap).
+    :param adaptive_threshold: dB a peak must be above the mean level of its frame (None for no threshold).
     :return: a list of hashes with their corresponding offsets.
     """
-    # FFT the signal and extract frequency components
-    arr2D = mlab.specgram(
-        channel_samples,
-        NFFT=wsize,
-        Fs=Fs,
-        window=mlab.window_hanning,
-        noverlap=int(wsize * wratio))[0]
+    # FFT the signal and extract frequency components, already log transformed.
+    arr2D = spectrogram(channel_samples, Fs=Fs, wsize=wsize, wratio=wratio)
 
-    # Apply log transform since specgram function returns linear array. 0s are excluded to avoid np warning.
-    arr2D = 10 * np.log10(arr2D, out=np.zeros_like(arr2D), where=(arr2D != 0))
-
-    local_maxima = get_2D_peaks(arr2D, plot=False, amp_min=amp_min)
+    local_maxima = get_2D_peaks(arr2D, plot=False, amp_min=amp_min, peak_backend=peak_backend)
+    local_maxima = select_peaks(arr2D, np.asarray(local_maxima, dtype=np.int64).reshape(-1, 2),
+                                peak_cap=peak_cap, adaptive_threshold=adaptive_threshold)
 
     # return hashes
-    return generate_hashes(local_maxima, fan_value=fan_value)
+    return generate_hashes(local_maxima, fan_value=fan_value, hash_format=hash_format)
+
+
+def fingerprint_batch(clips: List[List[int]],
+                      Fs: int = DEFAULT_FS,
+                      wsize: int = DEFAULT_WINDOW_SIZE,
+                      wratio: float = DEFAULT_OVERLAP_RATIO,
+                      fan_value: int = DEFAULT_FAN_VALUE,
+                      amp_min: int = DEFAULT_AMP_MIN,
+                      hash_format: str = FINGERPRINT_HASH_FORMAT,
+                      peak_backend: str = PEAK_BACKEND,
+                      peak_cap: int = PEAK_DENSITY_CAP,
+                      adaptive_threshold: float = PEAK_ADAPTIVE_THRESHOLD,
+                      batch_frames: int = FINGERPRINT_BATCH_FRAMES) -> List[List[Tuple[str, int]]]:
+    """
+    Fingerprints many clips at once, the output is the same as calling fingerprint() on each one of
+    them, but the STFT, the peak search and the hashing run once over the whole batch, so their
+    fixed cost is paid once per batch instead of once per clip.
+
+    :param clips: list of channel samples to fingerprint, all of them at the same sampling rate.
+    :param Fs: audio sampling rate.
+    :param wsize: FFT windows size.
+    :param wratio: ratio by which each sequential window overlaps the last and the next window.
+    :param fan_value: degree to which a fingerprint can be paired with its neighbors.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :param hash_format: how the peak pairs are hashed, one of the FINGERPRINT_HASH_FORMATS.
+    :param peak_backend: how the peaks are found, one of the PEAK_BACKENDS.
+    :param peak_cap: maximum number of peaks kept per time window and frequency band (None for no cap).
+    :param adaptive_threshold: dB a peak must be above the mean level of its frame (None for no threshold).
+    :param batch_frames: number of frames of the clips transformed and searched for peaks at once.
+    :return: a list with the hashes and their corresponding offsets of each clip.
+    """
+    if len(clips) == 0:
+        return []
+
+    frames = [_frames(clip, wsize=wsize, wratio=wratio) for clip in clips]
+    lengths = np.array([len(clip_frames) for clip_frames in frames])
+
+    # clips are transformed and searched for peaks in groups of about batch_frames frames, which
+    # keeps the spectrogram in cache while paying the fixed costs once per group.
+    peaks = []
+    group_start = 0
+    while group_start < len(clips):
+        group_end = group_start + 1
+        while group_end < len(clips) and lengths[group_start:group_end + 1].sum() <= batch_frames:
+            group_end += 1
+
+        # a single spectrogram with the frames of the clips in the group one after the other.
+        arr2D = _log_spectrum(np.concatenate(frames[group_start:group_end]), Fs=Fs)
+        group_peaks = _batch_peaks(arr2D, lengths[group_start:group_end], amp_min=amp_min, peak_backend=peak_backend)
+
+        starts = np.concatenate(([0], np.cumsum(lengths[group_start:group_end])[:-1]))
+        peaks.extend(
+            select_peaks(arr2D[:, start:start + length], clip_peaks, peak_cap=peak_cap,
+                         adaptive_threshold=adaptive_threshold)
+            for start, length, clip_peaks in zip(starts, lengths[group_start:group_end], group_peaks)
+        )
+
+        group_start = group_end
+
+    # all the peaks are hashed together, with every clip shifted in time further than
+    # MAX_HASH_TIME_DELTA from the previous one, so peaks of different clips are never paired.
+    shifts = np.concatenate(([0], np.cumsum(lengths + MAX_HASH_TIME_DELTA + 1)[:-1]))
+    all_peaks = np.concatenate(peaks)
+    all_peaks[:, 1] += np.repeat(shifts, [len(clip_peaks) for clip_peaks in peaks])
+
+    hashes, offsets = generate_hash_arrays(all_peaks, fan_value=fan_value, hash_format=hash_format)
+
+    clip_idxs = np.searchsorted(shifts, offsets, side="right") - 1
+    offsets = offsets - shifts[clip_idxs]
+    bounds = np.searchsorted(clip_idxs, np.arange(1, len(clips)))
+
+    return [
+        list(zip(clip_hashes.tolist(), clip_offsets.tolist()))
+        for clip_hashes, clip_offsets in zip(np.split(hashes, bounds), np.split(offsets, bounds))
+    ]
+
+
+def _batch_peaks(arr2D: np.array, lengths: np.ndarray, amp_min: int = DEFAULT_AMP_MIN,
+                 peak_backend: str = PEAK_BACKEND) -> List[np.ndarray]:
+    """
+    Finds the peaks of the spectrograms of many clips laid one after the other, as if get_2D_peaks
+    had been called on each one of them.
+
+    :param arr2D: matrix with the spectrograms of the clips one after the other.
+    :param lengths: number of frames of each clip.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :param peak_backend: how the peaks are found, one of the PEAK_BACKENDS.
+    :return: a list with an array of the frequency and time of the peaks for each clip.
+    """
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    if amp_min < 0:
+        # background cells can be peaks too, and those depend on the clip borders, so each clip
+        # is searched on its own.
+        return [
+            np.asarray(get_2D_peaks(arr2D[:, start:start + length], amp_min=amp_min, peak_backend=peak_backend),
+                       dtype=np.int64).reshape(-1, 2)
+            for start, length in zip(starts, lengths)
+        ]
+
+    # clips are separated by PEAK_NEIGHBORHOOD_SIZE columns of -inf, so no neighborhood spans two
+    # clips. Those are just like the borders of a single spectrogram, since the columns the peak
+    # filter reflects at a border are already within the neighborhood of the border columns.
+    separator = PEAK_NEIGHBORHOOD_SIZE
+    padded_starts = starts + separator * np.arange(len(lengths))
+    padded = np.full((arr2D.shape[0], lengths.sum() + separator * (len(lengths) - 1)), -np.inf, dtype=arr2D.dtype)
+    for start, padded_start, length in zip(starts, padded_starts, lengths):
+        padded[:, padded_start:padded_start + length] = arr2D[:, start:start + length]
+
+    found = get_2D_peaks(padded, amp_min=amp_min, peak_backend=peak_backend)
+    found = np.asarray(found, dtype=np.int64).reshape(-1, 2)
+
+    # peaks go back to their clip, keeping their order (none can be in the separators).
+    clip_idxs = np.searchsorted(padded_starts, found[:, 1], side="right") - 1
+    found[:, 1] -= padded_starts[clip_idxs]
+
+    order = np.argsort(clip_idxs, kind="stable")
+    return np.split(found[order], np.searchsorted(clip_idxs[order], np.arange(1, len(lengths))))
+
+
+def spectrogram(channel_samples: List[int],
+                Fs: int = DEFAULT_FS,
+                wsize: int = DEFAULT_WINDOW_SIZE,
+                wratio: float = DEFAULT_OVERLAP_RATIO,
+                block_frames: int = 256) -> np.ndarray:
+    """
+    Log scaled power spectrogram of the channel, numerically compatible with the former
+    10 * log10(mlab.specgram(...)) (PSD scaled, one-sided, hanning window) but computed in float32,
+    the rfft of the windowed frames (strided views of the samples) included. It is within a thousandth
+    of a dB of the float64 one above DEFAULT_AMP_MIN, and about a tenth of a dB for the quietest bins.
+    Frames are transformed in blocks so the complex intermediate never spans the whole track.
+
+    :param channel_samples: channel samples to transform.
+    :param Fs: audio sampling rate.
+    :param wsize: FFT windows size.
+    :param wratio: ratio by which each sequential window overlaps the last and the next window.
+    :param block_frames: number of frames transformed at once.
+    :return: a matrix of frequencies by times with the log scaled power spectrum (0 where there is no power).
+    """
+    return _log_spectrum(_frames(channel_samples, wsize=wsize, wratio=wratio), Fs=Fs, block_frames=block_frames)
+
+
+def _frames(channel_samples: List[int], wsize: int = DEFAULT_WINDOW_SIZE,
+            wratio: float = DEFAULT_OVERLAP_RATIO) -> np.ndarray:
+    """
+    Splits the channel in overlapping frames, which are just views over the samples.
+
+    :param channel_samples: channel samples to split.
+    :param wsize: FFT windows size.
+    :param wratio: ratio by which each sequential window overlaps the last and the next window.
+    :return: a read only matrix of frames by samples.
+    """
+    samples = np.asarray(channel_samples)
+
+    # zero pad the samples up to a whole window if they are shorter than that (as specgram did).
+    if len(samples) < wsize:
+        samples = np.concatenate((samples, np.zeros(wsize - len(samples), dtype=samples.dtype)))
+
+    hop = wsize - int(wsize * wratio)
+    nframes = (len(samples) - wsize) // hop + 1
+
+    # nothing gets copied until the window is applied.
+    return np.lib.stride_tricks.as_strided(
+        samples,
+        shape=(nframes, wsize),
+        strides=(samples.strides[0] * hop, samples.strides[0]),
+        writeable=False
+    )
+
+
+def _log_spectrum(frames: np.ndarray, Fs: int = DEFAULT_FS, block_frames: int = 256) -> np.ndarray:
+    """
+    Log scaled power spectrum of every frame (see spectrogram).
+
+    :param frames: matrix of frames by samples.
+    :param Fs: audio sampling rate.
+    :param block_frames: number of frames transformed at once.
+    :return: a matrix of frequencies by frames with the log scaled power spectrum.
+    """
+    nframes, wsize = frames.shape
+
+    window = _hanning_window(wsize)
+
+    arr2D = np.empty((wsize // 2 + 1, nframes), dtype=np.float32)
+    for start in range(0, nframes, block_frames):
+        # float32 frames give a complex64 spectrum (np.fft.rfft would compute it in complex128).
+        spectrum = rfft(frames[start:start + block_frames] * window, axis=1)
+        arr2D[:, start:start + block_frames] = (spectrum.real ** 2 + spectrum.imag ** 2).T
+
+    # density scaling: by the sampling frequency and the window norm, and one-sided frequencies count
+    # twice except for the DC and the Nyquist (when there is one) components.
+    arr2D *= 1 / (Fs * float(np.sum(window.astype(np.float64) ** 2)))
+    arr2D[1:wsize // 2 + wsize % 2] *= 2
+
+    # Apply log transform since the spectrum is linear. 0s are excluded to avoid np warning and
+    # stay as 0s.
+    np.log10(arr2D, out=arr2D, where=(arr2D != 0))
+    arr2D *= 10
+
+    return arr2D
+
+
+@lru_cache(maxsize=None)
+def _hanning_window(wsize: int) -> np.ndarray:
+    """
+    Hanning window for the given size, built only once per size.
+
+    :param wsize: FFT windows size.
+    :return: a read only float32 window.
+    """
+    window = np.hanning(wsize).astype(np.float32)
+    window.flags.writeable = False
+    return window
+
+
+class StreamFingerprinter(object):
+    """
+    Incremental version of fingerprint() for a single channel, audio is fed in blocks of samples and
+    hashes come out as soon as they are final, with offsets relative to the start of the stream.
+
+    Only what is needed to carry on is kept between blocks:
+        - the samples of the last incomplete frame.
+        - PEAK_NEIGHBORHOOD_SIZE frames of spectrogram on each side of the frames yet to be searched
+        for peaks, as a peak is only final once its whole neighborhood is known.
+        - the last fan_value - 1 peaks, which still have to be paired with peaks to come.
+    With a peak cap, frames are searched in whole PEAK_DENSITY_WINDOW windows, so the very same peaks
+    are selected no matter how the audio is split in blocks.
+    So memory depends on the block size and not on the length of the audio. Output is the same as
+    fingerprint() over the whole channel, with peaks always in time order (as with PEAK_SORT).
+    """
+    def __init__(self,
+                 Fs: int = DEFAULT_FS,
+                 wsize: int = DEFAULT_WINDOW_SIZE,
+                 wratio: float = DEFAULT_OVERLAP_RATIO,
+                 fan_value: int = DEFAULT_FAN_VALUE,
+                 amp_min: int = DEFAULT_AMP_MIN,
+                 hash_format: str = FINGERPRINT_HASH_FORMAT,
+                 peak_backend: str = PEAK_BACKEND,
+                 peak_cap: int = PEAK_DENSITY_CAP,
+                 adaptive_threshold: float = PEAK_ADAPTIVE_THRESHOLD):
+        super().__init__()
+
+        self.Fs = Fs
+        self.wsize = wsize
+        self.wratio = wratio
+        self.fan_value = fan_value
+        self.amp_min = amp_min
+        self.hash_format = hash_format
+        self.peak_backend = peak_backend
+        self.peak_cap = peak_cap
+        self.adaptive_threshold = adaptive_threshold
+
+        self.hop = wsize - int(wsize * wratio)
+
+        # samples not consumed by a complete frame yet.
+        self._samples = np.empty(0, dtype=np.int16)
+        # number of frames computed so far.
+        self._nframes = 0
+        # spectrogram columns kept, the first one is the frame self._spectrum_start.
+        self._spectrum = np.empty((wsize // 2 + 1, 0), dtype=np.float32)
+        self._spectrum_start = 0
+        # frames before this one have already been searched for peaks.
+        self._searched = 0
+        # time sorted (freq, time) peaks which are still waiting for their neighbors.
+        self._peaks = np.empty((0, 2), dtype=np.int64)
+
+    def update(self, samples: np.ndarray) -> List[Tuple[str, int]]:
+        """
+        Feeds the next block of samples.
+
+        :param samples: next samples of the channel.
+        :return: a list of the hashes made final by this block, with their corresponding offsets.
+        """
+        self._samples = np.concatenate((self._samples, samples))
+
+        nframes = (len(self._samples) - self.wsize) // self.hop + 1 if len(self._samples) >= self.wsize else 0
+        if nframes > 0:
+            consumed = (nframes - 1) * self.hop + self.wsize
+            self._spectrum = np.concatenate(
+                (self._spectrum, spectrogram(self._samples[:consumed], Fs=self.Fs, wsize=self.wsize,
+                                             wratio=self.wratio)),
+                axis=1
+            )
+            self._samples = self._samples[nframes * self.hop:]
+            self._nframes += nframes
+
+        # frames whose neighborhood is not complete yet have to wait for the next block.
+        return self._search(self._nframes - PEAK_NEIGHBORHOOD_SIZE, final=False)
+
+    def flush(self) -> List[Tuple[str, int]]:
+        """
+        Signals the end of the channel.
+
+        :return: a list with the remaining hashes and their corresponding offsets.
+        """
+        if self._nframes == 0 and len(self._samples) > 0:
+            # audio shorter than a single window is zero padded into one frame.
+            self._spectrum = spectrogram(self._samples, Fs=self.Fs, wsize=self.wsize, wratio=self.wratio)
+            self._nframes = 1
+
+        self._samples = self._samples[0:0]
+
+        return self._search(self._nframes, final=True)
+
+    def _search(self, end: int, final: bool) -> List[Tuple[str, int]]:
+        """
+        Looks for peaks in the frames from the last searched one up to end, and pairs every peak
+        which has all its neighbors.
+
+        :param end: frame where the search stops (not included).
+        :param final: whether no more peaks will come after these.
+        :return: a list of hashes with their corresponding offsets.
+        """
+        if self.peak_cap is not None and not final:
+            # the peak cap is applied over whole windows, the rest of the frames wait for the next block.
+            end -= end % PEAK_DENSITY_WINDOW
+
+        if end > self._searched:
+            # the spectrogram is searched with the neighborhood of the frames on both sides, so that
+            # maxima come out just as if the whole spectrogram had been searched at once.
+            first = max(self._searched - PEAK_NEIGHBORHOOD_SIZE, 0) - self._spectrum_start
+            peaks = get_2D_peaks(self._spectrum[:, first:], amp_min=self.amp_min, peak_backend=self.peak_backend)
+            peaks = np.asarray(peaks, dtype=np.int64).reshape(-1, 2)
+
+            offset = self._spectrum_start + first
+            peaks = peaks[(peaks[:, 1] >= self._searched - offset) & (peaks[:, 1] < end - offset)]
+            peaks = select_peaks(self._spectrum[:, first:], peaks, peak_cap=self.peak_cap,
+                                 adaptive_threshold=self.adaptive_threshold, first_frame=offset)
+            peaks[:, 1] += offset
+
+            peaks = peaks[np.argsort(peaks[:, 1], kind="stable")]
+
+            self._peaks = np.concatenate((self._peaks, peaks))
+            self._searched = end
+
+            # drop the spectrogram no longer needed as neighborhood.
+            drop = max(end - PEAK_NEIGHBORHOOD_SIZE - self._spectrum_start, 0)
+            self._spectrum = self._spectrum[:, drop:]
+            self._spectrum_start += drop
+
+        # the last fan_value - 1 peaks could still be paired with peaks from the next blocks.
+        nanchors = len(self._peaks) if final else max(len(self._peaks) - (self.fan_value - 1), 0)
+
+        hashes, offsets = generate_hash_arrays(self._peaks, fan_value=self.fan_value, hash_format=self.hash_format,
+                                               nanchors=nanchors)
+        self._peaks = self._peaks[nanchors:]
+
+        return list(zip(hashes.tolist(), offsets.tolist()))
+
+
+def fingerprint_stream(blocks: Iterable[np.ndarray],
+                       Fs: int = DEFAULT_FS,
+                       wsize: int = DEFAULT_WINDOW_SIZE,
+                       wratio: float = DEFAULT_OVERLAP_RATIO,
+                       fan_value: int = DEFAULT_FAN_VALUE,
+                       amp_min: int = DEFAULT_AMP_MIN,
+                       hash_format: str = FINGERPRINT_HASH_FORMAT,
+                       peak_backend: str = PEAK_BACKEND,
+                       peak_cap: int = PEAK_DENSITY_CAP,
+                       adaptive_threshold: float = PEAK_ADAPTIVE_THRESHOLD) -> Iterator[List[Tuple[str, int]]]:
+    """
+    Fingerprints a channel given as consecutive blocks of samples, yielding hashes as they are
+    ready instead of building the spectrogram of the whole channel (see StreamFingerprinter).
+
+    :param blocks: consecutive blocks of channel samples.
+    :param Fs: audio sampling rate.
+    :param wsize: FFT windows size.
+    :param wratio: ratio by which each sequential window overlaps the last and the next window.
+    :param fan_value: degree to which a fingerprint can be paired with its neighbors.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :param hash_format: how the peak pairs are hashed, one of the FINGERPRINT_HASH_FORMATS.
+    :param peak_backend: how the peaks are found, one of the PEAK_BACKENDS.
+    :param peak_cap: maximum number of peaks kept per time window and frequency band (None for no cap).
+    :param adaptive_threshold: dB a peak must be above the mean level of its frame (None for no threshold).
+    :return: an iterator over lists of hashes with their corresponding offsets.
+    """
+    stream = StreamFingerprinter(Fs=Fs, wsize=wsize, wratio=wratio, fan_value=fan_value, amp_min=amp_min,
+                                 hash_format=hash_format, peak_backend=peak_backend, peak_cap=peak_cap,
+                                 adaptive_threshold=adaptive_threshold)
+    for block in blocks:
+        yield stream.update(block)
+
+    yield stream.flush()
 
 
-def get_2D_peaks(arr2D: np.array, plot: bool = False, amp_min: int = DEFAULT_AMP_MIN)\
-        -> List[Tuple[List[int], List[int]]]:
+def get_2D_peaks(arr2D: np.array, plot: bool = False, amp_min: int = DEFAULT_AMP_MIN,
+                 peak_backend: str = PEAK_BACKEND) -> List[Tuple[List[int], List[int]]]:
     """
     Extract maximum peaks from the spectogram matrix (arr2D).
 
     :param arr2D: matrix representing the spectogram.
     :param plot: for plotting the results.
     :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :param peak_backend: how the peaks are found, one of the PEAK_BACKENDS.
     :return: a list composed by a list of frequencies and times.
     """
+    if peak_backend not in PEAK_BACKENDS:
+        raise ValueError(f"Unsupported peak backend {peak_backend}, must be one of {PEAK_BACKENDS}.")
+
+    if peak_backend == "separable" and CONNECTIVITY_MASK == 2:
+        freqs_filter, times_filter = _separable_peaks(arr2D, amp_min)
+    else:
+        freqs_filter, times_filter = _morphology_peaks(arr2D, amp_min)
+
+    if plot:
+        # scatter of the peaks
+        fig, ax = plt.subplots()
+        ax.imshow(arr2D)
+        ax.scatter(times_filter, freqs_filter)
+        ax.set_xlabel('Time')
+        ax.set_ylabel('Frequency')
+        ax.set_title("Spectrogram")
+        plt.gca().invert_yaxis()
+        plt.show()
+
+    return list(zip(freqs_filter, times_filter))
+
+
+def _morphology_peaks(arr2D: np.array, amp_min: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the peaks with a maximum filter over the neighborhood footprint and the erosion of the
+    zero background.
+
+    :param arr2D: matrix representing the spectogram.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :return: a tuple with the frequencies and the times of the peaks.
+    """
     # Original code from the repo is using a morphology mask that does not consider diagonal elements
     # as neighbors (basically a diamond figure) and then applies a dilation over it, so what I'm proposing
     # is to change from the current diamond figure to a just a normal square one:
@@ -105,21 +528,88 @@ def get_2D_peaks(arr2D: np.array, plot: bool = False, amp_min: int = DEFAULT_AMP
     freqs_filter = freqs[filter_idxs]
     times_filter = times[filter_idxs]
 
-    if plot:
-        # scatter of the peaks
-        fig, ax = plt.subplots()
-        ax.imshow(arr2D)
-        ax.scatter(times_filter, freqs_filter)
-        ax.set_xlabel('Time')
-        ax.set_ylabel('Frequency')
-        ax.set_title("Spectrogram")
-        plt.gca().invert_yaxis()
-        plt.show()
+    return freqs_filter, times_filter
 
-    return list(zip(freqs_filter, times_filter))
 
+def _separable_peaks(arr2D: np.array, amp_min: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Same peaks as _morphology_peaks for the square mask (CONNECTIVITY_MASK = 2), but cheaper:
+        - a square neighborhood is separable, so the maximum filter is done as two 1D passes.
+        - eroded background cells are 0 in the spectrogram, which never passes an amp_min >= 0, so
+        in that case the erosion and the XOR are skipped altogether. Otherwise the erosion is done
+        as two 1D passes as well.
+
+    :param arr2D: matrix representing the spectogram.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :return: a tuple with the frequencies and the times of the peaks.
+    """
+    size = PEAK_NEIGHBORHOOD_SIZE * 2 + 1
+
+    local_max = maximum_filter1d(maximum_filter1d(arr2D, size, axis=1), size, axis=0) == arr2D
+
+    if amp_min >= 0:
+        return np.where(local_max & (arr2D > amp_min))
+
+    # a background cell survives the erosion when there is no signal in its neighborhood (cells
+    # beyond the borders count as background, as border_value=1 does).
+    signal = (arr2D != 0).view(np.uint8)
+    eroded_background = maximum_filter1d(
+        maximum_filter1d(signal, size, axis=1, mode="constant", cval=0), size, axis=0, mode="constant", cval=0
+    ) == 0
+
+    return np.where((local_max != eroded_background) & (arr2D > amp_min))
+
+
+def select_peaks(arr2D: np.array, peaks: np.ndarray, peak_cap: int = PEAK_DENSITY_CAP,
+                 adaptive_threshold: float = PEAK_ADAPTIVE_THRESHOLD, first_frame: int = 0) -> np.ndarray:
+    """
+    Keeps the peaks which are above the adaptive threshold and among the peak_cap strongest ones of
+    their PEAK_DENSITY_WINDOW frames window and PEAK_DENSITY_BANDS frequency band, in the order given.
+
+    :param arr2D: matrix representing the spectogram where the peaks were found.
+    :param peaks: array with the frequency and the time (column in arr2D) of each peak.
+    :param peak_cap: maximum number of peaks kept per time window and frequency band (None for no cap).
+    :param adaptive_threshold: dB a peak must be above the mean level of its frame (None for no threshold).
+    :param first_frame: frame number of the first column of arr2D, windows always start at multiples
+    of PEAK_DENSITY_WINDOW frames.
+    :return: an array with the selected peaks.
+    """
+    if len(peaks) == 0 or (peak_cap is None and adaptive_threshold is None):
+        return peaks
+
+    freqs = peaks[:, 0]
+    times = peaks[:, 1]
+    amps = arr2D[freqs, times]
+
+    keep = np.ones(len(peaks), dtype=bool)
+
+    if adaptive_threshold is not None:
+        # the mean level is only computed for the frames with peaks.
+        frames, frame_idxs = np.unique(times, return_inverse=True)
+        means = arr2D[:, frames].mean(axis=0, dtype=np.float64)
+        keep &= amps > means[frame_idxs] + adaptive_threshold
+
+    if peak_cap is not None:
+        windows = (times + first_frame) // PEAK_DENSITY_WINDOW
+        bands = freqs * PEAK_DENSITY_BANDS // arr2D.shape[0]
 
-def generate_hashes(peaks: List[Tuple[int, int]], fan_value: int = DEFAULT_FAN_VALUE) -> List[Tuple[str, int]]:
+        # candidates grouped by window and band, the strongest first (ties go to the earliest peak).
+        candidates = np.flatnonzero(keep)
+        order = candidates[np.lexsort((freqs[candidates], times[candidates], -amps[candidates],
+                                       bands[candidates], windows[candidates]))]
+
+        # rank of each candidate within its group.
+        groups = windows[order] * PEAK_DENSITY_BANDS + bands[order]
+        starts = np.flatnonzero(np.concatenate(([True], groups[1:] != groups[:-1])))
+        ranks = np.arange(len(order)) - np.repeat(starts, np.diff(np.append(starts, len(order))))
+
+        keep[order[ranks >= peak_cap]] = False
+
+    return peaks[keep]
+
+
+def generate_hashes(peaks: List[Tuple[int, int]], fan_value: int = DEFAULT_FAN_VALUE,
+                    hash_format: str = FINGERPRINT_HASH_FORMAT) -> List[Tuple[str, int]]:
     """
     Hash list structure:
        sha1_hash[0:FINGERPRINT_REDUCTION]    time_offset
@@ -127,30 +617,182 @@ def generate_hashes(peaks: List[Tuple[int, int]], fan_value: int = DEFAULT_FAN_V
 
     :param peaks: list of peak frequencies and times.
     :param fan_value: degree to which a fingerprint can be paired with its neighbors.
+    :param hash_format: how the peak pairs are hashed, one of the FINGERPRINT_HASH_FORMATS.
     :return: a list of hashes with their corresponding offsets.
     """
+    hashes, offsets = generate_hash_arrays(peaks, fan_value=fan_value, hash_format=hash_format)
+
+    return list(zip(hashes.tolist(), offsets.tolist()))
+
+
+def generate_hash_arrays(peaks: List[Tuple[int, int]], fan_value: int = DEFAULT_FAN_VALUE,
+                         hash_format: str = FINGERPRINT_HASH_FORMAT,
+                         nanchors: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Batched version of the peak pairing. Instead of looping over every peak and each one of its
+    neighbors, all the (peak, neighbor) pairs are built at once with array operations, the time delta
+    thresholds are applied as a mask and the whole batch is hashed in one go.
+
+    With the "sha1" format the hashes are bit-exact with the ones generated by the original nested
+    loop (and they come out in the very same order), so existing catalogs keep matching.
+
+    :param peaks: list of peak frequencies and times.
+    :param fan_value: degree to which a fingerprint can be paired with its neighbors.
+    :param hash_format: how the peak pairs are hashed, one of the FINGERPRINT_HASH_FORMATS.
+    :param nanchors: if given, only the first nanchors peaks (once sorted) are paired with their neighbors.
+    :return: a tuple with an array of hashes and an array with their corresponding offsets.
+    """
+    if hash_format not in FINGERPRINT_HASH_FORMATS:
+        raise ValueError(f"Unsupported hash format {hash_format}, must be one of {FINGERPRINT_HASH_FORMATS}.")
+
     # frequencies are in the first position of the tuples
     idx_freq = 0
     # times are in the second position of the tuples
     idx_time = 1
 
+    peaks = np.asarray(peaks, dtype=np.int64).reshape(-1, 2)
+
     if PEAK_SORT:
-        peaks.sort(key=itemgetter(1))
+        # a stable sort, so peaks within the same time keep their order (as list.sort does).
+        peaks = peaks[np.argsort(peaks[:, idx_time], kind="stable")]
+
+    freqs = peaks[:, idx_freq]
+    times = peaks[:, idx_time]
+
+    # every peak i is paired with the peaks i + 1, ..., i + fan_value - 1, the pairs are laid out
+    # peak by peak, exactly as the original nested loop visited them.
+    nanchors = len(peaks) if nanchors is None else min(nanchors, len(peaks))
+    anchors = np.repeat(np.arange(nanchors), max(fan_value - 1, 0))
+    neighbors = anchors + np.tile(np.arange(1, max(fan_value, 1)), nanchors)
+
+    in_range = neighbors < len(peaks)
+    anchors = anchors[in_range]
+    neighbors = neighbors[in_range]
+
+    t_delta = times[neighbors] - times[anchors]
+    in_delta = (MIN_HASH_TIME_DELTA <= t_delta) & (t_delta <= MAX_HASH_TIME_DELTA)
+
+    anchors = anchors[in_delta]
+    neighbors = neighbors[in_delta]
+    t_delta = t_delta[in_delta]
+
+    if hash_format == "sha1":
+        hashes = _sha1_hashes(freqs[anchors], freqs[neighbors], t_delta)
+    elif hash_format == "mixed":
+        hashes = _mixed_hashes(freqs[anchors], freqs[neighbors], t_delta)
+    else:
+        hashes = _packed_hashes(freqs[anchors], freqs[neighbors], t_delta, hash_format)
+
+    return hashes, times[anchors]
+
+
+def _sha1_hashes(freqs1: np.ndarray, freqs2: np.ndarray, t_deltas: np.ndarray) -> np.ndarray:
+    """
+    Hashes a batch of (freq1, freq2, t_delta) triples with sha1. The same triple shows up many times
+    across a track, so each distinct one is hashed only once and then broadcast back to every pair.
 
-    hashes = []
-    for i in range(len(peaks)):
-        for j in range(1, fan_value):
-            if (i + j) < len(peaks):
+    :param freqs1: frequencies of the anchor peaks.
+    :param freqs2: frequencies of the paired peaks.
+    :param t_deltas: time deltas between the anchor and the paired peaks.
+    :return: an array with the truncated sha1 hex digest for each triple.
+    """
+    if len(t_deltas) == 0:
+        return np.empty(0, dtype=f"<U{FINGERPRINT_REDUCTION}")
+
+    # pack each triple into a single integer key, which is way cheaper to deduplicate than the rows
+    # of a 2D array.
+    freq_span = int(max(freqs1.max(), freqs2.max())) + 1
+    delta_span = MAX_HASH_TIME_DELTA - MIN_HASH_TIME_DELTA + 1
+    keys = (freqs1 * freq_span + freqs2) * delta_span + (t_deltas - MIN_HASH_TIME_DELTA)
+
+    keys, inverse = np.unique(keys, return_inverse=True)
+
+    # unpack the distinct triples, frequencies and deltas are small integers so their text
+    # representation is looked up from a table rather than formatted once per hash.
+    freq_texts = [b"%d|" % freq for freq in range(freq_span)]
+    delta_texts = [b"%d" % t_delta for t_delta in range(MIN_HASH_TIME_DELTA, MAX_HASH_TIME_DELTA + 1)]
+
+    t_deltas = (keys % delta_span).tolist()
+    freqs2 = ((keys // delta_span) % freq_span).tolist()
+    freqs1 = (keys // delta_span // freq_span).tolist()
+
+    # same message as f"{freq1}|{freq2}|{t_delta}" in the original implementation.
+    sha1 = hashlib.sha1
+    digests = np.array([
+        sha1(freq_texts[freq1] + freq_texts[freq2] + delta_texts[t_delta]).hexdigest()[0:FINGERPRINT_REDUCTION]
+        for freq1, freq2, t_delta in zip(freqs1, freqs2, t_deltas)
+    ], dtype=f"<U{FINGERPRINT_REDUCTION}")
+
+    return digests[inverse.reshape(-1)]
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """
+    splitmix64 finalizer, scrambles every bit of the input into every bit of the output.
+
+    :param values: array of uint64 values.
+    :return: the mixed array of uint64 values.
+    """
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _mixed_hashes(freqs1: np.ndarray, freqs2: np.ndarray, t_deltas: np.ndarray) -> np.ndarray:
+    """
+    Hashes a batch of (freq1, freq2, t_delta) triples with integer mixing, entirely with array
+    operations. The output has the same shape as the sha1 hashes (FINGERPRINT_REDUCTION hex characters)
+    so it fits the existing schemas, but the values are different.
+
+    :param freqs1: frequencies of the anchor peaks.
+    :param freqs2: frequencies of the paired peaks.
+    :param t_deltas: time deltas between the anchor and the paired peaks.
+    :return: an array with the hex digest for each triple.
+    """
+    state = _mix64(freqs1.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15))
+    state = _mix64(state ^ freqs2.astype(np.uint64))
+    state = _mix64(state ^ t_deltas.astype(np.uint64))
+
+    # every 64 bits word gives 16 hex characters, derive as many words as needed.
+    words = [state]
+    while len(words) * 16 < FINGERPRINT_REDUCTION:
+        words.append(_mix64(words[-1] ^ np.uint64(0x9E3779B97F4A7C15)))
+
+    digest = np.stack(words, axis=1).astype(">u8").view(np.uint8).reshape(len(state), -1)
+
+    hex_chars = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+    hex_digest = np.empty((len(state), digest.shape[1] * 2), dtype=np.uint8)
+    hex_digest[:, 0::2] = hex_chars[digest >> 4]
+    hex_digest[:, 1::2] = hex_chars[digest & 0x0F]
+
+    return np.ascontiguousarray(hex_digest[:, 0:FINGERPRINT_REDUCTION]).view(f"S{FINGERPRINT_REDUCTION}")\
+        .reshape(-1).astype(f"<U{FINGERPRINT_REDUCTION}")
+
+
+def _packed_hashes(freqs1: np.ndarray, freqs2: np.ndarray, t_deltas: np.ndarray, hash_format: str) -> np.ndarray:
+    """
+    Packs a batch of (freq1, freq2, t_delta) triples into integers, using the bit layout given for the
+    format in PACKED_HASH_LAYOUTS. The result is reinterpreted as signed so that it fits the signed
+    integer columns of the databases.
+
+    :param freqs1: frequencies of the anchor peaks.
+    :param freqs2: frequencies of the paired peaks.
+    :param t_deltas: time deltas between the anchor and the paired peaks.
+    :param hash_format: one of the packed formats in PACKED_HASH_LAYOUTS.
+    :return: an array with the packed integer for each triple.
+    """
+    freq_bits, _, delta_bits = PACKED_HASH_LAYOUTS[hash_format]
+    unsigned_type, signed_type = (np.uint32, np.int32) if hash_format == "int32" else (np.uint64, np.int64)
 
-                freq1 = peaks[i][idx_freq]
-                freq2 = peaks[i + j][idx_freq]
-                t1 = peaks[i][idx_time]
-                t2 = peaks[i + j][idx_time]
-                t_delta = t2 - t1
+    if MAX_HASH_TIME_DELTA - MIN_HASH_TIME_DELTA >= 1 << delta_bits:
+        raise ValueError(f"The time delta range does not fit in the {delta_bits} bits of the {hash_format} format.")
 
-                if MIN_HASH_TIME_DELTA <= t_delta <= MAX_HASH_TIME_DELTA:
-                    h = hashlib.sha1(f"{str(freq1)}|{str(freq2)}|{str(t_delta)}".encode('utf-8'))
+    if len(t_deltas) and max(freqs1.max(), freqs2.max()) >= 1 << freq_bits:
+        raise ValueError(f"Frequencies do not fit in the {freq_bits} bits of the {hash_format} format, "
+                         f"use a smaller window size or a wider format.")
 
-                    hashes.append((h.hexdigest()[0:FINGERPRINT_REDUCTION], t1))
+    packed = (freqs1.astype(np.uint64) << np.uint64(freq_bits + delta_bits)) \
+        | (freqs2.astype(np.uint64) << np.uint64(delta_bits)) \
+        | (t_deltas - MIN_HASH_TIME_DELTA).astype(np.uint64)
 
-    return hashes
+    return packed.astype(unsigned_type).view(signed_type)
@@ -0,0 +1,141 @@
+import json
+import os
+import tempfile
+import zipfile
+from hashlib import sha1
+from typing import Dict, Set, Tuple
+
+import numpy as np
+
+import dejavu.config.settings as settings
+import dejavu.logic.decoder as decoder
+from dejavu.config.settings import FINGERPRINT_CACHE_SIZE
+from dejavu.logic.shared_fingerprints import (pack_fingerprints,
+                                              unpack_fingerprints)
+
+# Module level settings which change the fingerprints of a file, these are part of every cache key
+# along with the options given to the fingerprinting.
+FINGERPRINT_SETTINGS = [
+    "CONNECTIVITY_MASK", "DEFAULT_AMP_MIN", "DEFAULT_FAN_VALUE", "DEFAULT_OVERLAP_RATIO", "DEFAULT_WINDOW_SIZE",
+    "FINGERPRINT_HASH_FORMAT", "FINGERPRINT_REDUCTION", "MAX_HASH_TIME_DELTA", "MIN_HASH_TIME_DELTA",
+    "PACKED_HASH_LAYOUTS", "PEAK_ADAPTIVE_THRESHOLD", "PEAK_DENSITY_BANDS", "PEAK_DENSITY_CAP",
+    "PEAK_DENSITY_WINDOW", "PEAK_NEIGHBORHOOD_SIZE", "PEAK_SORT"
+]
+
+# Bumped whenever the fingerprinting changes in a way the settings above do not reflect, so
+# previously cached fingerprints are not used anymore.
+CACHE_VERSION = 3
+
+
+class FingerprintCache(object):
+    """
+    Local cache of the fingerprints of audio files, so a file already fingerprinted with the same
+    settings is not decoded and fingerprinted again (e.g. when the database is rebuilt).
+
+    Entries are addressed by the sha1 of the file content and a digest of the fingerprint settings,
+    and each one is a .npz file with the hash and offset arrays. Whenever the cache grows over
+    max_size bytes, the least recently used entries are evicted.
+    """
+    def __init__(self, path: str, max_size: int = FINGERPRINT_CACHE_SIZE):
+        super().__init__()
+
+        self.path = path
+        self.max_size = max_size
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def get(self, file_hash: str, options: Dict[str, any]) -> Tuple[Set[Tuple[str, int]], int]:
+        """
+        Looks for the fingerprints of a file.
+
+        :param file_hash: sha1 of the file content (see decoder.unique_hash).
+        :param options: options the file is fingerprinted with.
+        :return: a tuple with the set of hashes and offsets and the sampling rate they were generated
+        at, or None if the file is not in the cache.
+        """
+        entry = self._entry_path(file_hash, options)
+        try:
+            with np.load(entry, allow_pickle=False) as data:
+                hashes, offsets, fs = data["hashes"], data["offsets"], int(data["fs"])
+
+            # the entry becomes the most recently used one.
+            os.utime(entry)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+
+        return set(zip(*unpack_fingerprints(hashes, offsets))), fs
+
+    def put(self, file_hash: str, options: Dict[str, any], fingerprints: Set[Tuple[str, int]], fs: int) -> None:
+        """
+        Stores the fingerprints of a file, evicting the least recently used entries if needed.
+
+        :param file_hash: sha1 of the file content (see decoder.unique_hash).
+        :param options: options the file was fingerprinted with.
+        :param fingerprints: set of hashes and their corresponding offsets.
+        :param fs: sampling rate the fingerprints were generated at.
+        """
+        hashes, offsets = pack_fingerprints(fingerprints)
+
+        # written to a temporary file first, so a concurrent reader never finds a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, hashes=hashes, offsets=offsets, fs=np.int64(fs))
+            os.replace(tmp_path, self._entry_path(file_hash, options))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries until the cache fits in max_size bytes.
+        """
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".npz"):
+                try:
+                    stat = entry.stat()
+                except OSError:  # removed by another process meanwhile.
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            total_size -= size
+
+    def _entry_path(self, file_hash: str, options: Dict[str, any]) -> str:
+        """
+        Path of the cache entry for a file and a set of options.
+
+        :param file_hash: sha1 of the file content.
+        :param options: options the file is fingerprinted with.
+        :return: path to the .npz entry.
+        """
+        return os.path.join(self.path, f"{file_hash}_{settings_digest(options)}.npz")
+
+
+def settings_digest(options: Dict[str, any]) -> str:
+    """
+    Digest of every setting the fingerprints depend on: the given options (decoding and fingerprint
+    ones, among which the analysis rate and the downmix), the module level settings, and the decoder
+    backend files are read with, which changes the samples fingerprinted.
+
+    :param options: options the file is fingerprinted with.
+    :return: a sha1 hex digest.
+    """
+    all_settings = {
+        "version": CACHE_VERSION,
+        "decoder": decoder.backend(),
+        "options": options,
+        "settings": {name: getattr(settings, name) for name in FINGERPRINT_SETTINGS}
+    }
+    return sha1(json.dumps(all_settings, sort_keys=True, default=str).encode("utf8")).hexdigest()
@@ -0,0 +1,280 @@
+import queue
+import threading
+from time import time
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+from dejavu.base_classes.base_database import BaseDatabase
+from dejavu.config.settings import (FINGERPRINT_INSERT_BATCH_SIZE,
+                                    INGESTION_QUEUE_SIZE, INGESTION_WRITERS,
+                                    SONG_INSERT_BATCH_SIZE)
+
+
+class IngestionStats(object):
+    """
+    Counters of each stage of an ingestion pipeline.
+    """
+    def __init__(self):
+        super().__init__()
+
+        self.start_time = time()
+        self.files_fingerprinted = 0
+        self.files_failed = 0
+        self.hashes_fingerprinted = 0
+        self.songs_written = 0
+        self.hashes_written = 0
+        self.batches_written = 0
+        # time spent inserting batches, added up over every writer.
+        self.write_time = 0.0
+        # time the fingerprint stage was blocked because the writers fell behind.
+        self.backpressure_time = 0.0
+        # number of fingerprint workers, and time each one (by its process id) spent fingerprinting.
+        self.workers = 0
+        self.worker_time = {}
+
+    def add_worker_time(self, worker: int, seconds: float) -> None:
+        """
+        Accounts for the time a worker spent on a task.
+
+        :param worker: process id of the worker.
+        :param seconds: number of seconds the task took.
+        """
+        self.worker_time[worker] = self.worker_time.get(worker, 0.0) + seconds
+
+    def __str__(self) -> str:
+        elapsed = max(time() - self.start_time, 1e-9)
+        summary = (
+            f"Fingerprinted {self.files_fingerprinted} files ({self.files_fingerprinted / elapsed:.2f} per second, "
+            f"{self.files_failed} failed) with {self.hashes_fingerprinted} hashes. "
+            f"Wrote {self.songs_written} songs and {self.hashes_written} hashes in {self.batches_written} batches "
+            f"({self.hashes_written / elapsed:.0f} hashes per second overall, "
+            f"{self.hashes_written / max(self.write_time, 1e-9):.0f} per second of writing). "
+            f"Fingerprinting waited {self.backpressure_time:.2f} s for the writers, in {elapsed:.2f} s."
+        )
+
+        if self.workers:
+            # workers which got no task are not listed, but they count for the overall utilisation.
+            utilisation = ", ".join(f"{worker}: {100 * busy / elapsed:.0f}%"
+                                    for worker, busy in sorted(self.worker_time.items()))
+            summary += (f" Utilisation of {self.workers} workers: "
+                        f"{100 * sum(self.worker_time.values()) / (self.workers * elapsed):.0f}% ({utilisation}).")
+
+        return summary
+
+
+class IngestionPipeline(object):
+    """
+    Writes fingerprinted songs into the database while more files are being fingerprinted, with several
+    writer threads, each one inserting batches of songs through its own connection.
+
+    Songs are put in batches of song_batch_size into a queue of at most queue_size batches, which the
+    writers take them from. When the writers fall behind and the queue is full, put blocks, and so does
+    the fingerprinting of new files if its input is throttled (see throttle), since a new file is only
+    handed out once a previous one has been put. So the fingerprints kept in memory are bounded, instead
+    of piling up while the fingerprinting outpaces the writers.
+
+    Fingerprints which have to be released once used (see SharedFingerprints) are released as soon as
+    their batch is written, or dropped when aborting or after an error.
+
+    Usage:
+        with IngestionPipeline(db) as pipeline:
+            for result in pool.imap_unordered(worker, pipeline.throttle(tasks, nprocesses)):
+                pipeline.put(song_name, file_hash, hashes)  # or pipeline.release() if it failed
+    """
+    def __init__(self, db: BaseDatabase, writers: int = INGESTION_WRITERS, queue_size: int = INGESTION_QUEUE_SIZE,
+                 song_batch_size: int = SONG_INSERT_BATCH_SIZE, hash_batch_size: int = FINGERPRINT_INSERT_BATCH_SIZE,
+                 on_written: Callable[[List[str]], None] = None):
+        """
+        Starts the writer threads.
+
+        :param db: database the songs are inserted into.
+        :param writers: number of writer threads.
+        :param queue_size: maximum number of batches waiting for a writer.
+        :param song_batch_size: number of songs inserted at a time, in a single transaction.
+        :param hash_batch_size: number of fingerprints inserted by each statement.
+        :param on_written: called with the file hashes of every batch of songs written, from the writer threads.
+        """
+        super().__init__()
+
+        self.db = db
+        self.song_batch_size = max(song_batch_size, 1)
+        self.hash_batch_size = hash_batch_size
+        self.on_written = on_written
+        self.stats = IngestionStats()
+
+        self._batch = []
+        self._batches = queue.Queue(maxsize=max(queue_size, 1))
+        self._lock = threading.Lock()
+        self._errors = []
+        self._slots = None
+        self._closed = threading.Event()
+        self._aborted = threading.Event()
+
+        self._writers = [threading.Thread(target=self._write, daemon=True) for _ in range(max(writers, 1))]
+        for writer in self._writers:
+            writer.start()
+
+    def throttle(self, tasks: Iterable, max_pending: int) -> Iterator:
+        """
+        Hands out tasks only while fewer than max_pending of them are pending, so a pool consuming them stops
+        taking new files while put is blocked. Each task is pending until its song is put into the pipeline
+        or it is released.
+
+        :param tasks: fingerprint tasks.
+        :param max_pending: maximum number of tasks handed out and not yet put or released.
+        :return: an iterator over the tasks.
+        """
+        self._slots = threading.Semaphore(max(max_pending, 1))
+        for task in tasks:
+            # the timeout lets the pipeline be closed (e.g. after an error) while waiting for a slot.
+            while not self._slots.acquire(timeout=0.1):
+                if self._closed.is_set():
+                    return
+            yield task
+
+    def release(self, failed: bool = True) -> None:
+        """
+        Accounts for a task which produced no song, because its file could not be fingerprinted or because it
+        only fingerprinted a part of a file, whose song is put once every part is done.
+
+        :param failed: whether the task failed.
+        """
+        if failed:
+            with self._lock:
+                self.stats.files_failed += 1
+
+        if self._slots is not None:
+            self._slots.release()
+
+    def put(self, song_name: str, file_hash: str, hashes: Iterable[Tuple[str, int]]) -> None:
+        """
+        Adds a fingerprinted song to the current batch, which is queued for the writers once it is full.
+        Blocks while the queue is full.
+
+        :param song_name: name of the song.
+        :param file_hash: sha1 of the song file.
+        :param hashes: fingerprints of the song, e.g. a set of tuples of hash and offset or SharedFingerprints.
+        """
+        if self._errors:
+            self._release([(song_name, file_hash, hashes)])
+        self._raise_errors()
+
+        with self._lock:
+            self.stats.files_fingerprinted += 1
+            self.stats.hashes_fingerprinted += len(hashes)
+
+        self._batch.append((song_name, file_hash, hashes))
+        if len(self._batch) >= self.song_batch_size:
+            self._flush()
+
+        if self._slots is not None:
+            self._slots.release()
+
+    def close(self) -> None:
+        """
+        Queues the last batch, waits for the writers to finish and raises the first error any of them
+        found, if any.
+        """
+        try:
+            if self._batch and not self._errors:
+                self._flush()
+        finally:
+            self._stop()
+
+        self._raise_errors()
+
+    def abort(self) -> None:
+        """
+        Stops the writers without writing the batches not written yet.
+        """
+        self._aborted.set()
+        self._release(self._batch)
+        self._batch = []
+        self._stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _stop(self) -> None:
+        """
+        Waits for the writers to finish the queued batches and stops them.
+        """
+        if self._closed.is_set():
+            return
+
+        self._closed.set()
+        for _ in self._writers:
+            self._batches.put(None)
+        for writer in self._writers:
+            writer.join()
+
+    def _flush(self) -> None:
+        """
+        Queues the current batch for the writers, waiting while the queue is full.
+        """
+        batch, self._batch = self._batch, []
+
+        t = time()
+        self._batches.put(batch)
+        waited = time() - t
+
+        with self._lock:
+            self.stats.backpressure_time += waited
+
+    def _write(self) -> None:
+        """
+        Writer thread loop, inserting batches until the pipeline is closed.
+        """
+        while True:
+            batch = self._batches.get()
+            if batch is None:
+                break
+
+            try:
+                # once a writer failed (or the pipeline is aborted), the remaining batches are only dequeued.
+                if self._errors or self._aborted.is_set():
+                    self._release(batch)
+                    continue
+
+                t = time()
+                try:
+                    self.db.insert_songs(batch, batch_size=self.hash_batch_size)
+                finally:
+                    self._release(batch)
+                write_time = time() - t
+
+                with self._lock:
+                    self.stats.songs_written += len(batch)
+                    self.stats.hashes_written += sum(len(hashes) for _, _, hashes in batch)
+                    self.stats.batches_written += 1
+                    self.stats.write_time += write_time
+
+                if self.on_written is not None:
+                    self.on_written([file_hash for _, file_hash, _ in batch])
+            except Exception as e:
+                # raised by the next put, or by close.
+                self._errors.append(e)
+
+    @staticmethod
+    def _release(batch: List[Tuple[str, str, Iterable[Tuple[str, int]]]]) -> None:
+        """
+        Releases the fingerprints of a batch of songs which need it once they are not needed anymore.
+
+        :param batch: a list of tuples with the song name, the file hash and the fingerprints of each song.
+        """
+        for _, _, hashes in batch:
+            release = getattr(hashes, "release", None)
+            if release is not None:
+                release()
+
+    def _raise_errors(self) -> None:
+        """
+        Raises the first error a writer found, if any.
+        """
+        if self._errors:
+            raise self._errors[0]
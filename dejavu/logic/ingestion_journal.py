@@ -0,0 +1,122 @@
+import os
+import threading
+from typing import Dict, Iterable
+
+from dejavu.logic.file_manifest import FileManifest
+
+# States of a file in an ingestion job, in the order it goes through them.
+QUEUED = "queued"
+FINGERPRINTED = "fingerprinted"
+COMMITTED = "committed"
+STATES = [QUEUED, FINGERPRINTED, COMMITTED]
+
+
+class IngestionJournal(FileManifest):
+    """
+    Local journal of a bulk ingestion job (see Dejavu.fingerprint_directory), with the state of every file
+    the job found, so a job which crashed or was killed is resumed where it stopped by running it again with
+    the same journal.
+
+    Each file is:
+        - queued once it is hashed and handed out to be fingerprinted (or found already fingerprinted).
+        - fingerprinted once its fingerprints are waiting to be written into the database.
+        - committed once the transaction which wrote its song (and fingerprints) is committed.
+    Committed files which did not change since are skipped altogether when the job runs again, they are
+    neither hashed nor looked up in the database. Any other file is done again: songs left half written are
+    removed by the database setup, and files already fingerprinted are not decoded again if there is a
+    fingerprint cache.
+
+    Files and their sha1 are recorded as in a FileManifest (so a journal is a manifest as well), and their
+    state in a table of its own. Unlike a manifest, the journal can be used from several threads at a time.
+    State changes are written to it by checkpoint, which is done whenever songs are committed, and when
+    closing it.
+    """
+    def __init__(self, path: str):
+        """
+        Opens the journal, creating it if needed.
+
+        :param path: path to the sqlite database file.
+        """
+        super().__init__(path)
+
+        self._lock = threading.Lock()
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS states (
+                path TEXT PRIMARY KEY
+            ,   state TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_files_sha1 ON files (sha1);
+        """)
+        self._connection.commit()
+
+    def is_committed(self, file_path: str, stat: os.stat_result = None) -> bool:
+        """
+        Tells whether a file was committed by the job and did not change since.
+
+        :param file_path: path to the file.
+        :param stat: result of os.stat for the file, if already known.
+        :return: True if the file is done.
+        """
+        stat = stat or os.stat(file_path)
+        with self._lock:
+            if self.get(file_path, stat) is None:
+                return False
+            row = self._connection.execute(
+                "SELECT 1 FROM states WHERE path = ? AND state = ?;", (self._key(file_path), COMMITTED)
+            ).fetchone()
+        return row is not None
+
+    def queue(self, file_path: str, file_hash: str, stat: os.stat_result = None) -> None:
+        """
+        Records a file found by the job, as queued.
+
+        :param file_path: path to the file.
+        :param file_hash: sha1 of the file content.
+        :param stat: result of os.stat for the file when it was hashed (or before), if already known.
+        """
+        stat = stat or os.stat(file_path)
+        with self._lock:
+            self.put(file_path, file_hash, stat)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO states (path, state) VALUES (?, ?);", (self._key(file_path), QUEUED)
+            )
+
+    def mark(self, file_hashes: Iterable[str], state: str) -> None:
+        """
+        Moves files to a new state, by their content (so every file with the same content is moved).
+
+        :param file_hashes: sha1 of the files.
+        :param state: one of STATES.
+        """
+        if state not in STATES:
+            raise ValueError(f"Unknown ingestion state {state}, must be one of {STATES}.")
+
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE states SET state = ? WHERE path IN (SELECT path FROM files WHERE sha1 = ?);",
+                [(state, file_hash) for file_hash in file_hashes]
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Counts the files in each state.
+
+        :return: a dictionary with the number of files (value) in each state (key).
+        """
+        with self._lock:
+            counts = dict(self._connection.execute("SELECT state, COUNT(*) FROM states GROUP BY state;").fetchall())
+        return {state: counts.get(state, 0) for state in STATES}
+
+    def checkpoint(self) -> None:
+        """
+        Writes the state changes to the journal.
+        """
+        with self._lock:
+            self.commit()
+
+    def close(self) -> None:
+        """
+        Writes the state changes and closes the journal.
+        """
+        with self._lock:
+            super().close()
@@ -11,12 +11,48 @@ class FileRecognizer(BaseRecognizer):
     def __init__(self, dejavu):
         super().__init__(dejavu)
 
-    def recognize_file(self, filename: str) -> Dict[str, any]:
-        channels, self.Fs, _ = decoder.read(filename, self.dejavu.limit)
+    def recognize_file(self, filename: str, start: float = None, limit: int = None,
+                       nprocesses: int = None) -> Dict[str, any]:
+        # only the window from start to start + limit seconds is decoded (limit defaults to the
+        # fingerprint_limit config).
+        limit = limit or self.dejavu.limit
 
-        t = time()
-        matches, fingerprint_time, query_time, align_time = self._recognize(*channels)
-        t = time() - t
+        cache = self.dejavu.cache
+        file_hash = None
+        if cache is not None:
+            # a file already fingerprinted with the same settings is neither decoded nor fingerprinted.
+            file_hash = self.dejavu.get_file_hash(filename)
+            cache_options = self.dejavu.get_cache_options(limit, self.dejavu.analysis_rate, self.dejavu.downmix,
+                                                          self.dejavu.fingerprint_options, start=start)
+            cached = cache.get(file_hash, cache_options)
+        else:
+            cached = None
+
+        if cached is not None:
+            hashes, self.Fs = cached
+
+            t = time()
+            matches, fingerprint_time, query_time, align_time = self._match(hashes, 0)
+            t = time() - t
+        elif nprocesses is not None:
+            # long recordings are fingerprinted by several processes (see get_file_fingerprints_parallel).
+            t = time()
+            hashes, self.Fs = self.dejavu.get_file_fingerprints_parallel(filename, limit, nprocesses=nprocesses,
+                                                                         start=start, file_hash=file_hash,
+                                                                         cache=cache)
+            matches, fingerprint_time, query_time, align_time = self._match(hashes, time() - t)
+            t = time() - t
+        else:
+            channels, self.Fs, _ = decoder.read(filename, limit, analysis_rate=self.dejavu.analysis_rate,
+                                                downmix=self.dejavu.downmix, start=start, hash_file=False)
+
+            t = time()
+            hashes, fingerprint_time = self._fingerprint(*channels)
+            matches, fingerprint_time, query_time, align_time = self._match(hashes, fingerprint_time)
+            t = time() - t
+
+            if cache is not None:
+                cache.put(file_hash, cache_options, hashes, self.Fs)
 
         results = {
             TOTAL_TIME: t,
@@ -28,5 +64,6 @@ class FileRecognizer(BaseRecognizer):
 
         return results
 
-    def recognize(self, filename: str) -> Dict[str, any]:
-        return self.recognize_file(filename)
+    def recognize(self, filename: str, start: float = None, limit: int = None,
+                  nprocesses: int = None) -> Dict[str, any]:
+        return self.recognize_file(filename, start=start, limit=limit, nprocesses=nprocesses)
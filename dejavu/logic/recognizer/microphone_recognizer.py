@@ -1,6 +1,7 @@
 import numpy as np
 import pyaudio
 
+import dejavu.logic.decoder as decoder
 from dejavu.base_classes.base_recognizer import BaseRecognizer
 
 
@@ -61,7 +62,9 @@ class MicrophoneRecognizer(BaseRecognizer):
     def recognize_recording(self):
         if not self.recorded:
             raise NoRecordingError("Recording was not complete/begun")
-        return self._recognize(*self.data)
+        channels, self.Fs = decoder.resample(self.data, self.samplerate, analysis_rate=self.dejavu.analysis_rate,
+                                             downmix=self.dejavu.downmix)
+        return self._recognize(*channels)
 
     def get_recorded_time(self):
         return len(self.data[0]) / self.rate
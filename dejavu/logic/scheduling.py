@@ -0,0 +1,147 @@
+import heapq
+import os
+import queue
+import threading
+from typing import Any, Iterable, Iterator, List, Tuple
+
+import dejavu.logic.decoder as decoder
+from dejavu.config.settings import (MAX_HASH_TIME_DELTA, PEAK_DENSITY_WINDOW,
+                                    PEAK_NEIGHBORHOOD_SIZE, SCHEDULE_BITRATE)
+from dejavu.logic.wav_reader import WavFormatError, WavReader
+
+
+def longest_first(tasks: Iterable[Tuple[float, Any]]) -> Iterator[Any]:
+    """
+    Hands out tasks longest first, out of the ones produced so far. Tasks are produced by a thread of their
+    own, so whenever a task is asked for, the longest one among all those produced meanwhile is handed out,
+    and the first one is handed out as soon as it is produced. So once tasks are produced faster than they
+    are consumed (e.g. when a directory is scanned faster than it is fingerprinted), they are consumed
+    longest first, and a long one does not stall the end of the run by being picked up last.
+
+    :param tasks: tuples of the estimated cost of each task and the task.
+    :return: an iterator over the tasks.
+    """
+    produced = queue.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def produce() -> None:
+        try:
+            for task in tasks:
+                produced.put(task)
+                # once the consumer stops iterating, no more tasks are produced.
+                if stop.is_set():
+                    break
+        except BaseException as e:
+            produced.put((done, e))
+        else:
+            produced.put((done, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    # costs are negated for a max heap, and ties are handed out in the order they were produced.
+    pending = []
+    count = 0
+    finished = False
+    try:
+        while not finished or pending:
+            # every task produced so far is taken, waiting for one only if there are none pending.
+            while not finished:
+                try:
+                    item = produced.get(block=not pending)
+                except queue.Empty:
+                    break
+
+                if item[0] is done:
+                    finished = True
+                    if item[1] is not None:
+                        raise item[1]
+                else:
+                    heapq.heappush(pending, (-item[0], count, item[1]))
+                    count += 1
+
+            if pending:
+                yield heapq.heappop(pending)[2]
+    finally:
+        stop.set()
+
+
+def estimate_seconds(file_name: str, limit: int = None) -> float:
+    """
+    Estimates how many seconds of audio are fingerprinted from a file, from the header of wav files and from
+    the size of any other one (see SCHEDULE_BITRATE).
+
+    :param file_name: path to the file.
+    :param limit: number of seconds fingerprinted at most.
+    :return: the estimated number of seconds.
+    """
+    try:
+        wav = WavReader(file_name)
+        seconds = wav.nframes / wav.fs
+    except WavFormatError:
+        seconds = os.path.getsize(file_name) * 8 / SCHEDULE_BITRATE
+
+    return min(seconds, limit) if limit else seconds
+
+
+def split_file(file_name: str, nparts: int, limit: int, wsize: int, hop: int, start: float = None,
+               analysis_rate: int = None, downmix: bool = False) -> List[Tuple[int, int]]:
+    """
+    Splits the audio of a file in about nparts ranges of frames (spectrogram columns), whose fingerprints
+    can be computed separately (see decode_window), and together are those of the whole file. Ranges start
+    at a multiple of PEAK_DENSITY_WINDOW, as peaks are capped in windows of frames counted from the start of
+    the audio, and the last one is open, so the ranges cover the whole audio even if its length is only an
+    estimate (see estimate_seconds), as it is for any file but wav files read as they are.
+
+    :param file_name: path to the file.
+    :param nparts: number of ranges.
+    :param limit: number of seconds fingerprinted at most.
+    :param wsize: FFT window size.
+    :param hop: number of samples between frames.
+    :param start: number of seconds into the file where fingerprinting starts.
+    :param analysis_rate: sampling rate the channels are resampled to, None keeps the file one.
+    :param downmix: whether the channels are mixed down into a single one.
+    :return: a list of the first and last (not included, None for the last range) frames of each range.
+    """
+    audio = decoder.probe(file_name, analysis_rate=analysis_rate, downmix=downmix) if nparts > 1 else None
+    if audio is None:
+        return [(0, None)]
+
+    _, fs, nsamples = audio
+    if nsamples is None:
+        nsamples = int(estimate_seconds(file_name) * fs)
+
+    nsamples = max(nsamples - int(round((start or 0) * fs)), 0)
+    if limit:
+        nsamples = min(nsamples, int(round(limit * fs)))
+
+    nframes = (nsamples - wsize) // hop + 1 if nsamples >= wsize else 0
+    bounds = sorted({index * nframes // nparts // PEAK_DENSITY_WINDOW * PEAK_DENSITY_WINDOW
+                     for index in range(nparts)})
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def decode_window(first: int, last: int, wsize: int, hop: int) -> Tuple[int, Tuple[int, int]]:
+    """
+    Window of the audio to be decoded to compute the fingerprints anchored in a range of frames exactly as
+    they are computed from the whole audio, which is the range along with:
+        - before it, the neighborhood of the peaks in its first frames (PEAK_NEIGHBORHOOD_SIZE frames,
+        rounded up to whole PEAK_DENSITY_WINDOW windows so the peak cap windows are the same).
+        - after it, MAX_HASH_TIME_DELTA frames for the peaks its last frames are paired with, up to the end
+        of their window, and their neighborhood.
+    Only the fingerprints anchored in the range are to be kept, the others may be missing or wrong.
+
+    :param first: first frame of the range.
+    :param last: last frame (not included) of the range, None up to the end of the audio.
+    :param wsize: FFT window size.
+    :param hop: number of samples between frames.
+    :return: a tuple with the first frame of the window, and the window of samples (see decoder.read_blocks).
+    """
+    context = -(-PEAK_NEIGHBORHOOD_SIZE // PEAK_DENSITY_WINDOW) * PEAK_DENSITY_WINDOW
+    start = max(first - context, 0)
+
+    if last is None:
+        return start, (start * hop, None)
+
+    end = -(-(last + MAX_HASH_TIME_DELTA) // PEAK_DENSITY_WINDOW) * PEAK_DENSITY_WINDOW + PEAK_NEIGHBORHOOD_SIZE
+    return start, (start * hop, (end - 1) * hop + wsize - start * hop)
@@ -0,0 +1,199 @@
+import os
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8
+    resource_tracker = shared_memory = None
+
+# Shared memory blocks are only kept alive with no process attached to them on POSIX systems, on any other
+# (or before Python 3.8, which has no shared memory module) the arrays are pickled along with the descriptor
+# instead.
+SHARED_MEMORY_AVAILABLE = os.name == "posix" and shared_memory is not None
+
+
+def pack_fingerprints(fingerprints: Iterable[Tuple[str, int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Packs fingerprints into a hash and an offset array. Hex hashes are packed as bytes, a quarter of the
+    size of numpy unicode strings, and packed integer hashes (see the "int32" and "int64" hash formats) as
+    64 bit integers.
+
+    :param fingerprints: hashes and their corresponding offsets.
+    :return: a tuple with the hash and the offset arrays.
+    """
+    fingerprints = list(fingerprints)
+    hashes = [hsh for hsh, _ in fingerprints]
+    offsets = np.array([offset for _, offset in fingerprints], dtype=np.int64)
+
+    if not hashes or not isinstance(hashes[0], str):
+        return np.array(hashes, dtype=np.int64), offsets
+
+    widths = set(map(len, hashes))
+    if len(widths) == 1 and hashes[0]:
+        # hashes of the same length (as those of a single hash format are) are packed by joining them, which
+        # is several times faster than numpy converting them one by one.
+        return np.frombuffer("".join(hashes).encode("ascii"), dtype=f"S{widths.pop()}"), offsets
+
+    return np.array(hashes, dtype="S"), offsets
+
+
+def unpack_fingerprints(hashes: np.ndarray, offsets: np.ndarray) -> Tuple[List[str], List[int]]:
+    """
+    Unpacks fingerprints packed by pack_fingerprints, column by column.
+
+    :param hashes: hash array.
+    :param offsets: offset array.
+    :return: a tuple with the list of hashes and the list of their corresponding offsets, as Python objects.
+    """
+    if hashes.dtype.kind == "S":
+        # decoding the bytes objects is faster than converting to a numpy unicode array first.
+        return list(map(bytes.decode, hashes.tolist())), offsets.tolist()
+
+    return hashes.tolist(), offsets.tolist()
+
+
+def start_tracker() -> None:
+    """
+    Starts the process which unlinks the shared memory blocks still linked when this process exits, if it is
+    not running yet. Started before creating a multiprocessing pool, the workers share it, so blocks created
+    by a worker (see SharedFingerprints) and never released are unlinked as well.
+    """
+    if SHARED_MEMORY_AVAILABLE:
+        resource_tracker.ensure_running()
+
+
+class SharedFingerprints(object):
+    """
+    Fingerprints of a file packed into arrays (see pack_fingerprints) in a shared memory block, so a
+    multiprocessing worker can hand them to the parent process with only this small descriptor being
+    pickled, instead of a set of millions of tuples.
+
+    The block is created by the worker and it outlives it, until the parent releases it once the fingerprints
+    have been used (e.g. written into the database by an IngestionPipeline). The fingerprints are read
+    column by column (see columns), which the database inserts them from, or iterating over the descriptor
+    yields them as tuples of hash and offset, as for a set of them.
+    """
+    def __init__(self, fingerprints: Iterable[Tuple[str, int]]):
+        """
+        Packs the fingerprints into a new shared memory block.
+
+        :param fingerprints: hashes and their corresponding offsets.
+        """
+        super().__init__()
+
+        hashes, offsets = pack_fingerprints(fingerprints)
+
+        self.count = len(offsets)
+        self.hash_dtype = hashes.dtype.str
+        self.name = None
+        self._arrays = None
+
+        if not SHARED_MEMORY_AVAILABLE:
+            self._arrays = hashes, offsets
+            return
+
+        # offsets go first so both arrays are aligned.
+        block = shared_memory.SharedMemory(create=True, size=max(offsets.nbytes + hashes.nbytes, 1))
+        try:
+            np.frombuffer(block.buf, dtype=offsets.dtype, count=self.count)[:] = offsets
+            np.frombuffer(block.buf, dtype=hashes.dtype, count=self.count, offset=offsets.nbytes)[:] = hashes
+        except BaseException:
+            block.close()
+            block.unlink()
+            raise
+
+        self.name = block.name
+        block.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        return zip(*self.columns())
+
+    def columns(self) -> Tuple[List[str], List[int]]:
+        """
+        Reads the fingerprints from the shared memory block, which is left as it is.
+
+        :return: a tuple with the list of hashes and the list of their corresponding offsets.
+        """
+        if self._arrays is not None:
+            return unpack_fingerprints(*self._arrays)
+        elif self.name is None:
+            raise ValueError("The fingerprints were already released")
+
+        block = shared_memory.SharedMemory(name=self.name)
+        try:
+            # the fingerprints are copied out, as the block can't be closed while arrays are using it.
+            return self._read(block)
+        finally:
+            block.close()
+
+    def _read(self, block: "shared_memory.SharedMemory") -> Tuple[List[str], List[int]]:
+        """
+        Unpacks the fingerprints from a shared memory block.
+
+        :param block: block the fingerprints were packed into.
+        :return: a tuple with the list of hashes and the list of their corresponding offsets.
+        """
+        offsets = np.frombuffer(block.buf, dtype=np.int64, count=self.count)
+        hashes = np.frombuffer(block.buf, dtype=self.hash_dtype, count=self.count, offset=offsets.nbytes)
+        return unpack_fingerprints(hashes, offsets)
+
+    def release(self) -> None:
+        """
+        Frees the shared memory block, after which the fingerprints can't be read anymore.
+        """
+        if self.name is not None:
+            try:
+                block = shared_memory.SharedMemory(name=self.name)
+            except FileNotFoundError:  # already released.
+                pass
+            else:
+                block.close()
+                block.unlink()
+            self.name = None
+
+        self._arrays = None
+
+
+class FingerprintParts(object):
+    """
+    Fingerprints of a file fingerprinted in parts (e.g. time ranges fingerprinted by different workers),
+    which are used as the fingerprints of the whole file, the way SharedFingerprints are.
+    """
+    def __init__(self, parts: List[SharedFingerprints]):
+        """
+        :param parts: fingerprints of each part, no fingerprint can be in more than one of them.
+        """
+        super().__init__()
+
+        self.parts = parts
+
+    def __len__(self) -> int:
+        return sum(len(part) for part in self.parts)
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        return zip(*self.columns())
+
+    def columns(self) -> Tuple[List[str], List[int]]:
+        """
+        Reads the fingerprints of every part.
+
+        :return: a tuple with the list of hashes and the list of their corresponding offsets.
+        """
+        hashes, offsets = [], []
+        for part in self.parts:
+            part_hashes, part_offsets = part.columns()
+            hashes += part_hashes
+            offsets += part_offsets
+        return hashes, offsets
+
+    def release(self) -> None:
+        """
+        Frees the fingerprints of every part.
+        """
+        for part in self.parts:
+            part.release()
@@ -0,0 +1,84 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+
+class SongCache(object):
+    """
+    In-process cache of the metadata of songs (name, file sha1 and number of hashes) by song id, so results
+    are formatted without a database round trip (and a connection) per song recognized. At most max_size
+    songs are kept, the least recently used ones are dropped first.
+
+    Songs are invalidated by the database they belong to whenever they are inserted or deleted through it.
+    Changes made by other processes are not seen, a song deleted by one may still be served from the cache
+    of another until it is dropped.
+
+    The cache can be used from any thread.
+    """
+    def __init__(self, max_size: int):
+        """
+        :param max_size: maximum number of songs kept, 0 (or None) disables the cache.
+        """
+        super().__init__()
+
+        self.max_size = max_size or 0
+
+        self._lock = threading.Lock()
+        self._songs = OrderedDict()
+
+    def get_many(self, song_ids: Iterable[int]) -> Tuple[Dict[int, Dict[str, str]], List[int]]:
+        """
+        Looks up songs in the cache, marking the ones found as the most recently used.
+
+        :param song_ids: song identifiers.
+        :return: a tuple with a dictionary with the songs found (value) by song id (key), and a list with the
+        song ids not found.
+        """
+        found, missing = {}, []
+        with self._lock:
+            for song_id in song_ids:
+                song = self._songs.get(song_id)
+                if song is None:
+                    missing.append(song_id)
+                else:
+                    self._songs.move_to_end(song_id)
+                    found[song_id] = dict(song)
+
+        return found, missing
+
+    def put_many(self, songs: Dict[int, Dict[str, str]]) -> None:
+        """
+        Adds songs to the cache, dropping the least recently used ones beyond max_size.
+
+        :param songs: a dictionary with the songs (value) by song id (key).
+        """
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            for song_id, song in songs.items():
+                self._songs[song_id] = dict(song)
+                self._songs.move_to_end(song_id)
+
+            while len(self._songs) > self.max_size:
+                self._songs.popitem(last=False)
+
+    def invalidate(self, song_ids: Iterable[int]) -> None:
+        """
+        Drops songs from the cache.
+
+        :param song_ids: song identifiers.
+        """
+        with self._lock:
+            for song_id in song_ids:
+                self._songs.pop(song_id, None)
+
+    def clear(self) -> None:
+        """
+        Drops every song from the cache.
+        """
+        with self._lock:
+            self._songs.clear()
+
+    def __len__(self) -> int:
+        return len(self._songs)
@@ -0,0 +1,208 @@
+import struct
+from typing import Any, BinaryIO, Iterator, Tuple
+
+import numpy as np
+
+# wav format tags.
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavFormatError(Exception):
+    """
+    Raised for files which are not wav files or whose encoding the reader does not support.
+    """
+    pass
+
+
+class WavReader(object):
+    """
+    Reads PCM (8, 16, 24 and 32 bit) and IEEE float (32 and 64 bit) wav files, including RF64 ones,
+    by memory mapping their data chunk instead of reading it.
+
+    Reads can also update a sha1 hash with the whole content of the file, from the same mapping, so
+    the file isn't read again to hash it.
+
+    Samples are returned as 16 bit arrays of frames by channels. For 16 bit files those are just views
+    over the mapped file, so nothing is copied or even read until the samples are used, and then only
+    the pages used are read. Any other format is converted in chunks of chunk_frames frames into a
+    16 bit buffer, keeping the most significant bits.
+    """
+    def __init__(self, file_name: str, chunk_frames: int = 2**18):
+        """
+        Reads the wav header and maps the data chunk.
+
+        :param file_name: wav file to be read.
+        :param chunk_frames: number of frames converted at a time for formats other than 16 bit PCM.
+        """
+        super().__init__()
+
+        self.file_name = file_name
+        self.chunk_frames = chunk_frames
+        self._bytes = None
+
+        with open(file_name, "rb") as f:
+            format_tag, self.channels, self.fs, self.sampwidth, data_offset, data_size = self._read_header(f)
+            f.seek(0, 2)
+            self.file_size = f.tell()
+
+        if self.channels == 0:
+            raise WavFormatError(f"{file_name} has no channels")
+        elif format_tag == WAVE_FORMAT_PCM and self.sampwidth in (1, 2, 3, 4):
+            self._dtype = {1: np.uint8, 2: np.dtype("<i2"), 3: np.uint8, 4: np.dtype("<i4")}[self.sampwidth]
+        elif format_tag == WAVE_FORMAT_IEEE_FLOAT and self.sampwidth in (4, 8):
+            self._dtype = np.dtype(f"<f{self.sampwidth}")
+        else:
+            raise WavFormatError(f"Unsupported wav format {format_tag} with {self.sampwidth * 8} bits "
+                                 f"in {file_name}")
+
+        # files being written (or truncated) may have less data than their header says.
+        self._data_offset = data_offset
+        self._frame_size = self.sampwidth * self.channels
+        self.nframes = min(data_size, self.file_size - data_offset) // self._frame_size
+
+        if self.nframes > 0:
+            shape = (self.nframes, self.channels, 3) if self.sampwidth == 3 else (self.nframes, self.channels)
+            self._data = np.memmap(file_name, dtype=self._dtype, mode="r", offset=data_offset, shape=shape)
+        else:
+            self._data = np.empty((0, self.channels, 3) if self.sampwidth == 3 else (0, self.channels),
+                                  dtype=self._dtype)
+
+    def read(self, start: float = None, limit: int = None, sha1_hash: Any = None) -> np.ndarray:
+        """
+        Reads a window of the file as 16 bit samples.
+
+        :param start: number of seconds into the file where reading starts.
+        :param limit: number of seconds to read, None reads up to the end.
+        :param sha1_hash: hash updated with the whole content of the file, if given.
+        :return: an array of frames by channels.
+        """
+        first, last = self._window(start, limit)
+
+        if sha1_hash is not None:
+            self._hash_bytes(sha1_hash, 0, self.file_size)
+
+        if self._dtype == np.dtype("<i2"):
+            return self._data[first:last]
+
+        samples = np.empty((last - first, self.channels), dtype=np.int16)
+        for index in range(first, last, self.chunk_frames):
+            end = min(index + self.chunk_frames, last)
+            samples[index - first:end - first] = self._to_int16(self._data[index:end])
+
+        return samples
+
+    def blocks(self, block_frames: int, start: float = None, limit: int = None,
+               sha1_hash: Any = None) -> Iterator[np.ndarray]:
+        """
+        Reads a window of the file in blocks of 16 bit samples.
+
+        :param block_frames: number of frames (samples per channel) of each block.
+        :param start: number of seconds into the file where reading starts.
+        :param limit: number of seconds to read, None reads up to the end.
+        :param sha1_hash: hash updated with the whole content of the file, if given, block by block as
+        they are read. It is complete once every block has been read.
+        :return: an iterator over arrays of frames by channels, the last one may be shorter.
+        """
+        first, last = self._window(start, limit)
+
+        if sha1_hash is not None:
+            self._hash_bytes(sha1_hash, 0, self._data_offset + first * self._frame_size)
+
+        for index in range(first, last, block_frames):
+            end = min(index + block_frames, last)
+            if sha1_hash is not None:
+                self._hash_bytes(sha1_hash, self._data_offset + index * self._frame_size,
+                                 self._data_offset + end * self._frame_size)
+            yield self._data[index:end] if self._dtype == np.dtype("<i2") else self._to_int16(self._data[index:end])
+
+        if sha1_hash is not None:
+            self._hash_bytes(sha1_hash, self._data_offset + last * self._frame_size, self.file_size)
+
+    def _hash_bytes(self, sha1_hash: Any, begin: int, end: int) -> None:
+        """
+        Updates a hash with a range of bytes of the file, from a mapping of the whole file which shares
+        its pages with the data one.
+
+        :param sha1_hash: hash to update.
+        :param begin: first byte of the range.
+        :param end: last byte (not included) of the range.
+        """
+        if begin >= end:
+            return
+
+        if self._bytes is None:
+            self._bytes = np.memmap(self.file_name, dtype=np.uint8, mode="r", shape=(self.file_size,))
+
+        sha1_hash.update(self._bytes[begin:end])
+
+    def _window(self, start: float, limit: int) -> Tuple[int, int]:
+        """
+        First and last (not included) frames of a window of the file.
+
+        :param start: number of seconds into the file where the window starts.
+        :param limit: number of seconds of the window, None goes up to the end.
+        :return: a tuple with the first and last frames.
+        """
+        first = min(int(round((start or 0) * self.fs)), self.nframes)
+        last = self.nframes if not limit else min(first + int(round(limit * self.fs)), self.nframes)
+        return first, last
+
+    def _to_int16(self, data: np.ndarray) -> np.ndarray:
+        """
+        Converts a chunk of samples to 16 bits.
+
+        :param data: chunk of samples as mapped from the file.
+        :return: an array of frames by channels.
+        """
+        if self.sampwidth == 1:
+            # 8 bit samples are unsigned.
+            return ((data.astype(np.int16) - 128) << 8).astype(np.int16)
+        elif self.sampwidth == 3:
+            # the two most significant bytes of each little endian 24 bit sample are a 16 bit sample.
+            return np.ascontiguousarray(data[:, :, 1:]).view("<i2").reshape(data.shape[:2])
+        elif self._dtype.kind == "i":
+            return (data >> 16).astype(np.int16)
+        else:
+            return np.clip(np.rint(data * 32768), -32768, 32767).astype(np.int16)
+
+    def _read_header(self, f: BinaryIO) -> Tuple[int, int, int, int, int, int]:
+        """
+        Reads the RIFF (or RF64) header and the chunks up to the data one.
+
+        :param f: file opened in binary mode.
+        :return: a tuple with the format tag, number of channels, sampling rate, bytes per sample, and
+        the offset and size of the data chunk.
+        """
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] not in (b"RIFF", b"RF64") or riff[8:] != b"WAVE":
+            raise WavFormatError(f"{self.file_name} is not a wav file")
+
+        fmt, ds64_data_size = None, None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise WavFormatError(f"{self.file_name} has no data chunk")
+
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"data":
+                if fmt is None:
+                    raise WavFormatError(f"{self.file_name} has no fmt chunk before its data")
+                if ds64_data_size is not None and size == 0xFFFFFFFF:
+                    size = ds64_data_size
+                return (*fmt, f.tell(), size)
+
+            body = f.read(size + size % 2)  # chunks are word aligned.
+            if chunk_id == b"fmt ":
+                if len(body) < 16:
+                    raise WavFormatError(f"{self.file_name} has a truncated fmt chunk")
+                format_tag, channels, fs = struct.unpack("<HHI", body[:8])
+                bits = struct.unpack("<H", body[14:16])[0]
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    # the actual format is the first two bytes of the sub format GUID.
+                    format_tag = struct.unpack("<H", body[24:26])[0]
+                fmt = (format_tag, channels, fs, (bits + 7) // 8)
+            elif chunk_id == b"ds64":
+                # RF64 keeps the 64 bit sizes in this chunk.
+                ds64_data_size = struct.unpack("<Q", body[8:16])[0]
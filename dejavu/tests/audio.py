@@ -0,0 +1,31 @@
+import numpy as np
+
+from dejavu.config.settings import DEFAULT_FS
+
+
+def synthetic_audio(seconds: float, Fs: int = DEFAULT_FS, seed: int = 0, channels: int = 1) -> np.ndarray:
+    """
+    Deterministic audio for the unit tests, with enough spectral peaks to be fingerprinted: short tones at
+    random frequencies and times over some noise.
+
+    :param seconds: length of the audio.
+    :param Fs: sampling rate.
+    :param seed: seed of the random generator, the same seed gives the same audio.
+    :param channels: number of channels.
+    :return: an int16 array of shape (channels, samples).
+    """
+    rng = np.random.default_rng(seed)
+    nsamples = int(seconds * Fs)
+    t = np.arange(nsamples) / Fs
+
+    audio = np.empty((channels, nsamples), dtype=np.int16)
+    for channel in range(channels):
+        signal = rng.normal(0, 300, nsamples)
+        for _ in range(int(seconds * 20)):
+            start = rng.integers(0, max(nsamples - Fs // 4, 1))
+            length = rng.integers(Fs // 20, Fs // 4)
+            tone = np.sin(2 * np.pi * rng.uniform(100, Fs / 2.5) * t[:length]) * rng.uniform(2000, 8000)
+            signal[start:start + length] += tone[:nsamples - start]
+        audio[channel] = np.clip(signal, -32768, 32767).astype(np.int16)
+
+    return audio
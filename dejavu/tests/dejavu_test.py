@@ -12,9 +12,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 from pydub import AudioSegment
 
-from dejavu.config.settings import (DEFAULT_FS, DEFAULT_OVERLAP_RATIO,
-                                    DEFAULT_WINDOW_SIZE, HASHES_MATCHED,
-                                    OFFSET, RESULTS, SONG_NAME, TOTAL_TIME)
+from dejavu.config.settings import (HASHES_MATCHED, OFFSET_SECS, RESULTS,
+                                    SONG_NAME, TOTAL_TIME)
 from dejavu.logic.decoder import get_audio_name_from_path
 
 
@@ -160,8 +159,7 @@ class DejavuTest:
                     song_start_time = re.findall("_[^_]+", f.replace(song, ""))
                     song_start_time = song_start_time[0].lstrip("_ ")
 
-                    result_start_time = round((match[OFFSET] * DEFAULT_WINDOW_SIZE *
-                                               DEFAULT_OVERLAP_RATIO) / DEFAULT_FS, 0)
+                    result_start_time = round(match[OFFSET_SECS], 0)
 
                     self.result_matching_times[line][col] = int(result_start_time) - int(song_start_time)
                     if abs(self.result_matching_times[line][col]) == 1:
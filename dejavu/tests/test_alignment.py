@@ -0,0 +1,85 @@
+import random
+import unittest
+from collections import Counter
+from itertools import groupby
+
+import numpy as np
+
+from dejavu.logic.alignment import align, match_arrays
+
+
+def reference_align(matches, topn, bin_size=1):
+    """
+    Aligns the matches the way dejavu originally did, by sorting and grouping tuples, with bins of offsets
+    counted together (the most common offset of the best bin, the smallest among ties) if bin_size > 1.
+    """
+    binned = sorted((song_id, offset // bin_size) for song_id, offset in matches)
+    counts = [(*key, len(list(group))) for key, group in groupby(binned)]
+    songs_matches = sorted([max(group, key=lambda count: count[2]) for _, group in groupby(counts, lambda c: c[0])],
+                           key=lambda count: count[2], reverse=True)[:topn]
+
+    if bin_size == 1:
+        return songs_matches
+
+    results = []
+    for song_id, best_bin, count in songs_matches:
+        in_bin = Counter(offset for sid, offset in matches if sid == song_id and offset // bin_size == best_bin)
+        offset = min(in_bin, key=lambda value: (-in_bin[value], value))
+        results.append((song_id, offset, count))
+    return results
+
+
+class AlignTest(unittest.TestCase):
+    """
+    Aligning matches over arrays gives the very same songs, offsets and counts (and ties) as sorting tuples.
+    """
+    def random_matches(self, rng: random.Random):
+        nsongs = rng.choice([1, 2, 5, 50, 5000])
+        span = rng.choice([1, 3, 50, 10 ** 6])
+        base = rng.choice([0, -500, 10 ** 5])
+        return [(rng.randrange(nsongs) * rng.choice([1, 1, 1000]), base + rng.randrange(span) - span // 2)
+                for _ in range(rng.choice([1, 3, 20, 500, 3000]))]
+
+    def test_random(self):
+        rng = random.Random(1)
+        for trial in range(300):
+            matches = self.random_matches(rng)
+            topn = rng.choice([1, 2, 5, 100])
+            with self.subTest(trial=trial):
+                self.assertEqual(align(*match_arrays(matches), topn=topn), reference_align(matches, topn))
+
+    def test_bins(self):
+        rng = random.Random(2)
+        for trial in range(200):
+            matches = self.random_matches(rng)
+            topn, bin_size = rng.choice([1, 3, 100]), rng.choice([2, 3, 8])
+            with self.subTest(trial=trial):
+                self.assertEqual(align(*match_arrays(matches), topn=topn, bin_size=bin_size),
+                                 reference_align(matches, topn, bin_size=bin_size))
+
+    def test_counts(self):
+        # matches already counted by pair (see MatchHistogram) give the same result as the matches themselves.
+        rng = random.Random(3)
+        for trial in range(200):
+            matches = self.random_matches(rng)
+            topn, bin_size = rng.choice([1, 5]), rng.choice([1, 4])
+            pairs = Counter(matches)
+            song_ids, offsets = (np.array(column, dtype=np.int64) for column in zip(*pairs))
+            counts = np.array(list(pairs.values()), dtype=np.int64)
+            with self.subTest(trial=trial):
+                self.assertEqual(align(song_ids, offsets, counts, topn=topn, bin_size=bin_size),
+                                 reference_align(matches, topn, bin_size=bin_size))
+
+    def test_ties(self):
+        # the smallest offset of a song, and the smallest song id among songs with the same count.
+        matches = [(3, 10), (3, 10), (3, 4), (3, 4), (1, 7), (1, 7), (2, 5)]
+        self.assertEqual(align(*match_arrays(matches), topn=3), [(1, 7, 2), (3, 4, 2), (2, 5, 1)])
+        self.assertEqual(align(*match_arrays(matches), topn=3), reference_align(matches, 3))
+
+    def test_empty(self):
+        self.assertEqual(align(*match_arrays([])), [])
+        self.assertEqual(align(*match_arrays([(1, 2)]), topn=0), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
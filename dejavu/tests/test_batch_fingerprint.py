@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import dejavu.logic.fingerprint as fingerprint_module
+from dejavu.logic.fingerprint import fingerprint, fingerprint_batch
+from dejavu.tests.audio import synthetic_audio
+
+
+class BatchFingerprintTest(unittest.TestCase):
+    """
+    Fingerprints of a batch of clips are those of each clip fingerprinted on its own.
+    """
+    def setUp(self):
+        audio = synthetic_audio(12, seed=7)[0]
+        # clips of different lengths, including one shorter than a window and one much longer than the others.
+        bounds = [0, 44100, 46000, 3 * 44100, 3 * 44100 + 2000, 9 * 44100, 12 * 44100]
+        self.clips = [audio[start:end] for start, end in zip(bounds, bounds[1:])]
+
+    def assert_same_as_single(self, clips, batch_frames: int = 32, **options) -> None:
+        batch = fingerprint_batch(clips, batch_frames=batch_frames, **options)
+
+        self.assertEqual(len(batch), len(clips))
+        for index, clip in enumerate(clips):
+            with self.subTest(clip=index):
+                self.assertEqual(sorted(batch[index]), sorted(fingerprint(clip, **options)))
+
+    def test_clips(self):
+        self.assert_same_as_single(self.clips)
+
+    def test_batch_frames(self):
+        for batch_frames in (1, 500, 10 ** 6):
+            with self.subTest(batch_frames=batch_frames):
+                self.assert_same_as_single(self.clips, batch_frames=batch_frames)
+
+    def test_options(self):
+        self.assert_same_as_single(self.clips, peak_cap=2, hash_format="int32", peak_backend="morphology")
+
+    def test_single_and_empty_batch(self):
+        self.assert_same_as_single(self.clips[:1])
+        self.assertEqual(fingerprint_batch([]), [])
+
+    def test_grouped_clips(self):
+        # clips of 5 to 10 seconds share their STFT and peak search with the default batch_frames.
+        audio = synthetic_audio(30, seed=8)[0]
+        bounds = [0, 5 * 44100, 15 * 44100, 22 * 44100, 30 * 44100]
+        clips = [audio[start:end] for start, end in zip(bounds, bounds[1:])]
+
+        with mock.patch.object(fingerprint_module, "_log_spectrum", wraps=fingerprint_module._log_spectrum) as stft, \
+                mock.patch.object(fingerprint_module, "_batch_peaks", wraps=fingerprint_module._batch_peaks) as peaks:
+            batch = fingerprint_batch(clips)
+
+        # all of them at once, in a single spectrogram.
+        self.assertEqual(stft.call_count, 1)
+        self.assertEqual(peaks.call_count, 1)
+        self.assertEqual(len(peaks.call_args.args[1]), len(clips))
+        for index, clip in enumerate(clips):
+            with self.subTest(clip=index):
+                self.assertEqual(sorted(batch[index]), sorted(fingerprint(clip)))
+
+    def test_silent_clip(self):
+        self.assert_same_as_single([self.clips[0], np.zeros(44100, dtype=np.int16), self.clips[2]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.exceptions import CouldntDecodeError
+from scipy.io import wavfile
+
+import dejavu.logic.decoder as decoder
+import dejavu.logic.ffmpeg_reader as ffmpeg_reader
+from dejavu.config.settings import DEFAULT_FS
+from dejavu.logic.ffmpeg_reader import FFmpegReader, ffmpeg_available
+from dejavu.tests.audio import synthetic_audio
+
+
+def pydub_samples(file_name: str, start: float = None, limit: float = None) -> np.ndarray:
+    """
+    Samples pydub decodes, as an array of frames by channels.
+    """
+    audiofile = AudioSegment.from_file(file_name, start_second=start, duration=limit)
+    return np.frombuffer(audiofile.raw_data, np.int16).reshape(-1, audiofile.channels)
+
+
+class FFmpegReaderTest(unittest.TestCase):
+    """
+    The samples piped from ffmpeg are those pydub decodes, whole, in blocks or in a window of the file.
+    """
+    @classmethod
+    def setUpClass(cls):
+        if not ffmpeg_available():
+            raise unittest.SkipTest("ffmpeg is not available")
+
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.samples = synthetic_audio(7, seed=11, channels=2).T
+        cls.wav = os.path.join(cls.directory.name, "song.wav")
+        wavfile.write(cls.wav, DEFAULT_FS, cls.samples)
+
+        # a lossless compressed copy, which only ffmpeg decodes.
+        cls.flac = os.path.join(cls.directory.name, "song.flac")
+        subprocess.run([ffmpeg_reader.FFMPEG_BINARY, "-nostdin", "-v", "error", "-i", cls.wav, cls.flac], check=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_read(self):
+        with FFmpegReader(self.wav) as reader:
+            self.assertEqual((reader.channels, reader.fs), (2, DEFAULT_FS))
+            data = reader.read()
+        np.testing.assert_array_equal(data, pydub_samples(self.wav))
+        np.testing.assert_array_equal(data, self.samples)
+
+    def test_blocks(self):
+        for block_frames in (1000, 44100, 10 ** 6):
+            with self.subTest(block_frames=block_frames), FFmpegReader(self.wav) as reader:
+                blocks = list(reader.blocks(block_frames))
+                self.assertTrue(all(len(block) == block_frames for block in blocks[:-1]))
+                np.testing.assert_array_equal(np.concatenate(blocks), pydub_samples(self.wav))
+
+    def test_window(self):
+        for start, limit in ((None, 2), (1.5, 3), (6, None), (6, 5)):
+            with self.subTest(start=start, limit=limit), FFmpegReader(self.wav, start=start, limit=limit) as reader:
+                np.testing.assert_array_equal(reader.read(), pydub_samples(self.wav, start=start, limit=limit))
+
+    def test_compressed(self):
+        with FFmpegReader(self.flac) as reader:
+            np.testing.assert_array_equal(reader.read(), self.samples)
+
+        if shutil.which("ffprobe") is not None:
+            np.testing.assert_array_equal(FFmpegReader(self.flac).read(), pydub_samples(self.flac))
+
+    def test_downmix_and_resample(self):
+        with FFmpegReader(self.wav, analysis_rate=11025, downmix=True) as reader:
+            data = reader.read()
+            self.assertEqual((reader.channels, reader.fs), (1, 11025))
+        self.assertAlmostEqual(len(data), len(self.samples) / 4, delta=64)
+
+    def test_decoder(self):
+        with mock.patch.object(decoder, "DECODER_BACKEND", "ffmpeg"):
+            self.assertEqual(decoder.backend(), "ffmpeg")
+            channels, fs, _ = decoder.read(self.flac, hash_file=False)
+            np.testing.assert_array_equal(np.stack(channels, axis=1), self.samples)
+
+            blocks = list(decoder.read_blocks(self.flac, 2))
+            np.testing.assert_array_equal(np.concatenate([np.stack(block, axis=1) for block, _ in blocks]),
+                                          self.samples)
+
+    def test_failure(self):
+        not_audio = os.path.join(self.directory.name, "song.txt")
+        with open(not_audio, "w") as f:
+            f.write("not audio")
+        with self.assertRaises(CouldntDecodeError):
+            FFmpegReader(not_audio).read()
+
+
+class FallbackTest(unittest.TestCase):
+    """
+    Files are decoded by pydub when the ffmpeg backend is selected but ffmpeg can't be found.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.samples = synthetic_audio(3, seed=12, channels=2).T
+        self.file_name = os.path.join(self.directory.name, "song.wav")
+        wavfile.write(self.file_name, DEFAULT_FS, self.samples)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_missing_ffmpeg(self):
+        with mock.patch.object(ffmpeg_reader, "FFMPEG_BINARY", "no-such-ffmpeg-binary"), \
+                mock.patch.object(decoder, "DECODER_BACKEND", "ffmpeg"), \
+                mock.patch.object(decoder, "FFmpegReader", side_effect=AssertionError("ffmpeg is missing")), \
+                mock.patch.object(decoder, "_open_wav", return_value=None), \
+                mock.patch.object(decoder.AudioSegment, "from_file", wraps=AudioSegment.from_file) as from_file:
+            self.assertFalse(ffmpeg_available())
+            self.assertEqual(decoder.backend(), "pydub")
+
+            channels, fs, file_hash = decoder.read(self.file_name)
+            self.assertEqual((fs, file_hash), (DEFAULT_FS, decoder.unique_hash(self.file_name)))
+            np.testing.assert_array_equal(np.stack(channels, axis=1), self.samples)
+
+            blocks = list(decoder.read_blocks(self.file_name, 1))
+            np.testing.assert_array_equal(np.concatenate([np.stack(block, axis=1) for block, _ in blocks]),
+                                          self.samples)
+
+        self.assertEqual(from_file.call_count, 2)
+
+    def test_unsupported_backend(self):
+        with mock.patch.object(decoder, "DECODER_BACKEND", "gstreamer"), self.assertRaises(ValueError):
+            decoder.backend()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import fnmatch
+import os
+import tempfile
+import unittest
+
+from dejavu.logic.decoder import find_files
+
+
+def reference_files(path, extensions):
+    """
+    The files dejavu originally found, walking the directory tree with os.walk.
+    """
+    extensions = [e.replace(".", "") for e in extensions]
+
+    results = []
+    for dirpath, dirnames, files in os.walk(path):
+        for extension in extensions:
+            for f in fnmatch.filter(files, f"*.{extension}"):
+                p = os.path.join(dirpath, f)
+                results.append((p, extension))
+    return results
+
+
+class FindFilesTest(unittest.TestCase):
+    """
+    The files found by listing directories with os.scandir in several threads are those os.walk finds, in
+    whatever order, for nested directories, symbolic links and extensions given with or without their dot.
+    """
+    FILES = [
+        "a.mp3", "b.wav", "c.MP3", "d.mp3.txt", "e.flac", ".mp3", "no_extension", "mp3",
+        "one/f.mp3", "one/g.ogg", "one/two/h.wav", "one/two/three/i.mp3", "one/two/three/j.mp3",
+        "empty/.hidden.wav", "spaces in name/k l.mp3",
+    ] + [f"wide/{i}/song{i}.mp3" for i in range(40)]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.directory.name, "library")
+        for name in self.FILES:
+            file_name = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+            open(file_name, "w").close()
+
+        # a directory named as a file, with a file inside.
+        os.makedirs(os.path.join(self.root, "album.mp3"))
+        open(os.path.join(self.root, "album.mp3", "m.mp3"), "w").close()
+
+        # links to files are found, links to directories are not followed, and broken links are files.
+        outside = os.path.join(self.directory.name, "outside")
+        os.makedirs(outside)
+        open(os.path.join(outside, "n.mp3"), "w").close()
+        os.symlink(os.path.join(outside, "n.mp3"), os.path.join(self.root, "link.mp3"))
+        os.symlink(os.path.join(self.root, "a.mp3"), os.path.join(self.root, "one", "link_a.wav"))
+        os.symlink(outside, os.path.join(self.root, "one", "linked_dir"))
+        os.symlink(outside, os.path.join(self.root, "linked_dir.mp3"))
+        os.symlink(self.root, os.path.join(self.root, "one", "two", "loop"))
+        os.symlink(os.path.join(self.directory.name, "missing.mp3"), os.path.join(self.root, "broken.mp3"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assert_same_files(self, path, extensions):
+        expected = sorted(reference_files(path, extensions))
+        for nthreads in (0, 1, 8):
+            with self.subTest(extensions=extensions, nthreads=nthreads):
+                self.assertEqual(sorted(find_files(path, extensions, nthreads=nthreads)), expected)
+
+    def test_extensions(self):
+        for extensions in (["mp3"], [".mp3"], ["mp3", ".wav"], ["wav", "mp3", "flac", "ogg"], ["MP3"], ["txt"],
+                           ["aac"], []):
+            self.assert_same_files(self.root, extensions)
+
+        self.assertIn((os.path.join(self.root, "one", "two", "three", "i.mp3"), "mp3"),
+                      list(find_files(self.root, [".mp3"])))
+
+    def test_symlinks(self):
+        found = [file_name for file_name, _ in find_files(self.root, ["mp3", "wav"])]
+        self.assertIn(os.path.join(self.root, "link.mp3"), found)
+        self.assertIn(os.path.join(self.root, "one", "link_a.wav"), found)
+        self.assertIn(os.path.join(self.root, "broken.mp3"), found)
+        self.assertFalse(any("linked_dir" in file_name or "loop" in file_name for file_name in found))
+
+        # a link given as the path is listed, as os.walk lists it.
+        linked_root = os.path.join(self.directory.name, "linked_library")
+        os.symlink(self.root, linked_root)
+        self.assert_same_files(linked_root, ["mp3", "wav"])
+
+    def test_nested(self):
+        self.assert_same_files(os.path.join(self.root, "one"), ["mp3", "wav", "ogg"])
+        self.assert_same_files(os.path.join(self.root, "wide"), [".mp3"])
+        self.assert_same_files(os.path.join(self.root, "missing"), ["mp3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
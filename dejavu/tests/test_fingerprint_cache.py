@@ -0,0 +1,68 @@
+import json
+import tempfile
+import unittest
+from hashlib import sha1
+from unittest import mock
+
+import dejavu.config.settings as settings
+import dejavu.logic.decoder as decoder
+from dejavu.logic.fingerprint_cache import (CACHE_VERSION,
+                                            FINGERPRINT_SETTINGS,
+                                            FingerprintCache, settings_digest)
+
+
+class SettingsDigestTest(unittest.TestCase):
+    """
+    Whatever changes the samples fingerprinted changes the cache key.
+    """
+    OPTIONS = {"limit": None, "analysis_rate": None, "downmix": False}
+
+    def test_same_settings(self):
+        self.assertEqual(settings_digest(dict(self.OPTIONS)), settings_digest(dict(self.OPTIONS)))
+
+    def test_analysis_rate_and_downmix(self):
+        digest = settings_digest(self.OPTIONS)
+        self.assertNotEqual(settings_digest({**self.OPTIONS, "analysis_rate": 11025}), digest)
+        self.assertNotEqual(settings_digest({**self.OPTIONS, "downmix": True}), digest)
+
+        # these are keyed once, as options, next to the decoder backend alone.
+        with mock.patch.object(decoder, "backend", return_value="pydub"):
+            key = {
+                "version": CACHE_VERSION,
+                "decoder": "pydub",
+                "options": self.OPTIONS,
+                "settings": {name: getattr(settings, name) for name in FINGERPRINT_SETTINGS}
+            }
+            self.assertEqual(settings_digest(self.OPTIONS),
+                             sha1(json.dumps(key, sort_keys=True, default=str).encode("utf8")).hexdigest())
+
+    def test_decoder_backend(self):
+        with mock.patch.object(decoder, "backend", return_value="pydub"):
+            pydub = settings_digest(self.OPTIONS)
+        with mock.patch.object(decoder, "backend", return_value="ffmpeg"):
+            ffmpeg = settings_digest(self.OPTIONS)
+        self.assertNotEqual(pydub, ffmpeg)
+
+        with tempfile.TemporaryDirectory() as path:
+            cache = FingerprintCache(path)
+            with mock.patch.object(decoder, "DECODER_BACKEND", "pydub"):
+                cache.put("AB" * 20, self.OPTIONS, {("0123456789abcdef0123", 7)}, 44100)
+
+            # changing the DECODER_BACKEND misses the cache, unless the ffmpeg one falls back to pydub.
+            with mock.patch.object(decoder, "DECODER_BACKEND", "ffmpeg"):
+                with mock.patch.object(decoder, "ffmpeg_available", return_value=True):
+                    self.assertIsNone(cache.get("AB" * 20, self.OPTIONS))
+                with mock.patch.object(decoder, "ffmpeg_available", return_value=False):
+                    self.assertEqual(cache.get("AB" * 20, self.OPTIONS), ({("0123456789abcdef0123", 7)}, 44100))
+
+    def test_entries(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = FingerprintCache(path)
+            cache.put("AB" * 20, self.OPTIONS, {("0123456789abcdef0123", 7)}, 44100)
+
+            self.assertEqual(cache.get("AB" * 20, self.OPTIONS), ({("0123456789abcdef0123", 7)}, 44100))
+            self.assertIsNone(cache.get("AB" * 20, {**self.OPTIONS, "downmix": True}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+from hashlib import sha1
+from unittest import mock
+
+import numpy as np
+from scipy.io import wavfile
+
+import dejavu
+import dejavu.logic.decoder as decoder
+from dejavu import Dejavu
+from dejavu.config.settings import DEFAULT_FS
+from dejavu.tests.audio import synthetic_audio
+
+
+class FakeDatabase:
+    """
+    The songs a Dejavu instance inserts, by file hash.
+    """
+    def __init__(self, **options):
+        self.songs = {}
+
+    def setup(self) -> None:
+        pass
+
+    def get_song_hashes(self):
+        return set(self.songs)
+
+    def insert_songs(self, songs) -> None:
+        for song_name, file_hash, hashes in songs:
+            self.songs[file_hash] = (song_name, set(hashes))
+
+
+class FingerprintFileTest(unittest.TestCase):
+    """
+    Files are fingerprinted (and hashed) as they are decoded, including files with no audio at all.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name: str, samples: np.ndarray) -> str:
+        file_name = os.path.join(self.directory.name, name)
+        wavfile.write(file_name, DEFAULT_FS, samples.T)
+        return file_name
+
+    def test_hashed_while_decoded(self):
+        file_name = self.write("song.wav", synthetic_audio(5, seed=9, channels=2))
+        fingerprints, fs, file_hash = Dejavu._fingerprint_file(file_name, None)
+
+        self.assertGreater(len(fingerprints), 0)
+        self.assertEqual(fs, DEFAULT_FS)
+        self.assertEqual(file_hash, decoder.unique_hash(file_name))
+
+    def test_empty_file(self):
+        file_name = self.write("empty.wav", np.empty((2, 0), dtype=np.int16))
+        self.assertEqual(Dejavu._fingerprint_file(file_name, None),
+                         (set(), DEFAULT_FS, decoder.unique_hash(file_name)))
+
+    def test_window_past_the_end(self):
+        file_name = self.write("song.wav", synthetic_audio(5, seed=9))
+        self.assertEqual(Dejavu._fingerprint_file(file_name, None, frames=(10 ** 6, None)), (set(), DEFAULT_FS, None))
+
+    def test_no_block(self):
+        file_name = self.write("song.wav", synthetic_audio(1, seed=9))
+        with mock.patch.object(decoder, "read_blocks", return_value=iter([])):
+            fingerprints, fs, _ = Dejavu._fingerprint_file(file_name, None, print_output=True)
+        self.assertEqual((fingerprints, fs), (set(), None))
+
+    def test_read_hash(self):
+        file_name = self.write("song.wav", synthetic_audio(2, seed=9))
+        file_hash = decoder.unique_hash(file_name)
+
+        self.assertEqual(decoder.read(file_name, limit=1)[2], file_hash)
+        self.assertEqual(decoder.read(file_name, limit=1, sha1_hash=sha1())[2], file_hash)
+        self.assertIsNone(decoder.read(file_name, limit=1, hash_file=False)[2])
+
+    def test_already_fingerprinted(self):
+        # files are hashed and looked up before being decoded, so they are not decoded again.
+        file_name = self.write("song.wav", synthetic_audio(5, seed=9))
+        copy_name = self.write("copy.wav", synthetic_audio(5, seed=9))
+        with mock.patch.object(dejavu, "get_database", return_value=FakeDatabase):
+            djv = Dejavu({})
+        djv.fingerprint_file(file_name)
+        self.assertEqual(list(djv.db.songs), [decoder.unique_hash(file_name)])
+
+        with mock.patch.object(decoder, "read_blocks") as read_blocks:
+            djv.fingerprint_file(file_name)
+            djv.fingerprint_file(copy_name)
+        read_blocks.assert_not_called()
+        self.assertEqual(len(djv.db.songs), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import hashlib
+import random
+import unittest
+from operator import itemgetter
+
+import numpy as np
+
+from dejavu.config.settings import (FINGERPRINT_REDUCTION, MAX_HASH_TIME_DELTA,
+                                    MIN_HASH_TIME_DELTA)
+from dejavu.logic.fingerprint import generate_hash_arrays, generate_hashes
+
+
+def reference_hashes(peaks, fan_value):
+    """
+    The sha1 hashes as dejavu originally generated them, with a nested loop over the sorted peaks.
+    """
+    peaks = sorted(peaks, key=itemgetter(1))
+
+    hashes = []
+    for i in range(len(peaks)):
+        for j in range(1, fan_value):
+            if (i + j) < len(peaks):
+                freq1, t1 = peaks[i]
+                freq2, t2 = peaks[i + j]
+                t_delta = t2 - t1
+
+                if MIN_HASH_TIME_DELTA <= t_delta <= MAX_HASH_TIME_DELTA:
+                    h = hashlib.sha1(f"{str(freq1)}|{str(freq2)}|{str(t_delta)}".encode('utf-8'))
+                    hashes.append((h.hexdigest()[0:FINGERPRINT_REDUCTION], t1))
+
+    return hashes
+
+
+class GenerateHashesTest(unittest.TestCase):
+    """
+    The batched sha1 hashes are bit-exact with the ones of the original nested loop, in the same order.
+    """
+    def random_peaks(self, rng: random.Random):
+        npeaks = rng.choice([0, 1, 2, 10, 300, 2000])
+        nfreqs = rng.choice([1, 3, 2049])
+        span = rng.choice([1, 5, 300, 5000])
+        return [(rng.randrange(nfreqs), rng.randrange(span)) for _ in range(npeaks)]
+
+    def test_random(self):
+        rng = random.Random(4)
+        for trial in range(200):
+            peaks = self.random_peaks(rng)
+            fan_value = rng.choice([1, 2, 5, 15])
+            with self.subTest(trial=trial):
+                self.assertEqual(generate_hashes(list(peaks), fan_value=fan_value, hash_format="sha1"),
+                                 reference_hashes(peaks, fan_value))
+
+    def test_duplicate_pairs(self):
+        # the same (freq1, freq2, t_delta) triple, hashed once, at many offsets and among identical peaks.
+        peaks = [(100, t) for t in range(0, 1000, 7)] + [(100, 3)] * 5 + [(2048, 3), (0, 3), (100, 10)] * 3
+        for fan_value in (2, 5, 15):
+            with self.subTest(fan_value=fan_value):
+                hashes = generate_hashes(list(peaks), fan_value=fan_value)
+                self.assertLess(len(set(hashes)), len(hashes))
+                self.assertEqual(hashes, reference_hashes(peaks, fan_value))
+
+    def test_time_delta_edges(self):
+        # pairs right at the bounds of the time deltas are hashed, and those just past them are not.
+        peaks = [(10, 0), (20, MIN_HASH_TIME_DELTA), (30, MAX_HASH_TIME_DELTA), (40, MAX_HASH_TIME_DELTA + 1),
+                 (50, 2 * MAX_HASH_TIME_DELTA + 1), (60, 2 * MAX_HASH_TIME_DELTA + 2)]
+        hashes = generate_hashes(list(peaks), fan_value=len(peaks))
+        self.assertEqual(hashes, reference_hashes(peaks, len(peaks)))
+
+        # the first peak with the ones at 0 and 200, the second with the one at 200, then 200 -> 201,
+        # 201 -> 401 and 401 -> 402, but no pair 201 frames apart.
+        self.assertEqual([offset for _, offset in hashes], [0, 0, 0, 200, 201, 401])
+
+    def test_unsorted_peaks(self):
+        # peaks at the same time keep the order they were given in, as list.sort does.
+        peaks = [(5, 9), (7, 2), (1, 9), (3, 2), (8, 0)]
+        self.assertEqual(generate_hashes(list(peaks), fan_value=4), reference_hashes(peaks, 4))
+
+    def test_arrays(self):
+        peaks = self.random_peaks(random.Random(5)) or [(1, 1)]
+        hashes, offsets = generate_hash_arrays(np.array(peaks), fan_value=5)
+        self.assertEqual(list(zip(hashes.tolist(), offsets.tolist())), reference_hashes(peaks, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
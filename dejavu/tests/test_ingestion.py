@@ -0,0 +1,214 @@
+import io
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+
+from dejavu.logic.ingestion import IngestionPipeline
+
+TIMEOUT = 10
+
+
+class Fingerprints(set):
+    """
+    Fingerprints which have to be released once used, as SharedFingerprints.
+    """
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.released = 0
+
+    def release(self):
+        self.released += 1
+
+
+class FakeDatabase(object):
+    """
+    Database recording the batches of songs inserted, which may wait for a gate to be opened, or for a number
+    of writers to insert at once, and which fails the batches of the songs given.
+    """
+    def __init__(self, gate: threading.Event = None, barrier: threading.Barrier = None, failing=()):
+        self.gate = gate
+        self.barrier = barrier
+        self.failing = set(failing)
+        self.batches = []
+        self.inserting = threading.Event()
+        self.lock = threading.Lock()
+
+    def insert_songs(self, batch, batch_size):
+        self.inserting.set()
+        if self.barrier is not None:
+            self.barrier.wait(timeout=TIMEOUT)
+        if self.gate is not None:
+            self.gate.wait(timeout=TIMEOUT)
+
+        with self.lock:
+            self.batches.append(([song_name for song_name, _, _ in batch], batch_size))
+        if self.failing.intersection(song_name for song_name, _, _ in batch):
+            raise RuntimeError("insert failed")
+
+
+def songs(n):
+    return [(f"song{i}", f"HASH{i}", Fingerprints({(f"{i:020x}", offset) for offset in range(i + 1)}))
+            for i in range(n)]
+
+
+def wait_for(condition) -> bool:
+    deadline = time.time() + TIMEOUT
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class IngestionPipelineTest(unittest.TestCase):
+    """
+    Songs put into the pipeline are inserted in batches by its writer threads, which the fingerprinting
+    waits for when they fall behind, whose errors are raised by put and close, and whose fingerprints are
+    released once, whether they were written, failed or dropped.
+    """
+    def assert_released(self, batch):
+        self.assertEqual([hashes.released for _, _, hashes in batch], [1] * len(batch))
+
+    def test_write(self):
+        db = FakeDatabase()
+        written = []
+        batch = songs(10)
+        with IngestionPipeline(db, writers=2, song_batch_size=3, hash_batch_size=7,
+                               on_written=written.extend) as pipeline:
+            for song in batch:
+                pipeline.put(*song)
+
+        self.assertEqual(sorted(len(song_names) for song_names, _ in db.batches), [1, 3, 3, 3])
+        self.assertEqual(sorted(name for song_names, _ in db.batches for name in song_names),
+                         sorted(song_name for song_name, _, _ in batch))
+        self.assertEqual({batch_size for _, batch_size in db.batches}, {7})
+        self.assertEqual(sorted(written), sorted(file_hash for _, file_hash, _ in batch))
+        self.assert_released(batch)
+
+        stats = pipeline.stats
+        self.assertEqual((stats.files_fingerprinted, stats.songs_written, stats.batches_written), (10, 10, 4))
+        self.assertEqual(stats.hashes_written, sum(len(hashes) for _, _, hashes in batch))
+        self.assertEqual(stats.hashes_fingerprinted, stats.hashes_written)
+
+    def test_writer_threads(self):
+        # the batches are only inserted once every writer is inserting one at the same time.
+        for writers in (1, 3):
+            with self.subTest(writers=writers):
+                db = FakeDatabase(barrier=threading.Barrier(writers))
+                with IngestionPipeline(db, writers=writers, song_batch_size=1) as pipeline:
+                    for song in songs(2 * writers):
+                        pipeline.put(*song)
+                self.assertEqual(len(db.batches), 2 * writers)
+
+    def test_backpressure(self):
+        gate = threading.Event()
+        db = FakeDatabase(gate=gate)
+        pipeline = IngestionPipeline(db, writers=1, queue_size=1, song_batch_size=1)
+        batch = songs(4)
+
+        # the writer takes the first batch, the queue takes the second, and the third one waits.
+        put = []
+        putter = threading.Thread(target=lambda: [put.append(pipeline.put(*song)) for song in batch])
+        putter.start()
+        self.assertTrue(wait_for(lambda: len(put) == 2 and db.inserting.is_set()))
+        time.sleep(0.2)
+        self.assertEqual(len(put), 2)
+
+        gate.set()
+        putter.join(TIMEOUT)
+        pipeline.close()
+        self.assertEqual(len(put), 4)
+        self.assertEqual(len(db.batches), 4)
+        self.assertGreater(pipeline.stats.backpressure_time, 0.1)
+        self.assert_released(batch)
+
+    def test_error_from_put(self):
+        db = FakeDatabase(failing=["song0"])
+        batch = songs(3)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            pipeline = IngestionPipeline(db, writers=1, song_batch_size=1)
+            pipeline.put(*batch[0])
+            self.assertTrue(wait_for(lambda: pipeline._errors))
+
+            # the song put after the error is not written but released.
+            with self.assertRaisesRegex(RuntimeError, "insert failed"):
+                pipeline.put(*batch[1])
+            pipeline.abort()
+
+        self.assertEqual(output.getvalue(), "")
+        self.assertEqual(db.batches, [(["song0"], pipeline.hash_batch_size)])
+        self.assert_released(batch[:2])
+        self.assertEqual(pipeline.stats.songs_written, 0)
+
+    def test_error_from_close(self):
+        gate = threading.Event()
+        db = FakeDatabase(gate=gate, failing=["song2"])
+        batch = songs(9)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            pipeline = IngestionPipeline(db, writers=1, song_batch_size=2)
+            for song in batch:
+                pipeline.put(*song)
+            gate.set()
+            with self.assertRaisesRegex(RuntimeError, "insert failed"):
+                pipeline.close()
+
+        # the batches after the failing one are dropped.
+        self.assertEqual(output.getvalue(), "")
+        self.assertEqual([song_names for song_names, _ in db.batches], [["song0", "song1"], ["song2", "song3"]])
+        self.assert_released(batch)
+        self.assertEqual(pipeline.stats.songs_written, 2)
+
+        # once closed, put raises the error too.
+        with self.assertRaisesRegex(RuntimeError, "insert failed"):
+            pipeline.put(*songs(1)[0])
+
+    def test_abort(self):
+        gate = threading.Event()
+        db = FakeDatabase(gate=gate)
+        batch = songs(7)
+        with self.assertRaises(KeyboardInterrupt):
+            with IngestionPipeline(db, writers=1, song_batch_size=2) as pipeline:
+                for song in batch:
+                    pipeline.put(*song)
+                self.assertTrue(wait_for(db.inserting.is_set))
+                threading.Timer(0.1, gate.set).start()
+                raise KeyboardInterrupt()
+
+        # the batch being inserted is written, the queued ones and the one not full are dropped.
+        self.assertEqual([song_names for song_names, _ in db.batches], [["song0", "song1"]])
+        self.assert_released(batch)
+        self.assertTrue(all(not writer.is_alive() for writer in pipeline._writers))
+
+    def test_throttle(self):
+        pipeline = IngestionPipeline(FakeDatabase(), writers=1)
+        handed_out = []
+        consumer = threading.Thread(target=lambda: handed_out.extend(pipeline.throttle(range(6), 2)))
+        consumer.start()
+
+        def assert_handed_out(n):
+            self.assertTrue(wait_for(lambda: len(handed_out) >= n))
+            time.sleep(0.1)
+            self.assertEqual(handed_out, list(range(n)))
+
+        # a slot is freed by every task put, released or failed.
+        assert_handed_out(2)
+        pipeline.put(*songs(1)[0])
+        assert_handed_out(3)
+        pipeline.release()
+        assert_handed_out(4)
+        pipeline.release(failed=False)
+        assert_handed_out(5)
+        self.assertEqual((pipeline.stats.files_fingerprinted, pipeline.stats.files_failed), (1, 1))
+
+        # the tasks stop being handed out once the pipeline is closed.
+        pipeline.close()
+        consumer.join(TIMEOUT)
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(handed_out, list(range(5)))
+
+
+if __name__ == "__main__":
+    unittest.main()
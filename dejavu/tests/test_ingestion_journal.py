@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from dejavu.logic.file_manifest import FileManifest
+from dejavu.logic.ingestion_journal import (COMMITTED, FINGERPRINTED, QUEUED,
+                                            IngestionJournal)
+
+
+class IngestionJournalTest(unittest.TestCase):
+    """
+    Files go through the states of a job by their content, and only unchanged committed files are done.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "job.db")
+        self.files = []
+        for index, content in enumerate([b"a", b"b", b"a"]):
+            file_path = os.path.join(self.directory.name, f"{index}.wav")
+            with open(file_path, "wb") as f:
+                f.write(content)
+            self.files.append(file_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_states(self):
+        with IngestionJournal(self.path) as journal:
+            for file_path, file_hash in zip(self.files, ["A", "B", "A"]):
+                journal.queue(file_path, file_hash)
+            self.assertEqual(journal.counts(), {QUEUED: 3, FINGERPRINTED: 0, COMMITTED: 0})
+
+            journal.mark(["A"], FINGERPRINTED)
+            self.assertEqual(journal.counts(), {QUEUED: 1, FINGERPRINTED: 2, COMMITTED: 0})
+
+            journal.mark(["A"], COMMITTED)
+            self.assertEqual([journal.is_committed(file_path) for file_path in self.files], [True, False, True])
+
+            with self.assertRaises(ValueError):
+                journal.mark(["B"], "done")
+
+    def test_resume(self):
+        with IngestionJournal(self.path) as journal:
+            for file_path, file_hash in zip(self.files, ["A", "B", "A"]):
+                journal.queue(file_path, file_hash)
+            journal.mark(["A", "B"], COMMITTED)
+
+        # a file which changed since is done again.
+        with open(self.files[2], "ab") as f:
+            f.write(b"c")
+
+        with IngestionJournal(self.path) as journal:
+            self.assertEqual(journal.counts(), {QUEUED: 0, FINGERPRINTED: 0, COMMITTED: 3})
+            self.assertEqual([journal.is_committed(file_path) for file_path in self.files], [True, True, False])
+
+    def test_manifest(self):
+        with IngestionJournal(self.path) as journal:
+            journal.queue(self.files[0], "A")
+
+        with FileManifest(self.path) as manifest:
+            self.assertEqual(manifest.get(self.files[0]), "A")
+            self.assertIsNone(manifest.get(self.files[1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
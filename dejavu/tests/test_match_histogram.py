@@ -0,0 +1,150 @@
+import random
+import unittest
+from collections import Counter
+from contextlib import contextmanager
+from unittest import mock
+
+import dejavu.logic.alignment as alignment
+from dejavu.base_classes.common_database import CommonDatabase
+from dejavu.logic.alignment import MatchHistogram
+
+
+def reference_matches(sampled_offsets, rows, max_postings=None):
+    """
+    Matches of a query the way return_matches originally listed them, a (song id, offset difference) tuple for
+    each row and each offset its hash was sampled at, counted by pair, along with the rows of each song.
+    """
+    postings = Counter(hsh for hsh, _, _ in rows)
+    matches, dedup_hashes = Counter(), Counter()
+    for hsh, song_id, offset in rows:
+        if max_postings and postings[hsh] > max_postings:
+            continue
+        dedup_hashes[song_id] += 1
+        for sampled_offset in sampled_offsets[hsh]:
+            matches[song_id, offset - sampled_offset] += 1
+    return dict(matches), dict(dedup_hashes)
+
+
+class MatchHistogramTest(unittest.TestCase):
+    """
+    Rows folded into a MatchHistogram, as the database returns them, are counted as the original tuples were.
+    """
+    def random_query(self, rng: random.Random, hashes):
+        # hashes sampled a few times each, and their rows in the database.
+        sampled_offsets = {hsh: [rng.randrange(3000) for _ in range(rng.choice([1, 1, 2, 5]))]
+                           for hsh in rng.sample(hashes, rng.randrange(1, len(hashes)))}
+        nsongs = rng.choice([1, 3, 40])
+        rows = [(hsh, rng.randrange(nsongs), rng.randrange(5000))
+                for hsh in hashes for _ in range(rng.choice([0, 1, 4, 30]))]
+        return sampled_offsets, rows
+
+    def histogram(self, rng: random.Random, sampled_offsets, rows, max_postings=None):
+        histogram = MatchHistogram(sampled_offsets, max_postings=max_postings)
+
+        # hashes are looked up in batches, whose rows come back in any order and are fetched in chunks.
+        values = list(sampled_offsets)
+        start = 0
+        while start < len(values):
+            stop = start + rng.choice([1, 7, 1000])
+            batch = set(values[start:stop])
+            batch_rows = [row for row in rows if row[0] in batch]
+            rng.shuffle(batch_rows)
+            while batch_rows:
+                size = rng.choice([1, 10, 500])
+                histogram.fold(batch_rows[:size])
+                batch_rows = batch_rows[size:]
+            histogram.flush()
+            start = stop
+
+        song_ids, offsets, counts = histogram.matches()
+        self.assertEqual(len(set(zip(song_ids.tolist(), offsets.tolist()))), len(counts))
+        return dict(zip(zip(song_ids.tolist(), offsets.tolist()), counts.tolist())), histogram.dedup_hashes
+
+    def assert_same_as_reference(self, seed: int, hashes, max_postings=None) -> None:
+        rng = random.Random(seed)
+        for trial in range(100):
+            sampled_offsets, rows = self.random_query(rng, hashes)
+            rows = [row for row in rows if row[0] in sampled_offsets]
+            merge_size = rng.choice([1, 100, 1 << 20])
+            with self.subTest(trial=trial), mock.patch.object(alignment, "MATCH_MERGE_SIZE", merge_size):
+                self.assertEqual(self.histogram(rng, sampled_offsets, rows, max_postings=max_postings),
+                                 reference_matches(sampled_offsets, rows, max_postings=max_postings))
+
+    def test_hex_hashes(self):
+        self.assert_same_as_reference(1, [f"{index:020X}" for index in range(200)])
+
+    def test_packed_hashes(self):
+        self.assert_same_as_reference(2, [index * 7919 - 10 ** 6 for index in range(200)])
+
+    def test_max_postings(self):
+        for max_postings in (1, 4, 10):
+            with self.subTest(max_postings=max_postings):
+                self.assert_same_as_reference(3, [f"{index:020X}" for index in range(100)], max_postings=max_postings)
+
+    def test_no_rows(self):
+        histogram = MatchHistogram({"AB": [1, 2]}, max_postings=3)
+        histogram.fold([])
+        song_ids, offsets, counts = histogram.matches()
+        self.assertEqual((len(song_ids), len(offsets), len(counts), histogram.dedup_hashes), (0, 0, 0, {}))
+
+
+class FakeCursor(object):
+    """
+    Cursor over the rows of a fingerprints table, which returns those of the hashes in an IN list.
+    """
+    def __init__(self, rows, rng: random.Random):
+        self.rows = rows
+        self.rng = rng
+        self.result = []
+
+    def execute(self, query, values):
+        self.result = [row for row in self.rows if row[0] in set(values)]
+        self.rng.shuffle(self.result)
+
+    def fetchmany(self, size):
+        rows, self.result = self.result[:size], self.result[size:]
+        return rows
+
+
+class FakeDatabase(CommonDatabase):
+    SELECT_MULTIPLE = "SELECT hash, song_id, offset FROM fingerprints WHERE hash IN (%s);"
+    IN_MATCH = "%s"
+
+    def __init__(self, rows, **options):
+        super().__init__(**options)
+        self.rows = rows
+        self.rng = random.Random(0)
+
+    @contextmanager
+    def cursor(self):
+        yield FakeCursor(self.rows, self.rng)
+
+    def _insert_song(self, cur, song_name, file_hash, total_hashes):
+        raise NotImplementedError
+
+
+class ReturnMatchesTest(unittest.TestCase):
+    """
+    return_matches counts the rows of the hashes of a query, looked up in batches, as the original tuples were.
+    """
+    def test_return_matches(self):
+        rng = random.Random(4)
+        hashes = [f"{index:020X}" for index in range(300)]
+        rows = [(hsh, rng.randrange(20), rng.randrange(5000)) for hsh in hashes for _ in range(rng.randrange(12))]
+        query = [(rng.choice(hashes).lower(), rng.randrange(3000)) for _ in range(500)]
+
+        sampled_offsets = {}
+        for hsh, offset in query:
+            sampled_offsets.setdefault(hsh.upper(), []).append(offset)
+        matched = [row for row in rows if row[0] in sampled_offsets]
+
+        for batch_size, max_postings in ((1000, None), (7, None), (13, 5)):
+            with self.subTest(batch_size=batch_size, max_postings=max_postings):
+                (song_ids, offsets, counts), dedup_hashes = FakeDatabase(rows).return_matches(
+                    query, batch_size=batch_size, max_postings=max_postings)
+                self.assertEqual((dict(zip(zip(song_ids.tolist(), offsets.tolist()), counts.tolist())), dedup_hashes),
+                                 reference_matches(sampled_offsets, matched, max_postings=max_postings))
+
+
+if __name__ == "__main__":
+    unittest.main()
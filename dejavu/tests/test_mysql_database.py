@@ -0,0 +1,128 @@
+import random
+import unittest
+from contextlib import contextmanager
+
+from mysql.connector.errors import ProgrammingError
+
+from dejavu.database_handler.mysql_database import MySQLDatabase
+
+
+class FakeMySQLCursor(object):
+    """
+    Cursor of a MySQL server with a fingerprints table, which answers the statements MySQLDatabase runs to
+    match hashes. Creating temporary tables can be denied, as it is to users without the privilege.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.result = []
+        self.range = None
+
+    def execute(self, query, params=()):
+        self.server.statements.append(query)
+        if query == MySQLDatabase.SELECT_VERSION:
+            self.result = [(self.server.version,)]
+        elif query.strip().startswith("CREATE TEMPORARY") and self.server.denied:
+            raise ProgrammingError(msg="CREATE TEMPORARY TABLES command denied", errno=1142)
+        elif query == MySQLDatabase.SET_LOOKUP_RANGE:
+            self.range = params
+        elif query == MySQLDatabase.EXECUTE_LOOKUP:
+            hashes = {self.server.lookup[position] for position in range(*self.range)}
+            self.result = [row for row in self.server.rows if row[0] in hashes]
+        elif "ROW_NUMBER()" in query:
+            self.result = [(1, 5, 3)]
+        elif " IN (" in query:
+            self.result = [row for row in self.server.rows if row[0] in set(params)]
+        else:
+            self.result = []
+
+    def executemany(self, query, seq_params):
+        self.server.statements.append(query)
+        self.server.lookup = dict(seq_params)
+
+    def fetchone(self):
+        return self.result.pop(0) if self.result else None
+
+    def fetchmany(self, size):
+        rows, self.result = self.result[:size], self.result[size:]
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(len(self.result))
+
+
+class FakeMySQLServer(object):
+    def __init__(self, rows, version: str = "8.0.36", denied: bool = False):
+        self.rows = rows
+        self.version = version
+        self.denied = denied
+        self.statements = []
+        self.lookup = {}
+
+    @contextmanager
+    def cursor(self):
+        yield FakeMySQLCursor(self)
+
+
+class MySQLMatchingTest(unittest.TestCase):
+    """
+    Server side matching is only used by servers with window functions, and hashes are looked up by IN lists
+    if the lookup table can't be created, with the same matches either way.
+    """
+    def setUp(self):
+        rng = random.Random(5)
+        hashes = [f"{index:020X}" for index in range(100)]
+        self.rows = [(hsh, rng.randrange(10), rng.randrange(1000)) for hsh in hashes for _ in range(rng.randrange(6))]
+        self.query = [(rng.choice(hashes).lower(), rng.randrange(500)) for _ in range(80)]
+
+    def database(self, server: FakeMySQLServer) -> MySQLDatabase:
+        db = MySQLDatabase()
+        db.cursor = server.cursor
+        return db
+
+    def matches(self, server: FakeMySQLServer, **options):
+        (song_ids, offsets, counts), dedup_hashes = self.database(server).return_matches(self.query, **options)
+        return sorted(zip(song_ids.tolist(), offsets.tolist(), counts.tolist())), dedup_hashes
+
+    def test_window_functions(self):
+        for version, expected in (("8.0.36", True), ("8.4.0", True), ("5.7.44-log", False), ("5.6.51", False),
+                                  ("10.6.16-MariaDB-1:10.6.16+maria~ubu2004", True), ("10.1.48-MariaDB", False)):
+            with self.subTest(version=version):
+                self.assertEqual(MySQLDatabase._has_window_functions(version), expected)
+
+    def test_server_side_matching(self):
+        server = FakeMySQLServer(self.rows, version="8.0.36")
+        (song_ids, offsets, counts), _ = self.database(server).return_aligned_matches(self.query, topn=2)
+        self.assertEqual((song_ids.tolist(), offsets.tolist(), counts.tolist()), ([1], [5], [3]))
+
+    def test_client_side_matching(self):
+        # MySQL 5.7 has no window functions, every match is returned as return_matches does.
+        server = FakeMySQLServer(self.rows, version="5.7.44")
+        db = self.database(server)
+        for _ in range(2):
+            (song_ids, offsets, counts), dedup_hashes = db.return_aligned_matches(self.query, topn=2)
+            self.assertEqual((sorted(zip(song_ids.tolist(), offsets.tolist(), counts.tolist())), dedup_hashes),
+                             self.matches(FakeMySQLServer(self.rows)))
+
+        self.assertFalse(any("ROW_NUMBER()" in statement for statement in server.statements))
+        # the version is only asked once.
+        self.assertEqual(server.statements.count(MySQLDatabase.SELECT_VERSION), 1)
+
+    def test_lookup_table_denied(self):
+        expected = self.matches(FakeMySQLServer(self.rows), batch_size=7)
+        self.assertGreater(len(expected[0]), 0)
+
+        server = FakeMySQLServer(self.rows, denied=True)
+        db = self.database(server)
+        for _ in range(2):
+            (song_ids, offsets, counts), dedup_hashes = db.return_matches(self.query, batch_size=7)
+            self.assertEqual((sorted(zip(song_ids.tolist(), offsets.tolist(), counts.tolist())), dedup_hashes),
+                             expected)
+
+        # creating the lookup table is only tried once, and nothing is left to clean up.
+        self.assertEqual(sum(statement.strip().startswith("CREATE TEMPORARY") for statement in server.statements), 1)
+        self.assertNotIn(MySQLDatabase.DEALLOCATE_LOOKUP, server.statements)
+        self.assertIsNone(db.LOOKUP_BATCH_LIMIT)
+
+
+if __name__ == "__main__":
+    unittest.main()
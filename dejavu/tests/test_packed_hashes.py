@@ -0,0 +1,218 @@
+import random
+import unittest
+from contextlib import contextmanager
+from operator import itemgetter
+from unittest import mock
+
+import numpy as np
+
+import dejavu.logic.fingerprint as fingerprint
+from dejavu.config.settings import (MAX_HASH_TIME_DELTA, MIN_HASH_TIME_DELTA,
+                                    PACKED_HASH_LAYOUTS)
+from dejavu.database_handler.mysql_database import MySQLDatabase
+from dejavu.database_handler.postgres_database import PostgreSQLDatabase
+from dejavu.logic.fingerprint import _packed_hashes, generate_hash_arrays
+from dejavu.tests.test_match_histogram import reference_matches
+from dejavu.tests.test_mysql_database import FakeMySQLServer
+
+
+def reference_triples(peaks, fan_value):
+    """
+    The (freq1, freq2, t_delta, t1) of every pair of peaks hashed by the original nested loop, in its order.
+    """
+    peaks = sorted(peaks, key=itemgetter(1))
+    return [(peaks[i][0], peaks[i + j][0], peaks[i + j][1] - peaks[i][1], peaks[i][1])
+            for i in range(len(peaks)) for j in range(1, fan_value)
+            if i + j < len(peaks) and MIN_HASH_TIME_DELTA <= peaks[i + j][1] - peaks[i][1] <= MAX_HASH_TIME_DELTA]
+
+
+def unpack(hashes: np.ndarray, hash_format: str):
+    """
+    Unpacks signed packed hashes into their (freq1, freq2, t_delta) triples.
+    """
+    freq_bits, _, delta_bits = PACKED_HASH_LAYOUTS[hash_format]
+    unsigned = [value & ((1 << (2 * freq_bits + delta_bits)) - 1) for value in hashes.tolist()]
+    return [(value >> (freq_bits + delta_bits), (value >> delta_bits) & ((1 << freq_bits) - 1),
+             (value & ((1 << delta_bits) - 1)) + MIN_HASH_TIME_DELTA) for value in unsigned]
+
+
+class PackedHashesTest(unittest.TestCase):
+    """
+    Peak pairs are packed into integers with the bits of PACKED_HASH_LAYOUTS, which give them back as they were.
+    """
+    def test_layout(self):
+        one = np.array([1])
+        self.assertEqual(_packed_hashes(one, 2 * one, 3 * one, "int32").tolist(), [(1 << 20) | (2 << 8) | 3])
+        self.assertEqual(_packed_hashes(one, 2 * one, 3 * one, "int64").tolist(), [(1 << 40) | (2 << 16) | 3])
+        self.assertEqual(_packed_hashes(one, 2 * one, 3 * one, "int32").dtype, np.int32)
+        self.assertEqual(_packed_hashes(one, 2 * one, 3 * one, "int64").dtype, np.int64)
+
+        # the highest frequencies set the sign bit, so the hashes fit the signed integer columns.
+        top = np.array([4095])
+        hashes = _packed_hashes(top, top, np.array([MAX_HASH_TIME_DELTA]), "int32")
+        self.assertLess(hashes[0], 0)
+        self.assertEqual(unpack(hashes, "int32"), [(4095, 4095, MAX_HASH_TIME_DELTA)])
+
+    def test_round_trip(self):
+        rng = random.Random(6)
+        for hash_format in ("int32", "int64"):
+            for trial in range(50):
+                peaks = [(rng.randrange(2049), rng.randrange(rng.choice([5, 300, 3000])))
+                         for _ in range(rng.choice([0, 1, 50, 500]))]
+                fan_value = rng.choice([2, 5, 15])
+                with self.subTest(hash_format=hash_format, trial=trial):
+                    hashes, offsets = generate_hash_arrays(peaks, fan_value=fan_value, hash_format=hash_format)
+                    self.assertEqual([(*triple, offset) for triple, offset in zip(unpack(hashes, hash_format),
+                                                                                  offsets.tolist())],
+                                     reference_triples(peaks, fan_value))
+
+    def test_frequency_overflow(self):
+        peaks = [(4096, 0), (1, 1)]
+        with self.assertRaises(ValueError):
+            generate_hash_arrays(peaks, hash_format="int32")
+        self.assertEqual(unpack(generate_hash_arrays(peaks, hash_format="int64")[0], "int64"), [(4096, 1, 1)])
+
+        with self.assertRaises(ValueError):
+            generate_hash_arrays([(1, 0), (1 << 24, 1)], hash_format="int64")
+
+        # no pair, nothing to overflow.
+        self.assertEqual(len(generate_hash_arrays([(1 << 30, 0)], hash_format="int32")[0]), 0)
+
+    def test_time_delta_overflow(self):
+        peaks = [(1, 0), (2, 255)]
+        with mock.patch.object(fingerprint, "MAX_HASH_TIME_DELTA", 256):
+            with self.assertRaises(ValueError):
+                generate_hash_arrays(peaks, hash_format="int32")
+            self.assertEqual(unpack(generate_hash_arrays(peaks, hash_format="int64")[0], "int64"), [(1, 2, 255)])
+
+        with mock.patch.object(fingerprint, "MAX_HASH_TIME_DELTA", 255):
+            self.assertEqual(unpack(generate_hash_arrays(peaks, hash_format="int32")[0], "int32"), [(1, 2, 255)])
+
+
+class FakePostgresCursor(object):
+    """
+    Cursor of a PostgreSQL server with a fingerprints table, which answers the prepared lookup statement.
+    """
+    class Connection(object):
+        @staticmethod
+        def get_transaction_status():
+            return 0
+
+    connection = Connection()
+
+    def __init__(self, rows, statements):
+        self.rows = rows
+        self.statements = statements
+        self.result = []
+
+    def execute(self, query, params=()):
+        self.statements.append(query)
+        if query == PostgreSQLDatabase.EXECUTE_LOOKUP:
+            self.result = [row for row in self.rows if row[0] in set(params[0])]
+        else:
+            self.result = []
+
+    def fetchmany(self, size):
+        rows, self.result = self.result[:size], self.result[size:]
+        return rows
+
+
+class PackedDatabaseTest(unittest.TestCase):
+    """
+    Databases with a packed hash format keep the hashes in an integer column, and look up the integers of a
+    recording as they are, whatever integer type they are given as.
+    """
+    def setUp(self):
+        rng = random.Random(7)
+        hashes = [rng.randrange(-2 ** 31, 2 ** 31) for _ in range(100)]
+        self.rows = [(hsh, rng.randrange(10), rng.randrange(1000)) for hsh in hashes for _ in range(rng.randrange(6))]
+        # hashes come as Python and numpy integers, the same hash counted once whatever its type.
+        self.query = [(rng.choice([int, np.int64, np.int32])(rng.choice(hashes)), rng.randrange(500))
+                      for _ in range(80)]
+
+        sampled_offsets = {}
+        for hsh, offset in self.query:
+            sampled_offsets.setdefault(int(hsh), []).append(offset)
+        self.expected = reference_matches(sampled_offsets, [row for row in self.rows if row[0] in sampled_offsets])
+        self.assertGreater(len(self.expected[0]), 0)
+
+    def matches(self, db, **options):
+        (song_ids, offsets, counts), dedup_hashes = db.return_matches(self.query, **options)
+        return dict(zip(zip(song_ids.tolist(), offsets.tolist()), counts.tolist())), dedup_hashes
+
+    def test_queries(self):
+        for db_cls in (MySQLDatabase, PostgreSQLDatabase):
+            for hash_format in ("int32", "int64"):
+                hash_type = db_cls.PACKED_HASH_TYPES[hash_format]
+                with self.subTest(db_cls=db_cls.__name__, hash_format=hash_format):
+                    db = db_cls(hash_format=hash_format)
+                    self.assertIn(f"{hash_type} NOT NULL", db.CREATE_FINGERPRINTS_TABLE)
+                    self.assertIn(f"{hash_type} NOT NULL", db.CREATE_QUERY_TABLE)
+                    self.assertEqual(db.INSERT_FINGERPRINT, db_cls.INSERT_PACKED_FINGERPRINT)
+                    self.assertEqual(db.SELECT, db_cls.SELECT_PACKED)
+                    self.assertEqual(db.SELECT_MULTIPLE, db_cls.SELECT_PACKED_MULTIPLE)
+                    self.assertEqual(db.IN_MATCH, "%s")
+                    self.assertEqual(db.QUERY_HASH_VALUES, db_cls.PACKED_QUERY_HASH_VALUES)
+
+            with self.subTest(db_cls=db_cls.__name__, hash_format="sha1"):
+                # hex formats keep the binary column.
+                db = db_cls(hash_format="sha1")
+                self.assertEqual(db.CREATE_FINGERPRINTS_TABLE, db_cls.CREATE_FINGERPRINTS_TABLE)
+                self.assertEqual(db.SELECT_MULTIPLE, db_cls.SELECT_MULTIPLE)
+                with self.assertRaises(ValueError):
+                    db_cls(hash_format="int16")
+
+        self.assertIn("INTEGER[]", PostgreSQLDatabase(hash_format="int32").PREPARE_LOOKUP)
+        self.assertIn("BIGINT[]", PostgreSQLDatabase(hash_format="int64").PREPARE_LOOKUP)
+        self.assertEqual(MySQLDatabase(hash_format="int64").SELECT_LOOKUP, MySQLDatabase.SELECT_PACKED_LOOKUP)
+        self.assertIn("BIGINT NOT NULL", MySQLDatabase(hash_format="int64").CREATE_LOOKUP_TABLE)
+
+    def mysql(self, server: FakeMySQLServer) -> MySQLDatabase:
+        db = MySQLDatabase(hash_format="int32")
+        db.cursor = server.cursor
+        return db
+
+    def test_in_lists(self):
+        for batch_size in (1000, 7):
+            with self.subTest(batch_size=batch_size):
+                server = FakeMySQLServer(self.rows, denied=True)
+                self.assertEqual(self.matches(self.mysql(server), batch_size=batch_size), self.expected)
+                # the integers are compared with the hash column as they are, no UNHEX.
+                in_list = MySQLDatabase.SELECT_PACKED_MULTIPLE.split("%s")[0]
+                self.assertTrue(server.statements[-1].startswith(in_list))
+                self.assertNotIn("UNHEX", server.statements[-1])
+
+    def test_mysql_lookup_table(self):
+        server = FakeMySQLServer(self.rows)
+        self.assertEqual(self.matches(self.mysql(server), batch_size=7), self.expected)
+        # the integers themselves are loaded into the lookup table.
+        self.assertTrue(all(type(hsh) is int for hsh in server.lookup.values()))
+
+    def test_postgres_arrays(self):
+        statements = []
+        db = PostgreSQLDatabase(hash_format="int64")
+        db.cursor = contextmanager(lambda: iter([FakePostgresCursor(self.rows, statements)]))
+        self.assertEqual(self.matches(db, batch_size=7), self.expected)
+        self.assertIn(db.PREPARE_LOOKUP, statements)
+        self.assertEqual(statements[-1], PostgreSQLDatabase.DEALLOCATE_LOOKUP)
+
+    def test_insert(self):
+        inserted = []
+
+        class Cursor(object):
+            def execute(self, query, params=()):
+                pass
+
+            def executemany(self, query, seq_params):
+                inserted.extend(seq_params)
+
+        db = MySQLDatabase(hash_format="int32")
+        db.cursor = contextmanager(lambda: iter([Cursor()]))
+        db._insert_song = lambda cur, song_name, file_hash, total_hashes: 3
+        hashes, offsets = generate_hash_arrays([(1, 0), (2, 3), (4095, 5)], hash_format="int32")
+        db.insert_songs([("song", "A" * 40, list(zip(hashes.tolist(), offsets.tolist())))])
+        self.assertEqual(inserted, [(3, hsh, offset) for hsh, offset in zip(hashes.tolist(), offsets.tolist())])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+from collections import defaultdict
+
+import numpy as np
+
+from dejavu.config.settings import PEAK_DENSITY_BANDS, PEAK_DENSITY_WINDOW
+from dejavu.logic.fingerprint import get_2D_peaks, select_peaks, spectrogram
+from dejavu.tests.audio import synthetic_audio
+
+
+def reference_select(arr2D, peaks, peak_cap=None, adaptive_threshold=None, first_frame=0):
+    """
+    Peak selection peak by peak: a peak is kept if it is more than adaptive_threshold dB above the mean of its
+    frame, and among the peak_cap strongest of those left in its window and band (the earliest, then the lowest,
+    among equal ones).
+    """
+    kept = [(freq, time) for freq, time in peaks.tolist()
+            if adaptive_threshold is None or arr2D[freq, time] > arr2D[:, time].mean() + adaptive_threshold]
+
+    if peak_cap is not None:
+        groups = defaultdict(list)
+        for freq, time in kept:
+            groups[(time + first_frame) // PEAK_DENSITY_WINDOW, freq * PEAK_DENSITY_BANDS // arr2D.shape[0]].append(
+                (-arr2D[freq, time], time, freq))
+        strongest = {(freq, time) for group in groups.values() for _, time, freq in sorted(group)[:peak_cap]}
+        kept = [peak for peak in kept if peak in strongest]
+
+    return kept
+
+
+class PeakBackendTest(unittest.TestCase):
+    """
+    The separable peak search finds the very same peaks as the original morphology one.
+    """
+    def assert_same_peaks(self, arr2D: np.ndarray, amp_min: int = 10) -> None:
+        morphology = get_2D_peaks(arr2D, amp_min=amp_min, peak_backend="morphology")
+        separable = get_2D_peaks(arr2D, amp_min=amp_min, peak_backend="separable")
+
+        self.assertGreater(len(morphology), 0)
+        self.assertEqual(sorted(map(tuple, separable)), sorted(map(tuple, morphology)))
+
+    def test_spectrogram(self):
+        self.assert_same_peaks(spectrogram(synthetic_audio(5, seed=1)[0]))
+
+    def test_silence(self):
+        # digital silence gives large flat regions of the spectrogram.
+        samples = synthetic_audio(4, seed=2)[0]
+        samples[44100:88200] = 0
+        self.assert_same_peaks(spectrogram(samples))
+
+    def test_plateaus(self):
+        # equal neighbors (ties) all over the spectrogram.
+        arr2D = np.round(spectrogram(synthetic_audio(3, seed=3)[0]) / 8) * 8
+        self.assert_same_peaks(arr2D)
+
+    def test_amp_min(self):
+        arr2D = spectrogram(synthetic_audio(3, seed=5)[0])
+        for amp_min in (0, 30, 60):
+            with self.subTest(amp_min=amp_min):
+                self.assert_same_peaks(arr2D, amp_min=amp_min)
+
+    def test_random(self):
+        rng = np.random.default_rng(6)
+        for shape in ((65, 40), (513, 7), (3, 100)):
+            with self.subTest(shape=shape):
+                self.assert_same_peaks(rng.integers(0, 40, shape).astype(np.float32))
+
+
+class SelectPeaksTest(unittest.TestCase):
+    """
+    select_peaks keeps the peaks above the mean of their frame by adaptive_threshold dB, and the peak_cap strongest
+    ones of every window of PEAK_DENSITY_WINDOW frames and band of 1 / PEAK_DENSITY_BANDS of the bins.
+    """
+    def assert_same_as_reference(self, arr2D, peaks, **options) -> None:
+        self.assertEqual([tuple(peak) for peak in select_peaks(arr2D, peaks, **options).tolist()],
+                         reference_select(arr2D, peaks, **options))
+
+    def test_peak_cap(self):
+        # a column of peaks per frame, 4 of them in each band, with the same amplitude within a frame.
+        arr2D = np.tile(np.arange(PEAK_DENSITY_WINDOW * 2, dtype=np.float32), (16, 1))
+        peaks = np.array([(freq, time) for time in range(arr2D.shape[1]) for freq in range(16)])
+
+        selected = select_peaks(arr2D, peaks, peak_cap=2)
+        # the 2 strongest of each window and band are the lowest bins of its last frame.
+        expected = [(freq, time) for time in (PEAK_DENSITY_WINDOW - 1, 2 * PEAK_DENSITY_WINDOW - 1)
+                    for freq in range(16) if freq % 4 < 2]
+        self.assertEqual(sorted(map(tuple, selected.tolist())), sorted(expected))
+
+        # windows are counted from the start of the audio, not from the first column.
+        shifted = select_peaks(arr2D, peaks, peak_cap=2, first_frame=PEAK_DENSITY_WINDOW // 2)
+        self.assertEqual(len(shifted), 3 * 2 * PEAK_DENSITY_BANDS)
+        self.assert_same_as_reference(arr2D, peaks, peak_cap=2, first_frame=PEAK_DENSITY_WINDOW // 2)
+
+        self.assertEqual(len(select_peaks(arr2D, peaks, peak_cap=10 ** 6)), len(peaks))
+
+    def test_adaptive_threshold(self):
+        # the frame means are 10, so peaks must be above 10 + 6 dB, and one right at 16 dB is not.
+        arr2D = np.full((10, 3), 10, dtype=np.float32)
+        arr2D[0, :] = [16, 17, 40]
+        arr2D[1, :] = [4, 3, -20]
+        peaks = np.array([(0, 0), (0, 1), (0, 2)])
+        means = arr2D.mean(axis=0)
+        expected = [(0, time) for time in range(3) if arr2D[0, time] > means[time] + 6]
+
+        self.assertEqual([tuple(peak) for peak in select_peaks(arr2D, peaks, adaptive_threshold=6).tolist()],
+                         expected)
+        self.assertEqual(expected, [(0, 1), (0, 2)])
+        self.assertEqual(len(select_peaks(arr2D, peaks, adaptive_threshold=-100)), 3)
+
+    def test_spectrogram(self):
+        arr2D = spectrogram(synthetic_audio(6, seed=7)[0])
+        peaks = np.asarray(get_2D_peaks(arr2D, amp_min=10), dtype=np.int64).reshape(-1, 2)
+        for peak_cap, adaptive_threshold, first_frame in ((1, None, 0), (3, None, 5), (None, 10.0, 0), (2, 5.0, 13)):
+            with self.subTest(peak_cap=peak_cap, adaptive_threshold=adaptive_threshold, first_frame=first_frame):
+                self.assert_same_as_reference(arr2D, peaks, peak_cap=peak_cap, adaptive_threshold=adaptive_threshold,
+                                              first_frame=first_frame)
+
+    def test_random(self):
+        # small integer amplitudes, so there are many ties.
+        rng = np.random.default_rng(8)
+        for trial in range(30):
+            arr2D = rng.integers(0, 8, (rng.integers(4, 60), rng.integers(1, 80))).astype(np.float32)
+            npeaks = rng.integers(0, arr2D.size)
+            cells = rng.choice(arr2D.size, npeaks, replace=False)
+            peaks = np.stack(np.unravel_index(cells, arr2D.shape), axis=1).astype(np.int64)
+            with self.subTest(trial=trial):
+                self.assert_same_as_reference(arr2D, peaks, peak_cap=int(rng.integers(1, 4)),
+                                              adaptive_threshold=float(rng.choice([-1, 0, 1.5])),
+                                              first_frame=int(rng.integers(0, 50)))
+
+    def test_disabled(self):
+        arr2D = spectrogram(synthetic_audio(2, seed=9)[0])
+        peaks = np.asarray(get_2D_peaks(arr2D), dtype=np.int64).reshape(-1, 2)
+        self.assertIs(select_peaks(arr2D, peaks, peak_cap=None, adaptive_threshold=None), peaks)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from scipy.io import wavfile
+
+import dejavu.logic.decoder as decoder
+from dejavu.config.settings import DEFAULT_FS
+from dejavu.tests.audio import synthetic_audio
+
+
+def concatenate(blocks) -> np.ndarray:
+    """
+    Samples of the blocks read_blocks yields, as an array of channels by samples.
+    """
+    blocks = list(blocks)
+    fs = {fs for _, fs in blocks}
+    assert len(blocks) > 0 and len(fs) == 1
+    return np.concatenate([np.stack(channels) for channels, _ in blocks], axis=1)
+
+
+class ReadWindowTest(unittest.TestCase):
+    """
+    A window of the samples read_blocks reads gives those very samples, whether the file is seekable or it is
+    decoded from the start, including windows past the end, empty or not aligned with anything.
+    """
+    NSAMPLES = 5 * DEFAULT_FS + 123
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.file_name = os.path.join(cls.directory.name, "song.wav")
+        wavfile.write(cls.file_name, DEFAULT_FS, synthetic_audio(cls.NSAMPLES / DEFAULT_FS, seed=13, channels=2).T)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    WINDOWS = [
+        (0, None), (0, 1), (1, 0), (0, 0), (DEFAULT_FS, DEFAULT_FS),
+        # not aligned with the blocks nor with the seconds.
+        (12345, 67891), (DEFAULT_FS - 1, 2), (3 * DEFAULT_FS + 7, None),
+        # partly and wholly off the end.
+        (NSAMPLES - 10, 100), (NSAMPLES - 1, None), (NSAMPLES, None), (NSAMPLES, 5), (10 * NSAMPLES, 10 ** 6),
+    ]
+
+    def assert_windows(self, **options) -> None:
+        samples = concatenate(decoder.read_blocks(self.file_name, 1, **options))
+        for first, nsamples in self.WINDOWS:
+            expected = samples[:, first:] if nsamples is None else samples[:, first:first + nsamples]
+            with self.subTest(first=first, nsamples=nsamples, **options):
+                blocks = list(decoder.read_blocks(self.file_name, 1, window=(first, nsamples), **options))
+                # there is always a block, even an empty one.
+                self.assertGreater(len(blocks), 0)
+                self.assertTrue(all(len(channels[0]) > 0 for channels, _ in blocks) or len(blocks) == 1)
+                np.testing.assert_array_equal(concatenate(blocks), expected)
+
+    def test_seekable(self):
+        self.assertTrue(decoder.seekable(self.file_name))
+        self.assert_windows()
+
+    def test_start_and_limit(self):
+        # start and limit in fractions of a sample are rounded as WavReader rounds them.
+        for start, limit in ((0.5, 2), (1.23456, 1.00001), (4.9, None), (4.99, 3), (6, None)):
+            self.assert_windows(start=start, limit=limit)
+
+    def test_downmix(self):
+        self.assert_windows(downmix=True, start=0.3)
+
+    def test_not_seekable(self):
+        # resampled files, and files not read by WavReader, are decoded from the start.
+        self.assertFalse(decoder.seekable(self.file_name, analysis_rate=22050))
+        self.assert_windows(analysis_rate=22050, limit=4)
+
+        with mock.patch.object(decoder, "_open_wav", return_value=None):
+            self.assertFalse(decoder.seekable(self.file_name))
+            self.assert_windows(start=1.5)
+
+    def test_stops_decoding(self):
+        # the blocks past the window are not decoded.
+        read_blocks = decoder.read_blocks
+        decoded = []
+
+        def blocks(*args, **kwargs):
+            for block in read_blocks(*args, **kwargs):
+                decoded.append(block)
+                yield block
+
+        with mock.patch.object(decoder, "seekable", return_value=False), \
+                mock.patch.object(decoder, "read_blocks", side_effect=blocks):
+            list(read_blocks(self.file_name, 1, window=(DEFAULT_FS // 2, DEFAULT_FS)))
+        self.assertEqual(len(decoded), 2)
+
+    def test_hash(self):
+        with self.assertRaises(ValueError):
+            list(decoder.read_blocks(self.file_name, 1, sha1_hash=mock.Mock(), window=(0, 10)))
+
+    def test_not_a_wav_file(self):
+        file_name = os.path.join(self.directory.name, "song.txt")
+        with open(file_name, "w") as f:
+            f.write("not audio")
+        self.assertFalse(decoder.seekable(file_name))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import pickle
+import unittest
+from unittest import mock
+
+import dejavu.logic.shared_fingerprints as shared_fingerprints
+from dejavu.logic.shared_fingerprints import (FingerprintParts,
+                                              SharedFingerprints)
+
+
+class SharedFingerprintsTest(unittest.TestCase):
+    """
+    Fingerprints handed over by a pickled descriptor are the ones packed, with or without shared memory.
+    """
+    FINGERPRINTS = {("0123456789abcdef0123", 7), ("fedcba9876543210fedc", 0), ("00000000000000000000", 7)}
+
+    def assert_round_trip(self, fingerprints) -> None:
+        shared = pickle.loads(pickle.dumps(SharedFingerprints(fingerprints)))
+        try:
+            self.assertEqual(len(shared), len(fingerprints))
+            self.assertEqual(set(shared), set(fingerprints))
+        finally:
+            shared.release()
+
+        with self.assertRaises(ValueError):
+            shared.columns()
+
+    def test_shared_memory(self):
+        if not shared_fingerprints.SHARED_MEMORY_AVAILABLE:
+            self.skipTest("no shared memory")
+        self.assert_round_trip(self.FINGERPRINTS)
+        self.assert_round_trip({(123456789, 3), (-5, 4)})
+        self.assert_round_trip(set())
+
+    def test_pickled(self):
+        # what is used before Python 3.8 or out of POSIX systems.
+        with mock.patch.object(shared_fingerprints, "SHARED_MEMORY_AVAILABLE", False):
+            self.assert_round_trip(self.FINGERPRINTS)
+            self.assert_round_trip(set())
+
+    def test_parts(self):
+        parts = FingerprintParts([SharedFingerprints({fingerprint}) for fingerprint in self.FINGERPRINTS])
+        try:
+            self.assertEqual(len(parts), len(self.FINGERPRINTS))
+            self.assertEqual(set(parts), self.FINGERPRINTS)
+        finally:
+            parts.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+import numpy as np
+
+import dejavu
+from dejavu import Dejavu
+from dejavu.config.settings import (FIELD_FILE_SHA1, FIELD_SONG_ID,
+                                    FIELD_SONGNAME, FIELD_TOTAL_HASHES,
+                                    HASHES_MATCHED, OFFSET, SONG_ID)
+from dejavu.database_handler.mysql_database import MySQLDatabase
+from dejavu.logic.song_cache import SongCache
+
+
+def song(song_id):
+    return {FIELD_SONGNAME: f"song{song_id}", FIELD_FILE_SHA1: f"{song_id:040X}", FIELD_TOTAL_HASHES: 100 * song_id}
+
+
+class SongCacheTest(unittest.TestCase):
+    """
+    The cache keeps the max_size songs most recently used, or none at all with a size of 0.
+    """
+    def test_lru(self):
+        cache = SongCache(3)
+        cache.put_many({song_id: song(song_id) for song_id in (1, 2, 3)})
+        self.assertEqual(len(cache), 3)
+
+        # song 1 is used, so song 2 is the least recently used one, dropped by the next song put.
+        self.assertEqual(cache.get_many([1]), ({1: song(1)}, []))
+        cache.put_many({4: song(4)})
+        self.assertEqual(cache.get_many([1, 2, 3, 4]), ({1: song(1), 3: song(3), 4: song(4)}, [2]))
+
+        # songs put again are the most recently used ones, and beyond max_size at once only the last ones are kept.
+        cache.put_many({3: song(3)})
+        cache.put_many({5: song(5), 6: song(6)})
+        self.assertEqual(cache.get_many([1, 3, 4, 5, 6]), ({3: song(3), 5: song(5), 6: song(6)}, [1, 4]))
+        cache.put_many({song_id: song(song_id) for song_id in range(10, 20)})
+        self.assertEqual(sorted(cache.get_many(range(20))[0]), [17, 18, 19])
+
+    def test_copies(self):
+        cache = SongCache(3)
+        songs = {1: song(1)}
+        cache.put_many(songs)
+        songs[1][FIELD_SONGNAME] = "changed"
+        cache.get_many([1])[0][1][FIELD_SONGNAME] = "changed"
+        self.assertEqual(cache.get_many([1]), ({1: song(1)}, []))
+
+    def test_invalidate(self):
+        cache = SongCache(10)
+        cache.put_many({song_id: song(song_id) for song_id in (1, 2, 3)})
+        cache.invalidate([2, 7])
+        self.assertEqual(cache.get_many([1, 2, 3]), ({1: song(1), 3: song(3)}, [2]))
+        cache.clear()
+        self.assertEqual(cache.get_many([1, 2, 3]), ({}, [1, 2, 3]))
+
+    def test_disabled(self):
+        for max_size in (0, None):
+            with self.subTest(max_size=max_size):
+                cache = SongCache(max_size)
+                cache.put_many({1: song(1)})
+                self.assertEqual(len(cache), 0)
+                self.assertEqual(cache.get_many([1]), ({}, [1]))
+
+
+class FakeSongsCursor(object):
+    """
+    Cursor of a database with a songs table, which answers the queries for songs by ids.
+    """
+    def __init__(self, songs, queried):
+        self.songs = songs
+        self.queried = queried
+        self.result = []
+
+    def execute(self, query, params=()):
+        self.queried.append(list(params))
+        self.result = [{FIELD_SONG_ID: song_id, **self.songs[song_id]} for song_id in params if song_id in self.songs]
+
+    def fetchall(self):
+        return self.result
+
+
+class GetSongsByIdsTest(unittest.TestCase):
+    """
+    Songs are brought from the cache, and only the ones missing from it are queried, in batches, then cached.
+    Songs not in the database are left out, and not cached.
+    """
+    def database(self, song_cache_size):
+        db = MySQLDatabase(song_cache_size=song_cache_size)
+        self.songs = {song_id: song(song_id) for song_id in range(1, 10)}
+        self.queried = []
+        db.cursor = contextmanager(lambda dictionary=False: iter([FakeSongsCursor(self.songs, self.queried)]))
+        return db
+
+    def test_misses(self):
+        db = self.database(100)
+        self.assertEqual(db.get_songs_by_ids([1, 2]), {1: song(1), 2: song(2)})
+        self.assertEqual(self.queried, [[1, 2]])
+
+        # the songs cached are not queried again, and a song deleted is left out.
+        self.queried.clear()
+        self.assertEqual(db.get_songs_by_ids([2, 3, 42, 1, 4], batch_size=2), {song_id: song(song_id)
+                                                                               for song_id in (1, 2, 3, 4)})
+        self.assertEqual(self.queried, [[3, 42], [4]])
+
+        self.queried.clear()
+        self.assertEqual(db.get_songs_by_ids([1, 2, 3, 4]), {song_id: song(song_id) for song_id in (1, 2, 3, 4)})
+        self.assertEqual(db.get_songs_by_ids([]), {})
+        self.assertEqual(self.queried, [])
+
+        # the song missing from the database is queried every time, in case it was inserted since.
+        self.assertEqual(db.get_songs_by_ids([42, 1]), {1: song(1)})
+        self.assertEqual(self.queried, [[42]])
+
+    def test_evicted(self):
+        db = self.database(2)
+        db.get_songs_by_ids([1, 2, 3])
+        self.queried.clear()
+        self.assertEqual(db.get_songs_by_ids([1, 2, 3]), {song_id: song(song_id) for song_id in (1, 2, 3)})
+        self.assertEqual(self.queried, [[1]])
+
+    def test_disabled(self):
+        db = self.database(0)
+        for _ in range(2):
+            self.assertEqual(db.get_songs_by_ids([1, 2]), {1: song(1), 2: song(2)})
+        self.assertEqual(self.queried, [[1, 2], [1, 2]])
+
+
+class FakeDatabase(object):
+    """
+    Database with the songs given, as brought by get_songs_by_ids.
+    """
+    songs = {}
+
+    def __init__(self, **options):
+        pass
+
+    def setup(self) -> None:
+        pass
+
+    def get_song_hashes(self):
+        return set()
+
+    def get_songs_by_ids(self, song_ids):
+        return {song_id: self.songs[song_id] for song_id in song_ids if song_id in self.songs}
+
+
+class AlignMatchesTest(unittest.TestCase):
+    """
+    Songs deleted between the matching of their fingerprints and the formatting of the results are left out.
+    """
+    def test_deleted_songs(self):
+        # songs 1, 2 and 3 matched, best first, but song 2 is gone.
+        matches = [(2, 7)] * 5 + [(1, 3)] * 4 + [(3, 0)] * 2
+        dedup_hashes = {1: 4, 2: 5, 3: 2}
+        with mock.patch.object(dejavu, "get_database", return_value=FakeDatabase), \
+                mock.patch.object(FakeDatabase, "songs", {1: song(1), 3: song(3)}):
+            djv = Dejavu({})
+            results = djv.align_matches(matches, dedup_hashes, queried_hashes=10, topn=3)
+            self.assertEqual([(result[SONG_ID], result[OFFSET], result[HASHES_MATCHED]) for result in results],
+                             [(1, 3, 4), (3, 0, 2)])
+
+            arrays = tuple(np.array(column, dtype=np.int64) for column in zip(*matches))
+            self.assertEqual(djv.align_matches(arrays, dedup_hashes, queried_hashes=10, topn=3), results)
+
+            with mock.patch.object(FakeDatabase, "songs", {}):
+                self.assertEqual(djv.align_matches(matches, dedup_hashes, queried_hashes=10, topn=3), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
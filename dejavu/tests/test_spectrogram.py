@@ -0,0 +1,57 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+from matplotlib import mlab
+
+import dejavu.logic.fingerprint as fingerprint
+from dejavu.config.settings import (DEFAULT_AMP_MIN, DEFAULT_FS,
+                                    DEFAULT_OVERLAP_RATIO, DEFAULT_WINDOW_SIZE)
+from dejavu.logic.fingerprint import get_2D_peaks, spectrogram
+from dejavu.tests.audio import synthetic_audio
+
+
+def reference_spectrogram(samples):
+    """
+    The spectrogram as dejavu originally computed it in float64, with mlab.specgram.
+    """
+    arr2D = mlab.specgram(samples, NFFT=DEFAULT_WINDOW_SIZE, Fs=DEFAULT_FS, window=mlab.window_hanning,
+                          noverlap=int(DEFAULT_WINDOW_SIZE * DEFAULT_OVERLAP_RATIO))[0]
+    return 10 * np.log10(arr2D, out=np.zeros_like(arr2D), where=(arr2D != 0))
+
+
+class SpectrogramTest(unittest.TestCase):
+    """
+    The spectrogram is computed in float32 from end to end, complex64 FFT included, and is the float64
+    one of mlab.specgram up to float32 rounding, with the same peaks.
+    """
+    def test_float32(self):
+        rfft = fingerprint.rfft
+        spectra = []
+
+        def transform(*args, **kwargs):
+            spectra.append(rfft(*args, **kwargs))
+            return spectra[-1]
+
+        with mock.patch.object(fingerprint, "rfft", side_effect=transform):
+            arr2D = spectrogram(synthetic_audio(3, seed=7)[0], block_frames=16)
+
+        self.assertEqual(arr2D.dtype, np.float32)
+        self.assertGreater(len(spectra), 1)
+        self.assertEqual({spectrum.dtype for spectrum in spectra}, {np.dtype(np.complex64)})
+
+    def test_reference(self):
+        for seed in range(4):
+            samples = synthetic_audio(10, seed=seed)[0]
+            expected = reference_spectrogram(samples)
+            arr2D = spectrogram(samples)
+            with self.subTest(seed=seed):
+                self.assertEqual(arr2D.shape, expected.shape)
+                loud = expected > DEFAULT_AMP_MIN
+                np.testing.assert_allclose(arr2D[loud], expected[loud], atol=1e-3)
+                np.testing.assert_allclose(arr2D, expected, atol=0.2)
+                self.assertEqual(get_2D_peaks(arr2D), get_2D_peaks(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+from scipy.io import wavfile
+
+from dejavu import Dejavu
+from dejavu.config.settings import (DEFAULT_FS, DEFAULT_OVERLAP_RATIO,
+                                    DEFAULT_WINDOW_SIZE)
+from dejavu.logic.scheduling import split_file
+from dejavu.tests.audio import synthetic_audio
+
+
+class SplitFileTest(unittest.TestCase):
+    """
+    Fingerprints of the time ranges of a split file, each one fingerprinted on its own (see decode_window),
+    are those of the whole file fingerprinted at once.
+    """
+    WSIZE = DEFAULT_WINDOW_SIZE
+    HOP = DEFAULT_WINDOW_SIZE - int(DEFAULT_WINDOW_SIZE * DEFAULT_OVERLAP_RATIO)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.file_name = os.path.join(cls.directory.name, "song.wav")
+        wavfile.write(cls.file_name, DEFAULT_FS, synthetic_audio(40, seed=8, channels=2).T)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def assert_same_as_serial(self, nparts: int, limit: int = None, start: float = None, analysis_rate: int = None,
+                              **fingerprint_options) -> None:
+        serial, _, _ = Dejavu._fingerprint_file(self.file_name, limit, start=start, analysis_rate=analysis_rate,
+                                                **fingerprint_options)
+        ranges = split_file(self.file_name, nparts, limit, self.WSIZE, self.HOP, start=start,
+                            analysis_rate=analysis_rate)
+
+        parts = []
+        for frames in ranges:
+            fingerprints, _, file_hash = Dejavu._fingerprint_file(self.file_name, limit, start=start,
+                                                                  analysis_rate=analysis_rate, frames=frames,
+                                                                  **fingerprint_options)
+            self.assertIsNone(file_hash)
+            parts.append(fingerprints)
+
+        self.assertGreater(len(ranges), 1)
+        self.assertGreater(len(serial), 0)
+        # ranges have no fingerprint in common.
+        self.assertEqual(sum(map(len, parts)), len(set().union(*parts)))
+        self.assertEqual(set().union(*parts), serial)
+
+    def test_parts(self):
+        for nparts in (2, 3, 7):
+            with self.subTest(nparts=nparts):
+                self.assert_same_as_serial(nparts)
+
+    def test_start_and_limit(self):
+        self.assert_same_as_serial(3, limit=25, start=4.5)
+
+    def test_peak_cap(self):
+        # peaks are capped in windows of frames counted from the start of the audio.
+        self.assert_same_as_serial(4, peak_cap=2)
+
+    def test_resampled(self):
+        # resampled files are not seekable, so every part is decoded from the start.
+        self.assert_same_as_serial(3, analysis_rate=22050)
+
+    def test_channels(self):
+        serial, _, _ = Dejavu._fingerprint_file(self.file_name, None)
+        channels = [Dejavu._fingerprint_file(self.file_name, None, channel=channel)[0] for channel in range(2)]
+        self.assertEqual(channels[0] | channels[1], serial)
+
+
+if __name__ == "__main__":
+    unittest.main()
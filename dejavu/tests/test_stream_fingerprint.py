@@ -0,0 +1,49 @@
+import unittest
+from itertools import chain
+
+import numpy as np
+
+from dejavu.logic.fingerprint import fingerprint, fingerprint_stream
+from dejavu.tests.audio import synthetic_audio
+
+
+class StreamFingerprintTest(unittest.TestCase):
+    """
+    Fingerprints of a channel fed in blocks (see StreamFingerprinter) are those of the whole channel.
+    """
+    def setUp(self):
+        self.samples = synthetic_audio(6, seed=4)[0]
+
+    def assert_same_as_whole(self, block_size: int, **options) -> None:
+        expected = fingerprint(self.samples, **options)
+        blocks = (self.samples[index: index + block_size] for index in range(0, len(self.samples), block_size))
+        streamed = list(chain.from_iterable(fingerprint_stream(blocks, **options)))
+
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(len(streamed), len(set(streamed)))
+        self.assertEqual(set(streamed), set(expected))
+
+    def test_block_sizes(self):
+        # blocks smaller than a window, not a multiple of the hop, and larger than the whole channel.
+        for block_size in (1000, 4096, 44100, 10 ** 7):
+            with self.subTest(block_size=block_size):
+                self.assert_same_as_whole(block_size)
+
+    def test_peak_cap(self):
+        self.assert_same_as_whole(10000, peak_cap=3)
+
+    def test_hash_format(self):
+        self.assert_same_as_whole(10000, hash_format="int64")
+
+    def test_shorter_than_a_window(self):
+        samples = self.samples[:3000]
+        streamed = list(chain.from_iterable(fingerprint_stream([samples[:1000], samples[1000:]])))
+        self.assertEqual(set(streamed), set(fingerprint(samples)))
+
+    def test_empty(self):
+        streamed = list(chain.from_iterable(fingerprint_stream([np.empty(0, dtype=np.int16)])))
+        self.assertEqual(streamed, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
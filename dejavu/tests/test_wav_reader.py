@@ -0,0 +1,199 @@
+import os
+import struct
+import tempfile
+import unittest
+from hashlib import sha1
+
+import numpy as np
+from scipy.io import wavfile
+
+import dejavu.logic.decoder as decoder
+from dejavu.logic.wav_reader import (WAVE_FORMAT_EXTENSIBLE,
+                                     WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM,
+                                     WavFormatError, WavReader)
+
+FS = 8000
+
+
+def chunk(chunk_id: bytes, body: bytes) -> bytes:
+    """
+    A RIFF chunk, with the pad byte of odd sized ones.
+    """
+    return chunk_id + struct.pack("<I", len(body)) + body + b"\0" * (len(body) % 2)
+
+
+def fmt_chunk(format_tag: int, channels: int, sampwidth: int, extensible: bool = False) -> bytes:
+    body = struct.pack("<HHIIHH", WAVE_FORMAT_EXTENSIBLE if extensible else format_tag, channels, FS,
+                       FS * channels * sampwidth, channels * sampwidth, sampwidth * 8)
+    if extensible:
+        # the sub format GUID starts with the actual format tag.
+        body += struct.pack("<HHIH", 22, sampwidth * 8, 0, format_tag) + bytes(14)
+    return chunk(b"fmt ", body)
+
+
+def wav_bytes(data: bytes, format_tag: int, channels: int, sampwidth: int, extensible: bool = False,
+              before: bytes = b"", after: bytes = b"") -> bytes:
+    """
+    A wav file with the given chunks before and after its data chunk.
+    """
+    chunks = fmt_chunk(format_tag, channels, sampwidth, extensible) + before + chunk(b"data", data) + after
+    return b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WAVE" + chunks
+
+
+def encode(samples: np.ndarray, sampwidth: int, floating: bool = False) -> bytes:
+    """
+    Little endian bytes of frames by channels of samples in [-1, 1), in the wav encoding of that width.
+    """
+    if floating:
+        return samples.astype(f"<f{sampwidth}").tobytes()
+    if sampwidth == 1:
+        return (np.round(samples * 127) + 128).astype(np.uint8).tobytes()
+    values = np.round(samples * (2 ** (8 * sampwidth - 1) - 1)).astype("<i4" if sampwidth > 2 else "<i2")
+    if sampwidth == 3:
+        return values.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    return values.tobytes()
+
+
+def to_int16(samples: np.ndarray) -> np.ndarray:
+    """
+    16 bit samples from what scipy.io.wavfile reads: the most significant bits of integer samples
+    (scipy left justifies 24 bit samples into 32 bits) and float samples scaled by 2 ** 15.
+    """
+    if samples.dtype == np.uint8:
+        return ((samples.astype(np.int16) - 128) << 8).astype(np.int16)
+    if samples.dtype == np.int16:
+        return samples
+    if samples.dtype == np.int32:
+        return (samples >> 16).astype(np.int16)
+    return np.clip(np.rint(samples.astype(np.float64) * 32768), -32768, 32767).astype(np.int16)
+
+
+class WavReaderTest(unittest.TestCase):
+    """
+    The 16 bit samples WavReader maps are those scipy.io.wavfile reads, for every encoding it supports,
+    whole, in windows or in blocks, and the hash it computes on the way is the one of the whole file.
+    """
+    FORMATS = [(WAVE_FORMAT_PCM, 1), (WAVE_FORMAT_PCM, 2), (WAVE_FORMAT_PCM, 3), (WAVE_FORMAT_PCM, 4),
+               (WAVE_FORMAT_IEEE_FLOAT, 4), (WAVE_FORMAT_IEEE_FLOAT, 8)]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.rng = np.random.RandomState(0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, content: bytes, name: str = "song.wav") -> str:
+        file_name = os.path.join(self.directory.name, name)
+        with open(file_name, "wb") as f:
+            f.write(content)
+        return file_name
+
+    def samples(self, nframes: int, channels: int) -> np.ndarray:
+        return self.rng.uniform(-1, 1, size=(nframes, channels))
+
+    def assert_same_as_scipy(self, file_name: str, chunk_frames: int = 2**18, reference: str = None) -> None:
+        # scipy does not read WAVE_FORMAT_EXTENSIBLE files, which are compared to the same data in a plain one.
+        _, expected = wavfile.read(reference or file_name)
+        expected = to_int16(expected.reshape(len(expected), -1))
+        reader = WavReader(file_name, chunk_frames=chunk_frames)
+
+        self.assertEqual(reader.fs, FS)
+        self.assertEqual(reader.nframes, len(expected))
+        np.testing.assert_array_equal(reader.read(), expected)
+
+        for start, limit in [(0.1, 0.25), (0.0, 0.01), (0.3, None), (0.123, 0.0457), (10, 1), (0.5, 10)]:
+            first = min(int(round(start * FS)), len(expected))
+            last = len(expected) if limit is None else min(first + int(round(limit * FS)), len(expected))
+            with self.subTest(start=start, limit=limit):
+                np.testing.assert_array_equal(reader.read(start=start, limit=limit), expected[first:last])
+
+                file_hash = sha1()
+                blocks = list(reader.blocks(333, start=start, limit=limit, sha1_hash=file_hash))
+                self.assertTrue(all(len(block) == 333 for block in blocks[:-1]))
+                np.testing.assert_array_equal(np.concatenate(blocks or [expected[:0]]), expected[first:last])
+                self.assertEqual(file_hash.hexdigest().upper(), decoder.unique_hash(file_name))
+
+        file_hash = sha1()
+        reader.read(start=0.2, limit=0.1, sha1_hash=file_hash)
+        self.assertEqual(file_hash.hexdigest().upper(), decoder.unique_hash(file_name))
+
+    def test_formats(self):
+        for format_tag, sampwidth in self.FORMATS:
+            for channels in (1, 2):
+                for extensible in (False, True):
+                    samples = self.samples(4001, channels)
+                    data = encode(samples, sampwidth, floating=format_tag == WAVE_FORMAT_IEEE_FLOAT)
+                    file_name = self.write(wav_bytes(data, format_tag, channels, sampwidth, extensible))
+                    reference = self.write(wav_bytes(data, format_tag, channels, sampwidth), "reference.wav")
+                    with self.subTest(format_tag=format_tag, sampwidth=sampwidth, channels=channels,
+                                      extensible=extensible):
+                        # in chunks smaller than the windows too.
+                        self.assert_same_as_scipy(file_name, reference=reference)
+                        self.assert_same_as_scipy(file_name, chunk_frames=100, reference=reference)
+
+    def test_scipy_written(self):
+        for dtype in (np.uint8, np.int16, np.int32, np.float32):
+            samples = self.samples(3000, 2)
+            if dtype == np.uint8:
+                samples = (samples * 127 + 128).astype(dtype)
+            elif dtype != np.float32:
+                samples = (samples * np.iinfo(dtype).max).astype(dtype)
+            file_name = os.path.join(self.directory.name, "scipy.wav")
+            wavfile.write(file_name, FS, samples.astype(dtype))
+            with self.subTest(dtype=dtype):
+                self.assert_same_as_scipy(file_name)
+
+    def test_odd_sized_chunks(self):
+        # word aligned chunks of an odd size before and after an odd sized data chunk.
+        samples = self.samples(1001, 1)
+        before = chunk(b"LIST", b"odd") + chunk(b"fact", struct.pack("<I", 1001))
+        file_name = self.write(wav_bytes(encode(samples, 1), WAVE_FORMAT_PCM, 1, 1, before=before,
+                                         after=chunk(b"junk", b"x" * 7)))
+        self.assert_same_as_scipy(file_name)
+        self.assertEqual(WavReader(file_name).nframes, 1001)
+
+    def test_empty(self):
+        file_name = self.write(wav_bytes(b"", WAVE_FORMAT_PCM, 2, 2))
+        reader = WavReader(file_name)
+        self.assertEqual(reader.nframes, 0)
+        self.assertEqual(reader.read().shape, (0, 2))
+        self.assertEqual(list(reader.blocks(100)), [])
+
+    def test_truncated_data(self):
+        # files being written have less data than their header says, and may end within a frame.
+        samples = self.samples(2000, 2)
+        content = wav_bytes(encode(samples, 3), WAVE_FORMAT_PCM, 2, 3)
+        file_name = self.write(content[:len(content) - 1000 * 6 - 4])
+
+        reader = WavReader(file_name)
+        self.assertEqual(reader.nframes, 999)
+        full = WavReader(self.write(content, "full.wav"))
+        np.testing.assert_array_equal(reader.read(), full.read()[:999])
+
+    def test_malformed_headers(self):
+        data = encode(self.samples(100, 1), 2)
+        content = wav_bytes(data, WAVE_FORMAT_PCM, 1, 2)
+        fmt = fmt_chunk(WAVE_FORMAT_PCM, 1, 2)
+        malformed = {
+            "empty": b"",
+            "truncated riff": content[:10],
+            "not riff": b"RIFX" + content[4:],
+            "not wave": content[:8] + b"AVI " + content[12:],
+            "truncated fmt": content[:12 + len(fmt) - 10],
+            "short fmt": b"RIFF" + struct.pack("<I", 0) + b"WAVE" + chunk(b"fmt ", fmt[8:16]) + chunk(b"data", data),
+            "no fmt": b"RIFF" + struct.pack("<I", 0) + b"WAVE" + chunk(b"data", data),
+            "no data": b"RIFF" + struct.pack("<I", 0) + b"WAVE" + fmt + chunk(b"LIST", b"info"),
+            "no channels": wav_bytes(data, WAVE_FORMAT_PCM, 0, 2),
+            "a-law": wav_bytes(data, 6, 1, 1),
+            "12 bit float": wav_bytes(data, WAVE_FORMAT_IEEE_FLOAT, 1, 2),
+            "40 bit": wav_bytes(data, WAVE_FORMAT_PCM, 1, 5),
+        }
+        for name, content in malformed.items():
+            file_name = self.write(content)
+            with self.subTest(name=name), self.assertRaises(WavFormatError):
+                WavReader(file_name)
+
+
+if __name__ == "__main__":
+    unittest.main()